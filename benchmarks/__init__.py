@@ -0,0 +1,5 @@
+""" Benchmarks of Plim.
+
+``python -m benchmarks.compile`` measures compilation of synthetic templates
+(see :mod:`benchmarks.generators`).
+"""
@@ -0,0 +1,202 @@
+""" Compile-time benchmark of :func:`plim.lexer.compile_plim_source`.
+
+Compiles the templates of :mod:`benchmarks.generators` of several sizes with Mako and Django syntaxes,
+and reports lines per second and peak memory of every run. Every timed run starts with a new syntax
+and empty caches (cold), and is followed by another compilation with the same syntax (warm),
+which takes the memoized snippets of embedded markup and the compiled blocks of markup languages from its caches. The time of every input class must grow
+linearly with its size: the classes with a greater exponent of growth are reported, and the exit status
+is 1 then. Results may be saved as JSON and compared with the results of a previous run::
+
+    $ python -m benchmarks.compile -o before.json
+    $ python -m benchmarks.compile -c before.json
+"""
+import argparse
+import functools
+import gc
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from plim import syntax as available_syntax
+from plim.cache import LRUCache, plim_version
+from plim.lexer import compile_plim_source
+
+from .generators import GENERATORS
+
+
+SYNTAXES = {
+    'mako': available_syntax.Mako,
+    'django': available_syntax.Django,
+}
+
+
+def new_syntax(name: str) -> Any:
+    """ Returns a new instance of a syntax of :data:`SYNTAXES` with its own empty cache of markup blocks,
+    so that its compilations don't depend on the ones that have run before.
+    """
+    syntax = SYNTAXES[name]()
+    syntax.markup_caches = (LRUCache(),)
+    return syntax
+
+
+def measure_time(source: str, syntax_factory: Callable[[], Any], repeat: int) -> Tuple[float, float]:
+    """ Returns 2-tuple of the best times of ``repeat`` cold and warm compilations of the source, in seconds.
+    A cold compilation uses a new syntax returned by ``syntax_factory``, and a warm one uses the same syntax again.
+    """
+    best_cold = best_warm = float('inf')
+    for _ in range(repeat):
+        syntax = syntax_factory()
+        gc.collect()
+        started_at = time.perf_counter()
+        compile_plim_source(source, syntax)
+        best_cold = min(best_cold, time.perf_counter() - started_at)
+        gc.collect()
+        started_at = time.perf_counter()
+        compile_plim_source(source, syntax)
+        best_warm = min(best_warm, time.perf_counter() - started_at)
+    return best_cold, best_warm
+
+
+def measure_peak_memory(source: str, syntax: Any) -> int:
+    """ Returns the peak size of memory blocks allocated by a compilation of the source, in bytes.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        compile_plim_source(source, syntax)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def scaling_exponent(points: Sequence[Tuple[int, float]]) -> float:
+    """ Returns ``k`` of the least-squares fit of ``seconds = c * size ** k`` to the points.
+    """
+    xs = [math.log(size) for size, _ in points]
+    ys = [math.log(max(seconds, 1e-9)) for _, seconds in points]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if not variance:
+        return 1.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+
+def run(sizes: Sequence[int], generators: Sequence[str], syntaxes: Sequence[str], repeat: int = 3,
+        max_exponent: float = 1.3, memory: bool = True) -> Dict[str, Any]:
+    """ Runs the benchmark and returns its results.
+
+    :param sizes: numbers of lines of the generated templates
+    :param generators: names of :data:`benchmarks.generators.GENERATORS`
+    :param syntaxes: names of :data:`SYNTAXES`
+    :param repeat: number of cold and warm compilations of every template. The best times are reported.
+    :param max_exponent: the greatest exponent of growth of time with size that is considered linear
+    :param memory: whether to measure peak memory (it takes another compilation under tracemalloc)
+    """
+    results: List[Dict[str, Any]] = []
+    scaling: List[Dict[str, Any]] = []
+    for syntax_name in syntaxes:
+        syntax_factory = functools.partial(new_syntax, syntax_name)
+        for generator_name in generators:
+            points = []
+            for size in sizes:
+                source = GENERATORS[generator_name](size)
+                lines = source.count('\n') + 1
+                seconds, warm_seconds = measure_time(source, syntax_factory, repeat)
+                points.append((lines, seconds))
+                results.append({
+                    'generator': generator_name,
+                    'syntax': syntax_name,
+                    'size': size,
+                    'lines': lines,
+                    'bytes': len(source.encode('utf-8')),
+                    'seconds': seconds,
+                    'lines_per_second': lines / seconds if seconds else None,
+                    'warm_seconds': warm_seconds,
+                    'warm_lines_per_second': lines / warm_seconds if warm_seconds else None,
+                    'peak_memory': measure_peak_memory(source, syntax_factory()) if memory else None,
+                })
+            if len(points) > 1:
+                exponent = scaling_exponent(points)
+                scaling.append({
+                    'generator': generator_name,
+                    'syntax': syntax_name,
+                    'exponent': exponent,
+                    'superlinear': exponent > max_exponent,
+                })
+    return {
+        'plim_version': plim_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'repeat': repeat,
+        'max_exponent': max_exponent,
+        'results': results,
+        'scaling': scaling,
+    }
+
+
+def format_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    """ Returns a human-readable table of the results. When a ``baseline`` report is given,
+    every row shows the change of cold throughput against the same row of the baseline.
+    """
+    baseline_rows = {}
+    if baseline is not None:
+        baseline_rows = dict(
+            ((row['generator'], row['syntax'], row['size']), row) for row in baseline['results']
+        )
+    buf = ['{:<16} {:<7} {:>7} {:>12} {:>12} {:>12} {:>9}'.format(
+        'generator', 'syntax', 'lines', 'lines/sec', 'warm l/sec', 'peak memory', 'change'
+    )]
+    for row in report['results']:
+        change = ''
+        previous = baseline_rows.get((row['generator'], row['syntax'], row['size']))
+        if previous is not None and previous['lines_per_second'] and row['lines_per_second']:
+            change = '{:+.1%}'.format(row['lines_per_second'] / previous['lines_per_second'] - 1)
+        memory = row['peak_memory']
+        buf.append('{:<16} {:<7} {:>7} {:>12,.0f} {:>12,.0f} {:>12} {:>9}'.format(
+            row['generator'], row['syntax'], row['lines'], row['lines_per_second'] or 0,
+            row.get('warm_lines_per_second') or 0,
+            '{:,.1f} KiB'.format(memory / 1024) if memory is not None else '-', change
+        ))
+    for item in report['scaling']:
+        if item['superlinear']:
+            buf.append('SUPERLINEAR: {generator} ({syntax}) time grows as size ** {exponent:.2f}'.format(**item))
+    return '\n'.join(buf)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.compile', description='Compile-time benchmark of Plim.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[250, 500, 1000, 2000],
+                        help='numbers of lines of the generated templates')
+    parser.add_argument('-g', '--generators', nargs='+', choices=sorted(GENERATORS), default=sorted(GENERATORS),
+                        help='input classes to benchmark (all by default)')
+    parser.add_argument('--syntax', nargs='+', choices=sorted(SYNTAXES), default=['mako', 'django'],
+                        dest='syntaxes', help='target syntaxes (both by default)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='cold and warm compilations of every template (3 of each by default)')
+    parser.add_argument('--max-exponent', type=float, default=1.3,
+                        help='the greatest exponent of growth of time with size that is considered linear (1.3)')
+    parser.add_argument('--no-memory', action='store_false', dest='memory', help="don't measure peak memory")
+    parser.add_argument('-o', '--output', help='save the results as JSON to this file')
+    parser.add_argument('-c', '--compare', help='compare the results with the JSON results of a previous run')
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.generators, args.syntaxes, args.repeat, args.max_exponent, args.memory)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 1 if any(item['superlinear'] for item in report['scaling']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+""" Generators of synthetic templates that stress different parts of the lexer.
+
+Every generator accepts the approximate number of lines of the template and returns its source.
+The sources are valid for both Mako and Django syntaxes.
+"""
+from typing import Callable, Dict, List
+
+
+def deep_nesting(size: int, depth: int = 40) -> str:
+    """ Chains of nested tags and statements, ``depth`` levels deep.
+    """
+    buf: List[str] = []
+    while len(buf) < size:
+        for level in range(depth):
+            indent = '  ' * level
+            if level % 3 == 0:
+                buf.append('{}-if x{}'.format(indent, level))
+            elif level % 3 == 1:
+                buf.append('{}div.level-{}#n{}'.format(indent, level, len(buf)))
+            else:
+                buf.append('{}-for i{} in items'.format(indent, level))
+        buf.append('  ' * depth + 'p = value')
+    return '\n'.join(buf[:size])
+
+
+def wide_attributes(size: int, width: int = 30) -> str:
+    """ Tags with ``width`` attributes each: static, dynamic, boolean, and multi-line ones.
+    """
+    buf: List[str] = []
+    for i in range(size):
+        attrs = []
+        for j in range(width):
+            kind = j % 4
+            if kind == 0:
+                attrs.append('data-a{}="value {}"'.format(j, i))
+            elif kind == 1:
+                attrs.append('a{}=${{item.v{}}}'.format(j, j))
+            elif kind == 2:
+                attrs.append('b{}=flag{}?'.format(j, j))
+            else:
+                attrs.append('c{}=fn(a, {})'.format(j, j))
+        buf.append('input.field#f{}({}) = label'.format(i, ' '.join(attrs)))
+    return '\n'.join(buf)
+
+
+def long_literals(size: int, block_lines: int = 50) -> str:
+    """ Explicit literal blocks of ``block_lines`` lines with variables in them.
+    """
+    buf: List[str] = []
+    while len(buf) < size:
+        buf.append('p')
+        buf.append('  | Paragraph {} starts here,'.format(len(buf)))
+        for i in range(block_lines - 2):
+            buf.append('    and goes on with ${{value}} and more words on the line number {}.'.format(i))
+    return '\n'.join(buf[:size])
+
+
+def embedded_markup(size: int) -> str:
+    """ Literals with inline tags in backticks, some of which are not valid plim markup.
+    """
+    buf: List[str] = []
+    for i in range(size):
+        buf.append(
+            'p Read `a href="/page/{0}" the page {0}`_, `b.note bold` text, '
+            'or `*just quotes*`, and ``escaped`` ones `span = value`'.format(i % 50)
+        )
+    return '\n'.join(buf)
+
+
+def if_chains(size: int, branches: int = 10) -> str:
+    """ ``-if/-elif/-else`` chains of ``branches`` branches.
+    """
+    buf: List[str] = []
+    while len(buf) < size:
+        buf.append('-if value == 0')
+        buf.append('  p zero')
+        for i in range(1, branches):
+            buf.append('-elif value == {}'.format(i))
+            buf.append('  span.branch-{0} = {0}'.format(i))
+        buf.append('-else')
+        buf.append('  p other')
+    return '\n'.join(buf[:size])
+
+
+def python_blocks(size: int, block_lines: int = 100) -> str:
+    """ ``-py`` blocks of ``block_lines`` lines.
+    """
+    buf: List[str] = []
+    while len(buf) < size:
+        buf.append('-py')
+        for i in range(block_lines - 1):
+            buf.append('  x{0} = compute({0}, "{0}") if value else None'.format(i))
+    return '\n'.join(buf[:size])
+
+
+GENERATORS: Dict[str, Callable[[int], str]] = {
+    'deep_nesting': deep_nesting,
+    'wide_attributes': wide_attributes,
+    'long_literals': long_literals,
+    'embedded_markup': embedded_markup,
+    'if_chains': if_chains,
+    'python_blocks': python_blocks,
+}
+
@@ -0,0 +1,268 @@
+""" Render-time benchmark of the Mako code that Plim generates.
+
+Every case of :data:`CASES` is a Plim template of ``benchmarks/templates`` and an equivalent
+Mako template written by hand, rendered with the same context. The Plim template goes through
+:func:`plim.preprocessor` and :class:`mako.template.Template`, as it does in applications, and both
+templates are reported side by side: renders per second, the size of the generated Python module,
+and the number of ``__M_writer`` calls in the module and in one render. Both templates must produce
+the same markup, whitespace aside.
+
+The templates of ``tests/fixtures`` have no contexts to render, so only the size of their modules
+is reported with ``--fixtures``. Results may be saved as JSON and compared with the results
+of a previous run::
+
+    $ python -m benchmarks.render -o before.json
+    $ python -m benchmarks.render -c before.json
+"""
+import argparse
+import gc
+import glob
+import json
+import os
+import platform
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from mako.runtime import Context
+from mako.template import Template
+
+from plim import preprocessor
+from plim.cache import plim_version
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'fixtures')
+
+WRITER = '__M_writer('
+
+
+def item_list_context(size: int) -> Dict[str, Any]:
+    return {'items': [
+        SimpleNamespace(
+            id=i, cls='odd' if i % 2 else 'even', done=i % 3 == 0, title='Item #{}'.format(i),
+            author='user{}'.format(i % 7), attrs={'title': 'Item {}'.format(i), 'tabindex': i}
+        ) for i in range(size)
+    ]}
+
+
+def form_context(size: int) -> Dict[str, Any]:
+    return {'fields': [
+        SimpleNamespace(
+            name='option{}'.format(i), label='Option {}'.format(i), checked=i % 2 == 0,
+            disabled=i % 5 == 0, help='Help on option {}'.format(i) if i % 4 == 0 else None
+        ) for i in range(size)
+    ]}
+
+
+def article_context(size: int) -> Dict[str, Any]:
+    return {
+        'title': 'Render-time benchmark',
+        'author': 'Plim',
+        'date': '2026-10-18',
+        'paragraphs': ['Paragraph {} of the article. '.format(i) * 8 for i in range(size)],
+    }
+
+
+def table_context(size: int) -> Dict[str, Any]:
+    columns = ['Column {}'.format(i) for i in range(8)]
+    return {
+        'columns': columns,
+        'rows': [[i * len(columns) + j for j in range(len(columns))] for i in range(size)],
+    }
+
+
+# Names of the templates of ``benchmarks/templates``, and factories of their contexts of a given size.
+CASES: Dict[str, Callable[[int], Dict[str, Any]]] = {
+    'item_list': item_list_context,
+    'form': form_context,
+    'article': article_context,
+    'table': table_context,
+}
+
+
+class CountingBuffer(object):
+    """ An output buffer of a Mako context that counts the calls of its ``write()``.
+    """
+    def __init__(self):
+        self.data: List[str] = []
+        self.writes = 0
+
+    def write(self, text: str) -> None:
+        self.writes += 1
+        self.data.append(text)
+
+    def getvalue(self) -> str:
+        return ''.join(self.data)
+
+
+def read_template(name: str, extension: str) -> str:
+    with open(os.path.join(TEMPLATES_DIR, name + extension), encoding='utf-8') as f:
+        return f.read()
+
+
+def count_writes(template: Template, context: Dict[str, Any]) -> CountingBuffer:
+    """ Renders the template with the context and returns the buffer of the output.
+    """
+    buf = CountingBuffer()
+    template.render_context(Context(buf, **context))
+    return buf
+
+
+def measure_renders_per_second(template: Template, context: Dict[str, Any], repeat: int,
+                               min_seconds: float = 0.05) -> float:
+    """ Returns the best rate of ``repeat`` runs of renders, where every run renders the template
+    for at least ``min_seconds``.
+    """
+    best = 0.0
+    for _ in range(repeat):
+        gc.collect()
+        renders = 0
+        started_at = time.perf_counter()
+        while True:
+            template.render(**context)
+            renders += 1
+            seconds = time.perf_counter() - started_at
+            if seconds >= min_seconds:
+                break
+        best = max(best, renders / seconds)
+    return best
+
+
+def module_metrics(template: Template) -> Dict[str, int]:
+    return {
+        'module_size': len(template.code.encode('utf-8')),
+        'writer_calls': template.code.count(WRITER),
+    }
+
+
+def _normalized(text: str) -> str:
+    return ''.join(text.split())
+
+
+def run(cases: Sequence[str], size: int = 50, repeat: int = 3, min_seconds: float = 0.05,
+        fixtures: bool = False) -> Dict[str, Any]:
+    """ Runs the benchmark and returns its results.
+
+    :param cases: names of :data:`CASES`
+    :param size: number of items of the collections of the contexts
+    :param repeat: number of runs of renders of every template. The best rate is reported.
+    :param min_seconds: the least duration of a run
+    :param fixtures: whether to report the modules of the templates of ``tests/fixtures``
+    """
+    results: List[Dict[str, Any]] = []
+    for name in cases:
+        context = CASES[name](size)
+        outputs = {}
+        for variant, template in (
+            ('plim', Template(preprocessor(read_template(name, '.plim')))),
+            ('mako', Template(read_template(name, '.mako'))),
+        ):
+            buf = count_writes(template, context)
+            outputs[variant] = buf.getvalue()
+            row = {
+                'case': name,
+                'variant': variant,
+                'size': size,
+                'renders_per_second': measure_renders_per_second(template, context, repeat, min_seconds),
+                'render_writes': buf.writes,
+                'output_size': len(outputs[variant].encode('utf-8')),
+            }
+            row.update(module_metrics(template))
+            results.append(row)
+        if _normalized(outputs['plim']) != _normalized(outputs['mako']):
+            raise AssertionError('The templates of the case "{}" render different markup'.format(name))
+
+    fixture_results: List[Dict[str, Any]] = []
+    if fixtures:
+        for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*_test.plim'))):
+            with open(path, encoding='utf-8') as f:
+                source = f.read()
+            try:
+                template = Template(preprocessor(source))
+            except Exception as e:
+                # fixtures of the syntax errors and of the markup languages without their compilers
+                fixture_results.append({'fixture': os.path.basename(path), 'error': type(e).__name__})
+                continue
+            row = {'fixture': os.path.basename(path)}
+            row.update(module_metrics(template))
+            fixture_results.append(row)
+
+    return {
+        'plim_version': plim_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'repeat': repeat,
+        'results': results,
+        'fixtures': fixture_results,
+    }
+
+
+def format_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    """ Returns a human-readable table of the results. Every Plim row shows its rate relative
+    to the hand-written template of the same case, and when a ``baseline`` report is given,
+    every row shows the change of its rate against the same row of the baseline.
+    """
+    baseline_rows = {}
+    if baseline is not None:
+        baseline_rows = dict(((row['case'], row['variant']), row) for row in baseline['results'])
+    rows = dict(((row['case'], row['variant']), row) for row in report['results'])
+    buf = ['{:<10} {:<7} {:>12} {:>9} {:>12} {:>9} {:>9} {:>9}'.format(
+        'case', 'variant', 'renders/sec', 'vs mako', 'module size', 'writers', 'writes', 'change'
+    )]
+    for row in report['results']:
+        relative = ''
+        hand_written = rows.get((row['case'], 'mako'))
+        if row['variant'] != 'mako' and hand_written is not None:
+            relative = '{:.2f}x'.format(row['renders_per_second'] / hand_written['renders_per_second'])
+        change = ''
+        previous = baseline_rows.get((row['case'], row['variant']))
+        if previous is not None and previous['renders_per_second']:
+            change = '{:+.1%}'.format(row['renders_per_second'] / previous['renders_per_second'] - 1)
+        buf.append('{:<10} {:<7} {:>12,.0f} {:>9} {:>12,} {:>9} {:>9} {:>9}'.format(
+            row['case'], row['variant'], row['renders_per_second'], relative,
+            row['module_size'], row['writer_calls'], row['render_writes'], change
+        ))
+    if report['fixtures']:
+        buf.append('')
+        buf.append('{:<36} {:>12} {:>9}'.format('fixture', 'module size', 'writers'))
+        for row in report['fixtures']:
+            if 'error' in row:
+                buf.append('{:<36} {:>22}'.format(row['fixture'], row['error']))
+            else:
+                buf.append('{:<36} {:>12,} {:>9}'.format(row['fixture'], row['module_size'], row['writer_calls']))
+    return '\n'.join(buf)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.render',
+                                     description='Render-time benchmark of the Mako code generated by Plim.')
+    parser.add_argument('-k', '--cases', nargs='+', choices=sorted(CASES), default=sorted(CASES),
+                        help='templates to benchmark (all by default)')
+    parser.add_argument('-s', '--size', type=int, default=50,
+                        help='number of items of the collections of the contexts (50 by default)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of renders of every template (3 by default)')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='the least duration of a run of renders (0.05 by default)')
+    parser.add_argument('--fixtures', action='store_true',
+                        help='report the modules of the templates of tests/fixtures as well')
+    parser.add_argument('-o', '--output', help='save the results as JSON to this file')
+    parser.add_argument('-c', '--compare', help='compare the results with the JSON results of a previous run')
+    args = parser.parse_args(argv)
+
+    report = run(args.cases, args.size, args.repeat, args.min_seconds, args.fixtures)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+<!DOCTYPE html><html><head><meta charset="utf-8"/><title>${title}</title></head><body><header id="top"><nav><ul><li><a href="/">Home</a></li><li><a href="/blog">Blog</a></li><li><a href="/about">About</a></li></ul></nav></header><article><h1>${title}</h1><p class="byline">Posted by${author} on${date} </p>
+% for paragraph in paragraphs:
+<p>${paragraph}</p>
+% endfor
+<footer><p>Comments are closed.</p></footer></article></body></html>
@@ -0,0 +1,9 @@
+<form action="/settings" method="post" id="settings">
+% for field in fields:
+<div class="field"><label for="${field.name}">${field.label}</label><input type="checkbox" name="${field.name}" id="${field.name}"${' checked="checked"' if field.checked else ''|n}${' disabled="disabled"' if field.disabled else ''|n}/>
+    % if field.help:
+<p class="help">${field.help}</p>
+    % endif
+</div>
+% endfor
+<button type="submit">Save</button></form>
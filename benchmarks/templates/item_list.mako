@@ -0,0 +1,5 @@
+<ul id="items">
+% for item in items:
+<li data-id="${item.id}"${' checked="checked"' if item.done else ''|n}${''.join(' %s="%s"' % kv for kv in item.attrs.items())|n} class="item ${item.cls}"><a href="/items/${item.id}">${item.title}</a>Created by<span class="author">${item.author}</span></li>
+% endfor
+</ul>
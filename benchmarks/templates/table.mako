@@ -0,0 +1,13 @@
+<table class="data"><thead><tr>
+% for column in columns:
+<th>${column}</th>
+% endfor
+</tr></thead><tbody>
+% for row in rows:
+<tr>
+    % for cell in row:
+<td>${cell}</td>
+    % endfor
+</tr>
+% endfor
+</tbody></table>
@@ -1,18 +1,42 @@
 import functools
-from typing import Mapping, Type, Sequence, Any, Callable
+from typing import Mapping, Type, Sequence, Any, Callable, Optional
 
 from pyrsistent import v
 
-from .lexer import compile_plim_source
+from .lexer import compile_plim_source, Limits
+from .lexer import compile_stream as _compile_stream
 from . import syntax as available_syntax
+from . import cache as _cache
+from . import incremental as _incremental
 
 
-def preprocessor_factory(custom_parsers: Sequence[Any] = v(), syntax: str = 'mako') -> Callable[[str, bool], str]:
+def preprocessor_factory(custom_parsers: Sequence[Any] = v(), syntax: str = 'mako',
+                         cache_size: int = 0, cache_max_bytes: Optional[int] = None,
+                         cache_dir: Optional[str] = None,
+                         segment_cache_size: int = 0, markup_executor: Any = None,
+                         limits: Optional[Limits] = None) -> Callable[[str, bool], str]:
     """
 
     :param custom_parsers: a list of 2-tuples of (parser_regex, parser_callable) or None
     :type custom_parsers: list or None
     :param syntax: name of the target template engine ('mako' by default)
+    :param cache_size: maximum number of compiled templates kept in memory. The preprocessor doesn't cache
+                       templates by default. The cache and its counters are available
+                       as ``preprocessor.cache`` (see :class:`plim.cache.LRUCache`).
+    :param cache_max_bytes: maximum total size of the compiled templates kept in memory
+    :param cache_dir: path to a directory where compiled templates are stored persistently. The directory
+                      may be shared by many processes (see :class:`plim.cache.DiskCache`).
+    :param segment_cache_size: maximum number of compiled top-level blocks kept in memory. When it is set,
+                               the preprocessor recompiles only the blocks of a template that have been
+                               changed since the previous compilation. The compiler is available
+                               as ``preprocessor.compiler``
+                               (see :class:`plim.incremental.IncrementalCompiler`).
+    :param markup_executor: a thread or process pool from :mod:`concurrent.futures`. When it is set,
+                            blocks of markup languages (``-scss``, ``-coffee``, ``-md``, etc.)
+                            are compiled by the pool while the rest of a template is being parsed.
+    :param limits: limits on the size of a template, the length of its lines, the depth of its nesting,
+                   and the time of its compilation (see :class:`plim.lexer.Limits`). A template that exceeds
+                   a limit fails with :class:`plim.errors.CompileLimitExceeded`.
     :return: preprocessor instance
     """
     syntax_choices: Mapping[str, Type[available_syntax.BaseSyntax]] = {
@@ -20,10 +44,25 @@ def preprocessor_factory(custom_parsers: Sequence[Any] = v(), syntax: str = 'mak
         'django': available_syntax.Django,
     }
     selected_syntax = syntax_choices[syntax](custom_parsers or v())
-    return functools.partial(compile_plim_source, syntax=selected_syntax)
+    selected_syntax.markup_executor = markup_executor
+    if segment_cache_size:
+        compiler = _incremental.IncrementalCompiler(selected_syntax, segment_cache_size)
+        preprocessor = functools.partial(_incremental.compile_incremental, syntax=selected_syntax,
+                                         compiler=compiler, limits=limits)
+        preprocessor.compiler = compiler  # type: ignore
+    else:
+        preprocessor = functools.partial(compile_plim_source, syntax=selected_syntax, limits=limits)
+    # ``preprocessor.stream(source_or_fileobj, sink)`` is a streaming counterpart of the preprocessor.
+    # See :func:`plim.lexer.compile_stream` for details.
+    preprocessor.stream = functools.partial(_compile_stream, syntax=selected_syntax, limits=limits)  # type: ignore
+    return _cache.cached_preprocessor(preprocessor, cache_size, cache_max_bytes, cache_dir)
 
 
 # ``preprocessor`` is a public object that always follows Mako's preprocessor API.
 # Do not use ``compile_plim_source`` in your projects, because its signature
 # may be changed in the future.
 preprocessor = preprocessor_factory()
+
+# ``compile_stream(source_or_fileobj, sink)`` compiles a template with the default preprocessor
+# and writes the result to ``sink`` (a text file object or a callable) chunk by chunk.
+compile_stream = preprocessor.stream  # type: ignore
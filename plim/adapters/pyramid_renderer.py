@@ -9,8 +9,11 @@ except ImportError:
         "To do so, please install Pyramid>=1.5 and pyramid_mako>=0.3.1 template bindings."
     )
 
+from ..cache import cached_preprocessor
 
-def add_plim_renderer(config, extension, mako_settings_prefix='mako.', preprocessor='plim.preprocessor'):
+
+def add_plim_renderer(config, extension, mako_settings_prefix='mako.', preprocessor='plim.preprocessor',
+                      cache_dir=None):
     """
     Register a Plim renderer for a template extension.
 
@@ -29,13 +32,20 @@ def add_plim_renderer(config, extension, mako_settings_prefix='mako.', preproces
     :type extension: str
     :param mako_settings_prefix: prefix of mako configuration options.
     :type mako_settings_prefix: str
+    :param cache_dir: directory of the persistent cache of compiled templates
+                      (see :class:`plim.cache.DiskCache`). The ``plim.cache_dir`` setting is used by default.
+    :type cache_dir: str or None
     """
     renderer_factory = MakoRendererFactory()
     config.add_renderer(extension, renderer_factory)
 
     def register() -> None:
         settings = copy.copy(config.registry.settings)
-        settings['{prefix}preprocessor'.format(prefix=mako_settings_prefix)] = preprocessor
+        plim_preprocessor = preprocessor
+        plim_cache_dir = cache_dir or settings.get('plim.cache_dir')
+        if plim_cache_dir:
+            plim_preprocessor = cached_preprocessor(config.maybe_dotted(preprocessor), cache_dir=plim_cache_dir)
+        settings['{prefix}preprocessor'.format(prefix=mako_settings_prefix)] = plim_preprocessor
 
         opts = parse_options_from_settings(settings, mako_settings_prefix, config.maybe_dotted)
         lookup = PkgResourceTemplateLookup(**opts)
@@ -0,0 +1,380 @@
+""" Caches of compiled templates.
+
+A caching preprocessor (see :func:`plim.preprocessor_factory`) looks up the result of compilation
+by a digest of the template source and a fingerprint of the syntax that compiles it,
+so that the same source is never compiled twice.
+
+Blocks of markup languages (``-md``, ``-rst``, ``-coffee``, ``-scss``, ``-stylus``) are cached
+on their own (see :func:`compile_markup`), because their external compilers are the slowest part
+of compilation, and these blocks rarely change along with the templates that contain them.
+"""
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Mapping, Optional, Sequence
+
+from . import lexer
+from .incremental import IncrementalCompiler
+from .lexer import compile_plim_source
+from .util import atomic_write
+
+
+@functools.lru_cache(maxsize=None)
+def distribution_version(name: str) -> str:
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return 'unknown'
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+def plim_version() -> str:
+    return distribution_version('Plim')
+
+
+def syntax_fingerprint(syntax: Any) -> str:
+    """ Returns a digest that identifies the version of Plim, the syntax class,
+    and its list of parsers (including custom ones).
+
+    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    """
+    digest = hashlib.sha1()
+    syntax_cls = type(syntax)
+    digest.update('{}\0{}.{}'.format(
+        plim_version(), syntax_cls.__module__, syntax_cls.__qualname__
+    ).encode('utf-8'))
+    for pattern, parser in syntax.parsers:
+        pattern_id = '{}/{}'.format(getattr(pattern, 'pattern', pattern), getattr(pattern, 'flags', ''))
+        parser_id = '{}.{}'.format(
+            getattr(parser, '__module__', ''), getattr(parser, '__qualname__', None) or repr(parser)
+        )
+        digest.update('\0{}\0{}'.format(pattern_id, parser_id).encode('utf-8', 'surrogatepass'))
+        # custom parsers may change without changing the version of Plim
+        code = getattr(parser, '__code__', None)
+        if code is not None:
+            digest.update(code.co_code)
+            digest.update(repr(code.co_consts).encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def cache_key(source: str, fingerprint: str, strip: bool = True) -> str:
+    """ Returns the cache key of the compiled ``source``.
+
+    :param source: template source
+    :param fingerprint: a fingerprint of the syntax (see :func:`syntax_fingerprint`)
+    :param strip: whether the compiled template is stripped
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update('{}\0{:d}\0'.format(fingerprint, strip).encode('ascii'))
+    digest.update(source.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+class LRUCache(object):
+    """ A thread-safe in-memory cache of compiled templates with the least-recently-used eviction policy.
+
+    The cache is bounded by the number of entries and, optionally, by the total size
+    of cached templates in bytes (UTF-8). ``hits``, ``misses``, and ``evictions`` count
+    the lookups and evictions since the cache was created or cleared.
+    """
+
+    def __init__(self, max_entries: int = 512, max_bytes: Optional[int] = None):
+        """
+        :param max_entries: maximum number of cached templates
+        :param max_bytes: maximum total size of cached templates, or None for no limit
+        """
+        if max_entries < 1:
+            raise ValueError('max_entries must be a positive number')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, tuple[str, int]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[str]:
+        """ Returns the cached template, or None if there is no such template in the cache.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: str) -> None:
+        """ Stores the template in the cache and evicts the least recently used templates if needed.
+        Templates that are larger than ``max_bytes`` are not cached.
+        """
+        size = len(value.encode('utf-8', 'surrogatepass'))
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.total_bytes > self.max_bytes
+            ):
+                _, (__, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """ Removes all templates from the cache and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+
+class DiskCache(object):
+    """ A persistent content-addressed cache of compiled templates.
+
+    Every template is stored in its own file ``<directory>/<key[:2]>/<key[2:]>``. The file is written
+    to a temporary file first and then renamed, so that processes that share the directory
+    never see partially written templates. Failed writes are ignored, because the cache
+    is not required for compilation. Entries are never evicted: remove the directory to clear the cache.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: path to the cache directory. It is created if it doesn't exist.
+        """
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self.path(key), 'r', encoding='utf-8', errors='surrogatepass', newline='') as f:
+                value = f.read()
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            with atomic_write(self.path(key), 'w', encoding='utf-8', errors='surrogatepass', newline='') as f:
+                f.write(value)
+        except (IOError, OSError):
+            pass
+
+
+def compile_cached(source: str, syntax: Any, caches: Sequence[Any], fingerprint: str, strip: bool = True,
+                   compiler: Any = None, limits: Optional[lexer.Limits] = None) -> str:
+    """ Returns the compiled ``source`` from the first cache that has it, compiling it on a miss.
+    The result is stored in all the caches that didn't have it.
+
+    :param source: template source
+    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    :param caches: caches of compiled templates, from the fastest to the slowest one
+                   (see :class:`LRUCache` and :class:`DiskCache`)
+    :param fingerprint: a fingerprint of the ``syntax`` (see :func:`syntax_fingerprint`)
+    :param strip: whether to strip the compiled template
+    :param compiler: an incremental compiler of the ``syntax`` that compiles the templates
+                     missing from the caches (see :class:`plim.incremental.IncrementalCompiler`)
+    :param limits: limits of compilation of the templates missing from the caches
+                   (see :class:`plim.lexer.Limits`)
+    """
+    key = cache_key(source, fingerprint, strip)
+    missed = []
+    for cache in caches:
+        result = cache.get(key)
+        if result is not None:
+            break
+        missed.append(cache)
+    else:
+        if compiler is not None:
+            result = compiler.compile(source, strip, limits)
+        else:
+            result = compile_plim_source(source, syntax, strip, limits)
+    for cache in missed:
+        cache.set(key, result)
+    return result
+
+
+def markup_cache_key(lang: str, source: str) -> str:
+    """ Returns the cache key of the compiled block of a markup language. The key depends on
+    the versions of Plim and of the compiler, and on the compiler function itself, so that replacing
+    an item of :data:`plim.lexer.MARKUP_LANGUAGES` doesn't bring stale results.
+
+    :param lang: name of the markup language
+    :param source: contents of the block
+    """
+    compiler = lexer.MARKUP_LANGUAGES[lang]
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update('markup\0{}\0{}\0{}\0{}.{}\0'.format(
+        lang,
+        plim_version(),
+        distribution_version(lexer.MARKUP_LANGUAGES.distributions.get(lang, lang)),
+        getattr(compiler, '__module__', ''),
+        getattr(compiler, '__qualname__', None) or repr(compiler),
+    ).encode('utf-8', 'surrogatepass'))
+    digest.update(source.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def _lookup_markup(key: str, caches: Sequence[Any]) -> Optional[str]:
+    """ Returns the compiled block from the first cache that has it, and stores it in the caches before that one.
+    """
+    for index, cache in enumerate(caches):
+        result = cache.get(key)
+        if result is not None:
+            for missed in caches[:index]:
+                missed.set(key, result)
+            return result
+    return None
+
+
+def compile_markup(lang: str, source: str, caches: Sequence[Any] = (),
+                   languages: Optional[Mapping[str, Any]] = None) -> str:
+    """ Returns the block of a markup language compiled by its compiler from :data:`plim.lexer.MARKUP_LANGUAGES`,
+    taking it from the first cache that has it. The result is stored in all the caches that didn't have it.
+    Compilation errors are not cached.
+
+    :param lang: name of the markup language
+    :param source: contents of the block
+    :param caches: caches of compiled blocks, from the fastest to the slowest one
+                   (see :class:`LRUCache` and :class:`DiskCache`)
+    :param languages: a mapping of language names to compilers to use instead of
+                      :data:`plim.lexer.MARKUP_LANGUAGES`
+    """
+    if languages is None:
+        languages = lexer.MARKUP_LANGUAGES
+    if not caches:
+        return languages[lang](source)
+    key = markup_cache_key(lang, source)
+    result = _lookup_markup(key, caches)
+    if result is None:
+        result = languages[lang](source)
+        for cache in caches:
+            cache.set(key, result)
+    return result
+
+
+def submit_markup(executor: Any, lang: str, source: str, caches: Sequence[Any] = (),
+                  languages: Optional[Mapping[str, Any]] = None) -> Future:
+    """ A counterpart of :func:`compile_markup` that compiles the block with the ``executor``.
+    Cached blocks are not submitted: their futures are completed already.
+
+    :param executor: a thread or process pool from :mod:`concurrent.futures`
+    :return: a :class:`concurrent.futures.Future` of the compiled block
+    """
+    # the compiler is submitted instead of compile_markup() itself, so that process pools
+    # don't have to pickle the caches
+    if languages is None:
+        languages = lexer.MARKUP_LANGUAGES
+    if not caches:
+        return executor.submit(languages[lang], source)
+
+    key = markup_cache_key(lang, source)
+    result = _lookup_markup(key, caches)
+    if result is not None:
+        future: Future = Future()
+        future.set_result(result)
+        return future
+
+    def store(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            for cache in caches:
+                cache.set(key, future.result())
+
+    future = executor.submit(languages[lang], source)
+    future.add_done_callback(store)
+    return future
+
+
+# Compiled blocks of markup languages are kept in memory by all syntax instances
+# (see ``markup_caches`` of :class:`plim.syntax.BaseSyntax`).
+markup_cache = LRUCache(max_entries=256, max_bytes=16 * 1024 * 1024)
+
+
+def compile_stream_cached(source: Any, sink: Any, syntax: Any, caches: Sequence[Any], fingerprint: str,
+                          strip: bool = True, compiler: Any = None, limits: Optional[lexer.Limits] = None) -> None:
+    """ A counterpart of :func:`plim.lexer.compile_stream` for caching preprocessors.
+    The source is read as a whole, because its digest is the cache key.
+    """
+    if not isinstance(source, str):
+        source = source.read()
+    write = getattr(sink, 'write', sink)
+    write(compile_cached(source, syntax, caches, fingerprint, strip, compiler, limits))
+
+
+def cached_preprocessor(preprocessor: Any, cache_size: int = 0, cache_max_bytes: Optional[int] = None,
+                        cache_dir: Optional[str] = None) -> Any:
+    """ Returns a caching counterpart of a preprocessor created by :func:`plim.preprocessor_factory`.
+    Caches of the original preprocessor are kept in front of the new ones. With ``cache_dir``,
+    the new preprocessor compiles templates with its own copy of the syntax, and the original one is not changed.
+
+    :param preprocessor: preprocessor instance
+    :param cache_size: maximum number of compiled templates kept in memory
+    :param cache_max_bytes: maximum total size of the compiled templates kept in memory
+    :param cache_dir: path to a directory of the persistent cache (see :class:`DiskCache`)
+    :return: preprocessor instance. The memory cache is available as ``preprocessor.cache``,
+             the persistent cache is available as ``preprocessor.disk_cache``.
+    """
+    keywords = getattr(preprocessor, 'keywords', None)
+    if not keywords or 'syntax' not in keywords:
+        raise TypeError('Only preprocessors created by plim.preprocessor_factory() can be cached')
+    syntax = keywords['syntax']
+    caches = list(keywords.get('caches', ()))
+    memory_cache = getattr(preprocessor, 'cache', None)
+    disk_cache = getattr(preprocessor, 'disk_cache', None)
+    if cache_size:
+        memory_cache = LRUCache(cache_size, cache_max_bytes)
+        caches.insert(0, memory_cache)
+    compiler = keywords.get('compiler')
+    if cache_dir:
+        disk_cache = DiskCache(cache_dir)
+        caches.append(disk_cache)
+        # Blocks of markup languages are persisted along with the templates. They are cached
+        # by a copy of the syntax, so that the original preprocessor (which may be the shared
+        # ``plim.preprocessor``) never writes to the directory.
+        syntax = syntax.clone()
+        syntax.markup_caches = tuple(syntax.markup_caches) + (disk_cache,)
+        if compiler is not None:
+            compiler = IncrementalCompiler(syntax, compiler.max_segments)
+    if not caches:
+        return preprocessor
+
+    options = dict(syntax=syntax, caches=tuple(caches), fingerprint=syntax_fingerprint(syntax))
+    if compiler is not None:
+        options['compiler'] = compiler
+    if keywords.get('limits') is not None:
+        options['limits'] = keywords['limits']
+    cached = functools.partial(compile_cached, **options)
+    cached.stream = functools.partial(compile_stream_cached, **options)  # type: ignore
+    if memory_cache is not None:
+        cached.cache = memory_cache  # type: ignore
+    if disk_cache is not None:
+        cached.disk_cache = disk_cache  # type: ignore
+    if 'compiler' in options:
+        cached.compiler = options['compiler']  # type: ignore
+    return cached
@@ -5,14 +5,28 @@ import sys
 import os
 import argparse
 import codecs
+import compileall
+import contextlib
+import glob
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, ContextManager, Dict, List, Optional, Tuple
 from pkg_resources import get_distribution
 from pkg_resources import EntryPoint
 
 from mako.template import Template
 from mako.lookup import TemplateLookup
 
+from .cache import cached_preprocessor
+from .deps import DependencyGraph, iter_template_uris, resolve_uri
+from .errors import MemoryBudgetExceeded
+from .memory import MemoryMonitor
+from .profiling import Instrumentation, Profiler
+from .util import atomic_write, write_if_changed
+from .watch import Watcher
 
-def plimc(args=None, stdout=None):
+
+def plimc(args=None, stdout=None, stderr=None):
     """This is the `plimc` command line utility
 
     :param args: list of command-line arguments. If None, then ``sys.argv[1:]`` will be used.
@@ -20,55 +34,427 @@ def plimc(args=None, stdout=None):
     :param stdout: file-like object representing stdout. If None, then ``sys.stdout`` will be used.
                    Custom stdout is used for testing purposes.
     :type stdout: None or a file-like object
+    :param stderr: text file-like object representing stderr, where ``--profile`` and ``--memory``
+                   write their reports. If None, then ``sys.stderr`` will be used.
+    :type stderr: None or a file-like object
+    :return: exit status
     """
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] == 'build':
+        return plimc_build(args[1:], stdout)
+    if args and args[0] == 'batch':
+        return plimc_batch(args[1:], stdout)
+    if args and args[0] == 'deps':
+        return plimc_deps(args[1:], stdout)
+    if args and args[0] == 'watch':
+        return plimc_watch(args[1:], stdout)
+
     # Parse arguments
     # ------------------------------------
-    cli_parser = argparse.ArgumentParser(description='Compile plim source files into mako files.')
+    cli_parser = argparse.ArgumentParser(
+        description='Compile plim source files into mako files. '
+                    'Run "plimc batch -h" to see how to compile many templates at once, '
+                    '"plimc build -h" to see how to compile directories of templates into Mako modules, '
+                    '"plimc deps -h" to see how to list dependencies between templates, '
+                    'and "plimc watch -h" to see how to recompile templates on changes.'
+    )
     cli_parser.add_argument('source', help="path to source plim template")
     cli_parser.add_argument('-o', '--output', help="write result to FILE.")
     cli_parser.add_argument('-e', '--encoding', default='utf-8', help="content encoding")
     cli_parser.add_argument('-p', '--preprocessor', default='plim:preprocessor',
                             help="Preprocessor instance that will be used for parsing the template")
     cli_parser.add_argument('-H', '--html', action='store_true', help="Render HTML output instead of Mako template")
+    cli_parser.add_argument('--cache-dir', help="Directory of the persistent cache of compiled templates")
+    cli_parser.add_argument('--profile', action='store_true',
+                            help="Print the time spent by every parser to stderr. "
+                                 "The template is always compiled, even if --cache-dir is given")
+    cli_parser.add_argument('--memory', action='store_true',
+                            help="Print the peak memory allocated by compilation and the lines of the lexer "
+                                 "that have allocated most of it to stderr. "
+                                 "The template is always compiled, even if --cache-dir is given")
+    cli_parser.add_argument('--memory-budget', type=_parse_size, metavar='SIZE',
+                            help="Fail if compilation allocates more than SIZE bytes of memory "
+                                 "(K, M, and G suffixes are accepted)")
     cli_parser.add_argument('-V', '--version', action='version',
                             version='Plim {}'.format(get_distribution("Plim").version))
 
-    if args is None:
-        args = sys.argv[1:]
     args = cli_parser.parse_args(args)
+    if stderr is None:
+        stderr = sys.stderr
 
     # Get custom preprocessor, if specified
     # -------------------------------------
-    preprocessor_path = args.preprocessor
-    # Add an empty string path, so modules located at the current working dir
-    # are reachable and considered in the first place (see issue #32).
-    sys.path.insert(0, '')
-    preprocessor = EntryPoint.parse('x={}'.format(preprocessor_path)).resolve()
-
-    # Render to html, if requested
-    # ----------------------------
-    if args.html:
-        root_dir = os.path.dirname(os.path.abspath(args.source))
-        template_file = os.path.basename(args.source)
-        lookup = TemplateLookup(directories=[root_dir],
-                                input_encoding=args.encoding,
-                                output_encoding=args.encoding,
-                                preprocessor=preprocessor)
-        content = lookup.get_template(template_file).render_unicode()
-    else:
-        with codecs.open(args.source, 'rb', args.encoding) as fd:
-            content = preprocessor(fd.read())
+    instrumented = args.profile or args.memory or args.memory_budget is not None
+    preprocessor = _resolve_preprocessor(args.preprocessor, None if instrumented else args.cache_dir)
+    instruments: List[Instrumentation] = []
+    if instrumented:
+        syntax = getattr(preprocessor, 'keywords', {}).get('syntax')
+        if syntax is None:
+            cli_parser.error('--profile, --memory, and --memory-budget require a preprocessor '
+                             'created by plim.preprocessor_factory()')
+        if args.profile:
+            instruments.append(Profiler(syntax))
+        if args.memory or args.memory_budget is not None:
+            instruments.append(MemoryMonitor(syntax, args.memory_budget))
 
     # Output
     # ------------------------------------
+    output: ContextManager[Any]
     if args.output is None:
         if stdout is None:
             stdout = sys.stdout.buffer
-        fd = stdout
-        content = codecs.encode(content, 'utf-8')
+        output = contextlib.nullcontext(stdout)
     else:
-        fd = codecs.open(args.output, 'wb', args.encoding)
+        # The result is streamed to a temporary file that replaces the output file
+        # only if compilation succeeds, so that errors never leave partial output behind
+        output = atomic_write(args.output, 'w', encoding=args.encoding, newline='')
+
+    for instrument in instruments:
+        instrument.enable()
     try:
-        fd.write(content)
+        with output as fd:
+            if args.output is None:
+                write = lambda content: fd.write(codecs.encode(content, 'utf-8'))
+            else:
+                write = fd.write
+
+            # Render to html, if requested
+            # ----------------------------
+            if args.html:
+                root_dir = os.path.dirname(os.path.abspath(args.source))
+                template_file = os.path.basename(args.source)
+                lookup = TemplateLookup(directories=[root_dir],
+                                        input_encoding=args.encoding,
+                                        output_encoding=args.encoding,
+                                        preprocessor=preprocessor)
+                write(lookup.get_template(template_file).render_unicode())
+            else:
+                with codecs.open(args.source, 'rb', args.encoding) as source:
+                    # Preprocessors created by plim.preprocessor_factory() can write
+                    # the result as soon as it is compiled
+                    stream = getattr(preprocessor, 'stream', None)
+                    if stream is None:
+                        write(preprocessor(source.read()))
+                    else:
+                        stream(source, write)
+            if instruments and isinstance(instruments[-1], MemoryMonitor):
+                instruments[-1].checkpoint()
+    except MemoryBudgetExceeded as e:
+        stderr.write('{source}: {error}\n'.format(source=args.source, error=e))
+        return 1
     finally:
-        fd.close()
+        if args.output is None:
+            stdout.close()
+        for instrument in reversed(instruments):
+            instrument.disable()
+    for instrument in instruments:
+        if not isinstance(instrument, MemoryMonitor) or args.memory:
+            stderr.write(instrument.format_report() + '\n')
+    return 0
+
+
+def plimc_build(args, stdout=None):
+    """This is the `plimc build` command: ahead-of-time compilation of a directory of plim templates
+    into Python modules of Mako templates.
+
+    The modules are written in the layout of ``mako.lookup.TemplateLookup(directories=[source_dir],
+    module_directory=module_dir)``, so that a lookup configured this way imports the modules
+    and never compiles the templates again, unless a template is newer than its module.
+
+    :param args: list of command-line arguments that follow ``build``.
+    :type args: list
+    :param stdout: file-like object representing stdout. If None, then ``sys.stdout`` will be used.
+    :type stdout: None or a file-like object
+    :return: exit status
+    """
+    cli_parser = argparse.ArgumentParser(
+        prog='plimc build',
+        description='Compile a directory of plim templates into Mako template modules.'
+    )
+    cli_parser.add_argument('source_dir', help="root directory of plim templates (the template lookup directory)")
+    cli_parser.add_argument('-m', '--module-dir', required=True, help="write Mako modules to DIR")
+    cli_parser.add_argument('-x', '--extension', default='.plim', help="extension of plim templates")
+    cli_parser.add_argument('-e', '--encoding', default='utf-8', help="content encoding")
+    cli_parser.add_argument('-p', '--preprocessor', default='plim:preprocessor',
+                            help="Preprocessor instance that will be used for parsing the templates")
+    cli_parser.add_argument('-f', '--force', action='store_true',
+                            help="Compile all templates, even those with up-to-date modules")
+    cli_parser.add_argument('--cache-dir', help="Directory of the persistent cache of compiled templates")
+
+    args = cli_parser.parse_args(args)
+    if stdout is None:
+        stdout = sys.stdout.buffer
+    write = lambda content: stdout.write(codecs.encode(content, 'utf-8'))
+
+    preprocessor = _resolve_preprocessor(args.preprocessor, args.cache_dir)
+    lookup = TemplateLookup(directories=[args.source_dir],
+                            module_directory=args.module_dir,
+                            input_encoding=args.encoding,
+                            preprocessor=preprocessor)
+    compiled = 0
+    failed = 0
+    for uri in iter_template_uris(args.source_dir, args.extension):
+        if args.force:
+            module_path = os.path.join(args.module_dir, os.path.normpath(uri).lstrip(os.path.sep) + '.py')
+            if os.path.exists(module_path):
+                os.remove(module_path)
+        try:
+            lookup.get_template(uri)
+        except Exception as e:
+            failed += 1
+            write('{uri}: {error}\n'.format(uri=uri, error=e))
+        else:
+            compiled += 1
+
+    # Python modules of the templates are compiled to bytecode as well,
+    # so that application processes only have to load them
+    compileall.compile_dir(args.module_dir, quiet=1)
+    write('{compiled} templates compiled into {module_dir}, {failed} failed\n'.format(
+        compiled=compiled, module_dir=args.module_dir, failed=failed
+    ))
+    return 1 if failed else 0
+
+
+def plimc_batch(args, stdout=None):
+    """This is the `plimc batch` command: compilation of many plim templates at once
+    by a pool of worker processes.
+
+    Sources are files, directories (all templates in their trees), and glob patterns.
+    Compiled templates are written into the output directory, mirroring the tree of every source.
+    An output file is not rewritten if its content hasn't changed, so that its modification time
+    (and the Mako module compiled from it) stays valid.
+
+    :param args: list of command-line arguments that follow ``batch``.
+    :type args: list
+    :param stdout: file-like object representing stdout. If None, then ``sys.stdout`` will be used.
+    :type stdout: None or a file-like object
+    :return: exit status
+    """
+    cli_parser = argparse.ArgumentParser(
+        prog='plimc batch',
+        description='Compile many plim source files into mako files in parallel.'
+    )
+    cli_parser.add_argument('sources', nargs='+', help="plim templates, directories, or glob patterns")
+    cli_parser.add_argument('-o', '--output-dir', required=True, help="write results to DIR")
+    cli_parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                            help="number of worker processes (the number of CPUs by default)")
+    cli_parser.add_argument('-x', '--extension', default='.plim',
+                            help="extension of plim templates in directories")
+    cli_parser.add_argument('--output-extension', default='.mako', help="extension of compiled templates")
+    cli_parser.add_argument('-e', '--encoding', default='utf-8', help="content encoding")
+    cli_parser.add_argument('-p', '--preprocessor', default='plim:preprocessor',
+                            help="Preprocessor instance that will be used for parsing the templates")
+    cli_parser.add_argument('--cache-dir', help="Directory of the persistent cache of compiled templates")
+    cli_parser.add_argument('--memory-budget', type=_parse_size, metavar='SIZE',
+                            help="Fail the templates whose compilation allocates more than SIZE bytes of memory "
+                                 "(K, M, and G suffixes are accepted)")
+
+    args = cli_parser.parse_args(args)
+    if stdout is None:
+        stdout = sys.stdout.buffer
+    write = lambda content: stdout.write(codecs.encode(content, 'utf-8'))
+
+    tasks = []
+    outputs: Dict[str, str] = {}
+    for path, relative_path in _iter_batch_sources(args.sources, args.extension):
+        output_path = os.path.join(args.output_dir, os.path.splitext(relative_path)[0] + args.output_extension)
+        key = os.path.normcase(os.path.abspath(output_path))
+        previous = outputs.get(key)
+        if previous is not None:
+            # a template that matches several sources is compiled once.
+            # Missing templates are compared by their paths, and fail on compilation.
+            if os.path.normcase(os.path.realpath(previous)) == os.path.normcase(os.path.realpath(path)):
+                continue
+            cli_parser.error('{} and {} would be written to the same file {}'.format(previous, path, output_path))
+        outputs[key] = path
+        tasks.append((path, output_path, args.encoding, args.preprocessor, args.cache_dir, args.memory_budget))
+
+    started_at = time.perf_counter()
+    if args.jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(_compile_batch_file, tasks, chunksize=max(1, len(tasks) // (args.jobs * 8))))
+    else:
+        results = [_compile_batch_file(task) for task in tasks]
+    elapsed = time.perf_counter() - started_at
+
+    counts = {'written': 0, 'unchanged': 0, 'failed': 0}
+    for path, status, seconds, error in results:
+        counts[status] += 1
+        write('{seconds:8.3f}s  {status:<9}  {path}\n'.format(seconds=seconds, status=status, path=path))
+        if error:
+            write('    {error}\n'.format(error=error))
+    write('{total} templates in {elapsed:.3f}s: {written} written, {unchanged} unchanged, {failed} failed\n'.format(
+        total=len(results), elapsed=elapsed, **counts
+    ))
+    return 1 if counts['failed'] else 0
+
+
+def plimc_deps(args, stdout=None):
+    """This is the `plimc deps` command: static dependencies between templates
+    (``-inherit``, ``-include``, and ``-namespace``) of a directory.
+
+    :param args: list of command-line arguments that follow ``deps``.
+    :type args: list
+    :param stdout: file-like object representing stdout. If None, then ``sys.stdout`` will be used.
+    :type stdout: None or a file-like object
+    :return: exit status
+    """
+    cli_parser = argparse.ArgumentParser(
+        prog='plimc deps',
+        description='List dependencies between plim templates of a directory.'
+    )
+    cli_parser.add_argument('source_dir', help="root directory of plim templates (the template lookup directory)")
+    group = cli_parser.add_mutually_exclusive_group()
+    group.add_argument('-r', '--reverse', action='store_true',
+                       help="list templates that refer to every template instead of its dependencies")
+    group.add_argument('-a', '--affected', nargs='+', metavar='URI',
+                       help="list templates that must be recompiled when the given templates change")
+    cli_parser.add_argument('-x', '--extension', default='.plim', help="extension of plim templates")
+    cli_parser.add_argument('-e', '--encoding', default='utf-8', help="content encoding")
+    cli_parser.add_argument('-p', '--preprocessor', default='plim:preprocessor',
+                            help="Preprocessor instance whose syntax will be used for parsing the templates")
+
+    args = cli_parser.parse_args(args)
+    if stdout is None:
+        stdout = sys.stdout.buffer
+    write = lambda content: stdout.write(codecs.encode(content, 'utf-8'))
+
+    preprocessor = _resolve_preprocessor(args.preprocessor)
+    syntax = getattr(preprocessor, 'keywords', {}).get('syntax')
+    graph = DependencyGraph.build(args.source_dir, args.extension, syntax, args.encoding)
+    if args.affected:
+        for uri in sorted(graph.affected(resolve_uri(uri) for uri in args.affected)):
+            write('{}\n'.format(uri))
+    else:
+        edges = graph.dependents if args.reverse else graph.dependencies
+        for uri in sorted(edges):
+            write('{uri}: {targets}\n'.format(uri=uri, targets=' '.join(sorted(edges[uri]))))
+    for uri, error in sorted(graph.errors.items()):
+        write('{uri}: error: {error}\n'.format(uri=uri, error=error))
+    return 1 if graph.errors else 0
+
+
+def plimc_watch(args, stdout=None, max_rebuilds=None):
+    """This is the `plimc watch` command: incremental recompilation of a directory of templates on changes.
+
+    :param args: list of command-line arguments that follow ``watch``.
+    :type args: list
+    :param stdout: file-like object representing stdout. If None, then ``sys.stdout`` will be used.
+    :type stdout: None or a file-like object
+    :param max_rebuilds: stop after this number of rebuilds (never stop by default). Used for testing purposes.
+    :return: exit status
+    """
+    cli_parser = argparse.ArgumentParser(
+        prog='plimc watch',
+        description='Watch a directory of plim templates and recompile changed templates '
+                    'and the templates that depend on them.'
+    )
+    cli_parser.add_argument('source_dir', help="root directory of plim templates")
+    cli_parser.add_argument('-o', '--out', required=True, help="write results to DIR")
+    cli_parser.add_argument('-i', '--interval', type=float, default=0.1,
+                            help="interval between checks for changes, in seconds (0.1 by default)")
+    cli_parser.add_argument('-d', '--debounce', type=float, default=0.05,
+                            help="time without changes before a rebuild starts, in seconds (0.05 by default)")
+    cli_parser.add_argument('-x', '--extension', default='.plim', help="extension of plim templates")
+    cli_parser.add_argument('--output-extension', default='.mako', help="extension of compiled templates")
+    cli_parser.add_argument('-e', '--encoding', default='utf-8', help="content encoding")
+    cli_parser.add_argument('-p', '--preprocessor', default='plim:preprocessor',
+                            help="Preprocessor instance that will be used for parsing the templates")
+
+    args = cli_parser.parse_args(args)
+    if stdout is None:
+        stdout = sys.stdout.buffer
+
+    def report(rebuild):
+        stdout.write(codecs.encode(
+            '[{time}] {compiled} templates rebuilt in {ms:.1f} ms: '
+            '{written} written, {removed} removed, {failed} failed\n'.format(
+                time=time.strftime('%H:%M:%S'), compiled=len(rebuild.compiled), ms=rebuild.seconds * 1000,
+                written=rebuild.written, removed=rebuild.removed, failed=len(rebuild.failed)
+            ), 'utf-8'))
+        for uri, error in sorted(rebuild.failed.items()):
+            stdout.write(codecs.encode('    {uri}: {error}\n'.format(uri=uri, error=error), 'utf-8'))
+        stdout.flush()
+
+    watcher = Watcher(args.source_dir, args.out, _resolve_preprocessor(args.preprocessor),
+                      args.extension, args.output_extension, args.encoding)
+    try:
+        watcher.run(report, args.interval, args.debounce, max_rebuilds)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _iter_batch_sources(sources, extension):
+    """ Yields 2-tuples of (path, path_relative_to_the_source_root) of the templates specified by ``sources``.
+    The root of a directory is the directory itself, the root of a glob pattern is the longest
+    directory path without wildcards, and the root of a file is its directory.
+    """
+    for source in sources:
+        if glob.has_magic(source):
+            parts = source.split(os.path.sep)
+            for index, part in enumerate(parts):
+                if glob.has_magic(part):
+                    break
+            root = os.path.sep.join(parts[:index])
+            for path in sorted(glob.glob(source, recursive=True)):
+                if os.path.isfile(path):
+                    yield path, os.path.relpath(path, root or os.curdir)
+        elif os.path.isdir(source):
+            for uri in iter_template_uris(source, extension):
+                yield os.path.join(source, uri[1:]), uri[1:]
+        else:
+            yield source, os.path.basename(source)
+
+
+# Preprocessors resolved by worker processes of "plimc batch"
+_batch_preprocessors: Dict[Tuple[str, Optional[str]], Any] = {}
+
+
+def _compile_batch_file(task):
+    """ Compiles a template of "plim batch". This function is executed by worker processes.
+
+    :return: 4-tuple of (path, status, seconds, error_message)
+    """
+    path, output_path, encoding, preprocessor_path, cache_dir, memory_budget = task
+    started_at = time.perf_counter()
+    try:
+        preprocessor = _batch_preprocessors.get((preprocessor_path, cache_dir))
+        if preprocessor is None:
+            preprocessor = _resolve_preprocessor(preprocessor_path, cache_dir)
+            _batch_preprocessors[(preprocessor_path, cache_dir)] = preprocessor
+        with codecs.open(path, 'rb', encoding) as source:
+            if memory_budget is None:
+                result = preprocessor(source.read())
+            else:
+                with MemoryMonitor(preprocessor.keywords['syntax'], memory_budget):
+                    result = preprocessor(source.read())
+            result = codecs.encode(result, encoding)
+        unchanged = not write_if_changed(output_path, result)
+    except Exception as e:
+        return path, 'failed', time.perf_counter() - started_at, '{}: {}'.format(type(e).__name__, e)
+    return path, 'unchanged' if unchanged else 'written', time.perf_counter() - started_at, None
+
+
+def _parse_size(value):
+    """ Parses a number of bytes with an optional K, M, or G suffix (powers of 1024).
+    """
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = value.strip().upper().rstrip('B')
+    try:
+        if value[-1:] in multipliers:
+            return int(float(value[:-1]) * multipliers[value[-1]])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size: {}'.format(value))
+
+
+def _resolve_preprocessor(preprocessor_path, cache_dir=None):
+    # Add an empty string path, so modules located at the current working dir
+    # are reachable and considered in the first place (see issue #32).
+    sys.path.insert(0, '')
+    preprocessor = EntryPoint.parse('x={}'.format(preprocessor_path)).resolve()
+    if cache_dir:
+        preprocessor = cached_preprocessor(preprocessor, cache_dir=cache_dir)
+    return preprocessor
@@ -0,0 +1,180 @@
+""" Static dependencies between templates.
+
+Templates refer to each other with ``-inherit``, ``-include``, and ``-namespace`` directives.
+This module extracts these references from parsed templates (without emitting them)
+and builds the dependency graph of a directory of templates, so that tools can find out
+which templates are affected by a change.
+"""
+import codecs
+import os
+import posixpath
+from collections import namedtuple
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from . import nodes
+from .lexer import parse_plim_source
+from .syntax import Mako
+
+
+DEPENDENCY_DIRECTIVES = ('inherit', 'include', 'namespace')
+
+
+# ``kind`` is the name of the directive, ``uri`` is the value of its ``file`` attribute
+Dependency = namedtuple('Dependency', ['kind', 'uri'])
+
+
+def _static_value(parts: List[Any]) -> Optional[str]:
+    """ Returns the text of an attribute value, or None if the value contains expressions.
+    """
+    buf = []
+    stack = list(reversed(parts))
+    while stack:
+        part = stack.pop()
+        if isinstance(part, str):
+            buf.append(part)
+        elif isinstance(part, nodes.Text):
+            buf.append(part.value)
+        elif isinstance(part, nodes.Fragment):
+            stack.extend(reversed(part.children))
+        else:
+            return None
+    value = ''.join(buf).strip()
+    if not value or '${' in value:
+        return None
+    return value
+
+
+def template_dependencies(source: str, syntax: Any = None) -> List[Dependency]:
+    """ Returns the static dependencies of a template in the order of their appearance.
+    References with dynamic file names (such as ``-include ${name}``) are skipped.
+
+    :param source: template source
+    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children (Mako by default).
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    """
+    if syntax is None:
+        syntax = Mako()
+    dependencies = []
+    for node in nodes.walk(parse_plim_source(source, syntax)):
+        if not isinstance(node, nodes.Directive) or node.name not in DEPENDENCY_DIRECTIVES:
+            continue
+        file_parts = node.file
+        for attr in node.attrs:
+            if attr.name == 'file' and attr.kind == nodes.ATTR_VALUE:
+                file_parts = attr.value
+        uri = _static_value(file_parts)
+        if uri is not None:
+            dependencies.append(Dependency(node.name, uri))
+    return dependencies
+
+
+def resolve_uri(uri: str, relative_to: Optional[str] = None) -> str:
+    """ Returns the lookup URI of a referenced template the same way ``mako.lookup.TemplateLookup`` does:
+    absolute URIs stay as they are, and relative ones are resolved against the URI of the referring template.
+
+    :param uri: the value of the ``file`` attribute
+    :param relative_to: the URI of the referring template
+    """
+    if not uri.startswith('/'):
+        if relative_to is not None:
+            uri = posixpath.join(posixpath.dirname(relative_to), uri)
+        else:
+            uri = '/' + uri
+    return posixpath.normpath(uri)
+
+
+class DependencyGraph(object):
+    """ Dependency graph of a directory of templates.
+
+    ``dependencies`` maps the URI of every template to the set of URIs it refers to,
+    and ``dependents`` is the reverse index: it maps URIs to the sets of templates that refer to them.
+    URIs are the ones of ``mako.lookup.TemplateLookup(directories=[source_dir])``, such as ``/pages/index.plim``.
+    Templates that cannot be parsed are listed in ``errors``.
+    """
+
+    def __init__(self, source_dir: str, extension: str = '.plim', syntax: Any = None, encoding: str = 'utf-8'):
+        """
+        :param source_dir: root directory of templates
+        :param extension: extension of templates
+        :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children (Mako by default).
+        :type syntax: :class:`plim.syntax.BaseSyntax`
+        :param encoding: content encoding
+        """
+        self.source_dir = source_dir
+        self.extension = extension
+        self.syntax = syntax if syntax is not None else Mako()
+        self.encoding = encoding
+        self.dependencies: Dict[str, Set[str]] = {}
+        self.dependents: Dict[str, Set[str]] = {}
+        self.errors: Dict[str, Exception] = {}
+
+    @classmethod
+    def build(cls, source_dir: str, extension: str = '.plim', syntax: Any = None,
+              encoding: str = 'utf-8') -> 'DependencyGraph':
+        """ Returns the graph of all templates in the directory tree.
+        """
+        graph = cls(source_dir, extension, syntax, encoding)
+        for uri in iter_template_uris(source_dir, extension):
+            graph.update(uri)
+        return graph
+
+    def path(self, uri: str) -> str:
+        """ Returns the path to the template file.
+        """
+        return os.path.join(self.source_dir, *uri.lstrip('/').split('/'))
+
+    def update(self, uri: str, source: Optional[str] = None) -> None:
+        """ Replaces the edges of the template with the ones of its current source.
+
+        :param uri: template URI
+        :param source: template source. It is read from the template file by default.
+        """
+        self.remove(uri)
+        try:
+            if source is None:
+                with codecs.open(self.path(uri), 'rb', self.encoding) as f:
+                    source = f.read()
+            dependencies = template_dependencies(source, self.syntax)
+        except Exception as e:
+            self.errors[uri] = e
+            dependencies = []
+        targets = set(resolve_uri(dependency.uri, uri) for dependency in dependencies)
+        self.dependencies[uri] = targets
+        for target in targets:
+            self.dependents.setdefault(target, set()).add(uri)
+
+    def remove(self, uri: str) -> None:
+        """ Removes the outgoing edges of the template from the graph.
+        The template stays in ``dependents`` of other templates, if they refer to it.
+        """
+        self.errors.pop(uri, None)
+        for target in self.dependencies.pop(uri, ()):
+            dependents = self.dependents[target]
+            dependents.discard(uri)
+            if not dependents:
+                del self.dependents[target]
+
+    def affected(self, uris: Iterable[str]) -> Set[str]:
+        """ Returns the URIs of the templates that must be recompiled when the given templates change:
+        the templates themselves and everything that refers to them, directly or transitively.
+        """
+        result = set()
+        stack = list(uris)
+        while stack:
+            uri = stack.pop()
+            if uri in result:
+                continue
+            result.add(uri)
+            stack.extend(self.dependents.get(uri, ()))
+        return result
+
+
+def iter_template_uris(source_dir: str, extension: str = '.plim') -> Iterable[str]:
+    """ Yields lookup URIs (such as ``/pages/index.plim``) of all templates in the directory tree.
+    """
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(extension):
+                path = os.path.relpath(os.path.join(root, name), source_dir)
+                yield '/' + path.replace(os.path.sep, '/')
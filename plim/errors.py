@@ -1,3 +1,6 @@
+from typing import Any, Optional
+
+
 class PlimError(Exception):
     pass
 
@@ -21,3 +24,59 @@ class ParserNotFound(PlimError):
     def __str__(self) -> str:
         return "Invalid syntax at line {lineno}: {line}".format(
             lineno=self.lineno, line=self.line)
+
+
+class JavaScriptError(PlimError):
+    """ An error of a JavaScript compiler, or of the runtime that runs it.
+    """
+    def __init__(self, msg: str):
+        super(JavaScriptError, self).__init__(msg)
+        self.msg = msg
+
+    def __str__(self) -> str:
+        return self.msg
+
+
+class MemoryBudgetExceeded(PlimError):
+    """ Compilation of a template has allocated more memory than its budget (see :mod:`plim.memory`).
+    """
+    def __init__(self, allocated: int, budget: int, lineno: Optional[int] = None):
+        super(MemoryBudgetExceeded, self).__init__()
+        self.allocated = allocated
+        self.budget = budget
+        self.lineno = lineno
+
+    def __str__(self) -> str:
+        msg = 'Compilation has allocated {allocated} bytes, over the memory budget of {budget} bytes'.format(
+            allocated=self.allocated, budget=self.budget)
+        if self.lineno is not None:
+            msg += ' at line {lineno}'.format(lineno=self.lineno)
+        return msg
+
+
+class CompileLimitExceeded(PlimError):
+    """ A template has exceeded one of the limits of compilation (see :class:`plim.lexer.Limits`).
+    """
+    MESSAGES = {
+        'max_source_size': 'The template is longer than {maximum} characters',
+        'max_line_length': 'The line is longer than {maximum} characters',
+        'max_depth': 'The template is nested deeper than {maximum} levels',
+        'timeout': 'Compilation has taken longer than {maximum} seconds',
+    }
+
+    def __init__(self, limit: str, value: Any, maximum: Any, lineno: int):
+        """
+        :param limit: name of the limit, such as ``max_line_length``
+        :param value: the value that has exceeded the limit
+        :param maximum: the limit
+        :param lineno: number of the line where the limit has been exceeded
+        """
+        super(CompileLimitExceeded, self).__init__()
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
+        self.lineno = lineno
+
+    def __str__(self) -> str:
+        return '{msg} at line {lineno}'.format(
+            msg=self.MESSAGES[self.limit].format(maximum=self.maximum), lineno=self.lineno)
@@ -1,28 +1,231 @@
-from typing import Mapping
+""" Compilers of markup languages (``-md``, ``-rst``, ``-coffee``, ``-scss``, ``-stylus``) and their registry.
 
-from docutils.core import publish_parts
-import coffeescript
-from scss import Scss
-from stylus import Stylus
+Compilers import the libraries they use on their first call, so that templates without
+these blocks don't pay for the imports. Third-party packages may register their own languages
+with entry points of the ``plim.markup_languages`` group:
 
+.. code-block:: python
+
+    setup(
+        ...
+        entry_points={
+            'plim.markup_languages': [
+                'less = my_package.plim_less:less_to_css',
+            ]
+        },
+    )
+
+An entry point is a callable that accepts the contents of a block and returns its HTML.
+It is imported when a template uses the language for the first time.
+"""
+import importlib
+import io
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, MutableMapping, Optional, Pattern
+
+from . import jsruntime
+
+
+ENTRY_POINT_GROUP = 'plim.markup_languages'
+
+
+def markdown_to_html(source: str) -> str:
+    import markdown2
+    return markdown2.markdown(source)
 
 
 def rst_to_html(source: str) -> str:
+    from docutils.core import publish_parts
     # This code was taken from http://wiki.python.org/moin/ReStructuredText
     # You may also be interested in http://www.tele3.cz/jbar/rest/about.html
-    html: Mapping[str, str] = publish_parts(source=source, writer_name='html')
-    return html['html_body']
+    html = publish_parts(source=source, writer_name='html')
+    return str(html['html_body'])
 
 
 def coffee_to_js(source: str) -> str:
-    return '<script>{js}</script>'.format(js=coffeescript.compile(source))
+    import coffeescript
+    pool = jsruntime.default_pool()
+    if pool is None:
+        js = coffeescript.compile(source)
+    else:
+        if 'coffee' not in pool.scripts:
+            pool.define('coffee', coffeescript.get_compiler_script())
+        js = pool.call('coffee', 'CoffeeScript.compile', source, {'bare': False})
+    return '<script>{js}</script>'.format(js=js)
 
 
 def scss_to_css(source: str) -> str:
+    from scss import Scss
     css = Scss().compile(source).strip()
     return '<style>{css}</style>'.format(css=css)
 
 
 def stylus_to_css(source: str) -> str:
-    compiler = Stylus()
-    return '<style>{css}</style>'.format(css=compiler.compile(source).strip())
+    import stylus
+    pool = jsruntime.default_pool()
+    if pool is None:
+        css = stylus.Stylus().compile(source)
+    else:
+        if 'stylus' not in pool.scripts:
+            # the compiler script of the stylus package
+            with io.open(os.path.join(os.path.dirname(os.path.abspath(stylus.__file__)), 'compiler.js')) as f:
+                pool.define('stylus', f.read())
+        css = pool.call('stylus', 'compiler', source, {'paths': [], 'compress': False}, {}, [])
+    return '<style>{css}</style>'.format(css=css.strip())
+
+
+def _import_object(path: str) -> Any:
+    """ Imports an object by its ``module:attribute`` path.
+    """
+    module_name, _, attribute = path.partition(':')
+    result = importlib.import_module(module_name)
+    for name in attribute.split('.') if attribute else ():
+        result = getattr(result, name)
+    return result
+
+
+class MarkupLanguages(MutableMapping):
+    """ A registry of compilers of markup languages: a mapping of language names to callables
+    that accept the contents of a block and return its HTML.
+
+    A compiler may be registered as a ``module:attribute`` string or as an entry point, which is
+    imported on the first lookup of the language. Entry points of ``entry_point_group`` are discovered
+    on the first access to the registry, and they don't override the languages registered explicitly.
+    ``version`` changes every time the set of languages changes.
+    """
+
+    def __init__(self, compilers: Optional[Mapping[str, Any]] = None,
+                 distributions: Optional[Mapping[str, str]] = None,
+                 entry_point_group: Optional[str] = ENTRY_POINT_GROUP):
+        """
+        :param compilers: a mapping of language names to compilers or to ``module:attribute`` paths of them
+        :param distributions: a mapping of language names to names of the distributions
+                              that provide their compilers (see :func:`plim.cache.markup_cache_key`)
+        :param entry_point_group: entry point group of third-party languages, or None
+        """
+        self._compilers: Dict[str, Any] = dict(compilers or {})
+        self.distributions: Dict[str, str] = dict(distributions or {})
+        self.entry_point_group = entry_point_group
+        self._entry_points_loaded = entry_point_group is None
+        self._lock = threading.RLock()
+        self.version = 0
+
+    def _load_entry_points(self) -> None:
+        if self._entry_points_loaded:
+            return
+        with self._lock:
+            if self._entry_points_loaded:
+                return
+            group = self.entry_point_group
+            # registries without a group never get here (see __init__)
+            assert group is not None
+            find_entry_points: Optional[Callable[..., Any]]
+            try:
+                from importlib.metadata import entry_points as find_entry_points
+            except ImportError:  # pragma: no cover
+                find_entry_points = None
+            if find_entry_points is not None:
+                all_entry_points = find_entry_points()
+                found: Iterable[Any]
+                if hasattr(all_entry_points, 'select'):
+                    found = all_entry_points.select(group=group)
+                else:  # pragma: no cover
+                    # Python < 3.10
+                    found = all_entry_points.get(group, ())
+                for entry_point in found:
+                    if entry_point.name in self._compilers:
+                        continue
+                    self._compilers[entry_point.name] = entry_point
+                    dist = getattr(entry_point, 'dist', None)
+                    if dist is not None:
+                        self.distributions.setdefault(entry_point.name, dist.metadata['Name'])
+                self.version += 1
+            self._entry_points_loaded = True
+
+    def __getitem__(self, name: str) -> Callable[[str], str]:
+        self._load_entry_points()
+        compiler = self._compilers[name]
+        if isinstance(compiler, str):
+            compiler = _import_object(compiler)
+            self._compilers[name] = compiler
+        elif not callable(compiler):
+            # an entry point
+            compiler = compiler.load()
+            self._compilers[name] = compiler
+        return compiler
+
+    def __setitem__(self, name: str, compiler: Any) -> None:
+        self._load_entry_points()
+        with self._lock:
+            if name not in self._compilers:
+                self.version += 1
+            self._compilers[name] = compiler
+
+    def __delitem__(self, name: str) -> None:
+        self._load_entry_points()
+        with self._lock:
+            del self._compilers[name]
+            self.version += 1
+
+    def __contains__(self, name: Any) -> bool:
+        self._load_entry_points()
+        return name in self._compilers
+
+    def __iter__(self) -> Iterator[str]:
+        self._load_entry_points()
+        return iter(list(self._compilers))
+
+    def __len__(self) -> int:
+        self._load_entry_points()
+        return len(self._compilers)
+
+    def register(self, name: str, compiler: Any, distribution: Optional[str] = None) -> None:
+        """ Registers a compiler of the language, replacing the previous one.
+
+        :param name: name of the language, as in ``-name``
+        :param compiler: a callable or its ``module:attribute`` path
+        :param distribution: name of the distribution that provides the compiler
+        """
+        self[name] = compiler
+        if distribution is not None:
+            self.distributions[name] = distribution
+
+
+class MarkupLanguagesPattern(object):
+    """ A parser pattern that matches the opening lines of blocks (``-lang``) of every language
+    of a registry. The regex is compiled on the first match, and again after the registry changes.
+    """
+    # the beginning of every match, which doesn't depend on the registry. The dispatch index
+    # of parsers (see :func:`plim.syntax.leading_char_re`) uses it without discovering entry points.
+    leading_regex = re.compile(r'-')
+
+    def __init__(self, languages: MarkupLanguages):
+        self.languages = languages
+        self._regex: Optional[Pattern[str]] = None
+        self._version: Optional[int] = None
+
+    def regex(self) -> Pattern[str]:
+        languages = self.languages
+        # the registry must discover its entry points before its version is checked
+        languages._load_entry_points()
+        if self._regex is None or self._version != languages.version:
+            # longer names first, so that a name doesn't shadow the longer ones that start with it
+            names = sorted(languages, key=lambda name: (-len(name), name))
+            self._regex = re.compile(r'-\s*(?P<lang>{})\s*'.format(
+                '|'.join(re.escape(name) for name in names) or '(?!)'
+            ))
+            self._version = languages.version
+        return self._regex
+
+    @property
+    def pattern(self) -> str:
+        return self.regex().pattern
+
+    @property
+    def flags(self) -> int:
+        return self.regex().flags
+
+    def match(self, string: str, *args: Any) -> Any:
+        return self.regex().match(string, *args)
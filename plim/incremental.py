@@ -0,0 +1,190 @@
+""" Block-level incremental recompilation.
+
+An edit to a large template usually touches one top-level block. :class:`IncrementalCompiler`
+splits the source into segments that start at non-indented lines, and keeps the compiled output
+of every segment by a digest of its text, so that a recompilation parses only the segments
+that have been changed since the previous one.
+
+A segment starts at every non-blank line without indentation, except for the lines that continue
+the previous statement (``-elif``, ``-else``, ``-except``, and ``-finally``). A construct may still
+span many segments: for example, a tag with attributes on many lines, or a line that ends with ``\\``.
+The parser decides where every block ends, and the number of segments that it took is cached
+along with the output, so the compiled template is always the same as the one of
+:func:`plim.lexer.compile_plim_source`.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .lexer import NEWLINE, Limits, SourceCursor, search_parser
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+def _combine(digests: Sequence[bytes]) -> bytes:
+    if len(digests) == 1:
+        return digests[0]
+    return hashlib.blake2b(b''.join(digests), digest_size=16).digest()
+
+
+def segment_starts(source: SourceCursor, syntax: Any) -> List[int]:
+    """ Returns the numbers of the lines that start top-level segments of the source.
+
+    :param source: source cursor
+    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    """
+    continuations = [
+        regex for regex in (syntax.PARSE_ELIF_ELSE_RE, syntax.PARSE_EXCEPT_ELSE_FINALLY_RE) if regex is not None
+    ]
+    starts = [1] if source.line_count else []
+    indents = source.indents
+    for index in range(1, len(indents)):
+        if indents[index]:
+            continue
+        line = source.line(index + 1)
+        if not any(regex.match(line) for regex in continuations):
+            starts.append(index + 1)
+    return starts
+
+
+class IncrementalCompiler(object):
+    """ Compiles templates reusing the output of the top-level segments that haven't changed.
+
+    The compiler is thread-safe and may be shared by many templates: segments are looked up
+    by their contents only. ``parsed`` and ``reused`` count the segments that have been parsed
+    and taken from the cache by the latest compilation.
+    """
+
+    def __init__(self, syntax: Any, max_segments: int = 4096):
+        """
+        :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
+        :type syntax: :class:`plim.syntax.BaseSyntax`
+        :param max_segments: maximum number of cached segments. The least recently used segments
+                             are evicted first.
+        """
+        if max_segments < 1:
+            raise ValueError('max_segments must be a positive number')
+        self.syntax = syntax
+        self.max_segments = max_segments
+        # digest of the first segment -> (number of segments, digest of all of them, output).
+        # Blocks that end at the end of the source take all the remaining segments,
+        # so their number is negative: such blocks may end elsewhere in a longer source.
+        self._segments: 'OrderedDict[bytes, Tuple[int, bytes, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.parsed = 0
+        self.reused = 0
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._segments.clear()
+
+    def _get(self, key: bytes) -> Optional[Tuple[int, bytes, str]]:
+        with self._lock:
+            entry = self._segments.get(key)
+            if entry is not None:
+                self._segments.move_to_end(key)
+            return entry
+
+    def _set(self, key: bytes, entry: Tuple[int, bytes, str]) -> None:
+        with self._lock:
+            self._segments[key] = entry
+            self._segments.move_to_end(key)
+            while len(self._segments) > self.max_segments:
+                self._segments.popitem(last=False)
+
+    def _parse_segments(self, source: SourceCursor, starts: List[int], start_index: Dict[int, int],
+                        index: int) -> Tuple[List[Any], int]:
+        """ Parses the source from the beginning of the segment ``index`` up to the beginning
+        of the first segment that is not a part of its blocks.
+
+        :return: 2-tuple of (parsed top-level nodes, index of the next segment)
+        """
+        syntax = self.syntax
+        source.jump(starts[index])
+        buf: List[Any] = []
+        tail_indent: Optional[int] = 0
+        tail_line: Optional[str] = ''
+        while True:
+            if not tail_line:
+                tail_indent, tail_line = source.scan_next()
+                if tail_line is None:
+                    return buf, len(starts)
+                if not tail_line:
+                    continue
+            lineno = source.lineno
+            next_index = start_index.get(lineno, index)
+            if next_index > index and not tail_indent and tail_line == source.line(lineno).rstrip(NEWLINE):
+                # the remainder of the source is parsed the same way as if it started from this line
+                return buf, next_index
+            matched_obj, parse = search_parser(lineno, tail_line, syntax)
+            parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+            buf.append(parsed_data)
+
+    def compile(self, source: str, strip: bool = True, limits: Optional[Limits] = None) -> str:
+        """ Returns the same result as :func:`plim.lexer.compile_plim_source`.
+
+        :param source: template source
+        :param strip: whether to strip the compiled template
+        :param limits: limits of compilation, or None (see :class:`plim.lexer.Limits`).
+                       The timeout applies to the blocks that are parsed.
+        """
+        source = source.replace('\r\n', '\n')
+        cursor = SourceCursor(source) if limits is None else limits.open(source)
+        starts = segment_starts(cursor, self.syntax)
+        offsets = cursor.line_offsets
+        bounds = starts + [cursor.line_count + 1]
+        digests = [
+            _digest(source[offsets[bounds[index] - 1]:offsets[bounds[index + 1] - 1]])
+            for index in range(len(starts))
+        ]
+        start_index = dict((lineno, index) for index, lineno in enumerate(starts))
+        parsed = reused = 0
+        buf: List[str] = []
+        pending: List[Tuple[int, bytes, int, bytes, List[Any]]] = []
+        index = 0
+        while index < len(starts):
+            entry = self._get(digests[index])
+            if entry is not None:
+                span, combined, output = entry
+                next_index = index + abs(span)
+                if (next_index == len(starts)) == (span < 0) and next_index <= len(starts) and \
+                        _combine(digests[index:next_index]) == combined:
+                    buf.append(output)
+                    reused += next_index - index
+                    index = next_index
+                    continue
+            parsed_nodes, next_index = self._parse_segments(cursor, starts, start_index, index)
+            span = next_index - index if next_index < len(starts) else index - next_index
+            pending.append((len(buf), digests[index], span, _combine(digests[index:next_index]), parsed_nodes))
+            buf.append('')
+            parsed += next_index - index
+            index = next_index
+        # Segments are emitted after all of them are parsed, so that blocks of markup languages
+        # submitted to the executor of the syntax are compiled at the same time.
+        for position, key, span, combined, parsed_nodes in pending:
+            output = self.syntax.emit(parsed_nodes)
+            self._set(key, (span, combined, output))
+            buf[position] = output
+        if limits is not None:
+            limits.check_time(cursor)
+        self.parsed, self.reused = parsed, reused
+        result = ''.join(buf)
+        if strip:
+            result = result.strip()
+        return result
+
+
+def compile_incremental(source: str, syntax: Any, compiler: IncrementalCompiler, strip: bool = True,
+                        limits: Optional[Limits] = None) -> str:
+    """ Preprocessor counterpart of :meth:`IncrementalCompiler.compile`.
+    ``syntax`` is the syntax of the ``compiler``: it is here so that preprocessors of all kinds
+    have the same keywords.
+    """
+    return compiler.compile(source, strip, limits)
@@ -0,0 +1,263 @@
+""" A pool of long-lived Node.js processes for the JavaScript-based extensions.
+
+PyExecJS runs every call of a compiler in a new process of the external runtime, which loads
+the compiler script again. :class:`JSRuntimePool` keeps a few ``node`` processes running instead:
+every process loads the scripts of the compilers once and serves requests (JSON lines)
+from its standard input.
+
+The CoffeeScript and Stylus extensions (see :mod:`plim.extensions`) use :func:`default_pool`.
+Set the ``PLIM_JS_POOL_SIZE`` environment variable to change the number of processes,
+or to ``0`` to go through PyExecJS as before.
+"""
+import atexit
+import json
+import os
+import queue
+import shutil
+import subprocess
+import threading
+from typing import Any, Dict, IO, List, Optional, Sequence, Set
+
+from . import errors
+
+
+# Every request is a JSON line, and every response is a JSON line of {"result": ...} or {"error": "..."}.
+# A "load" request runs a script in a new context, and a "call" request calls a function
+# of a loaded context, such as "CoffeeScript.compile".
+SERVER_SCRIPT = r"""
+var vm = require('vm');
+var readline = require('readline');
+var contexts = {};
+var log = function () { process.stderr.write(Array.prototype.join.call(arguments, ' ') + '\n'); };
+var sandbox_console = {log: log, info: log, warn: log, error: log};
+
+function handle(request) {
+  if (request.op === 'load') {
+    var context = vm.createContext({require: require, console: sandbox_console});
+    vm.runInContext(request.script, context, {filename: request.name + '.js'});
+    contexts[request.name] = context;
+    return null;
+  }
+  var context = contexts[request.name];
+  var dot = request.function.lastIndexOf('.');
+  var owner = dot < 0 ? context : vm.runInContext(request.function.slice(0, dot), context);
+  return owner[request.function.slice(dot + 1)].apply(owner, request.args);
+}
+
+readline.createInterface({input: process.stdin, terminal: false}).on('line', function (line) {
+  var response;
+  try {
+    var result = handle(JSON.parse(line));
+    response = {result: result === undefined ? null : result};
+  } catch (error) {
+    response = {error: String(error)};
+  }
+  process.stdout.write(JSON.stringify(response) + '\n');
+});
+"""
+
+
+class _Worker(object):
+    """ A running ``node`` process and the names of the scripts it has loaded.
+    """
+
+    def __init__(self, command: Sequence[str]):
+        self.process = subprocess.Popen(
+            list(command) + ['-e', SERVER_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        assert self.process.stdin is not None and self.process.stdout is not None
+        self.stdin: IO[bytes] = self.process.stdin
+        self.stdout: IO[bytes] = self.process.stdout
+        self.loaded: Set[str] = set()
+
+    def request(self, request: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """ Sends the request and returns the response.
+
+        :param timeout: seconds to wait for the response before the process is killed, or None
+        :raises TimeoutError: if the process has been killed because of the timeout
+        :raises OSError: if the process has exited
+        """
+        self.stdin.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.stdin.flush()
+        expired = threading.Event()
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._expire, (expired,))
+            timer.daemon = True
+            timer.start()
+        try:
+            line = self.stdout.readline()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if not line:
+            if expired.is_set():
+                raise TimeoutError('The JavaScript runtime has not responded in {} seconds'.format(timeout))
+            raise OSError('The JavaScript runtime has exited with code {}'.format(self.process.poll()))
+        return json.loads(line.decode('utf-8'))
+
+    def _expire(self, expired: threading.Event) -> None:
+        expired.set()
+        self.process.kill()
+
+    def close(self) -> None:
+        try:
+            self.stdin.close()
+            self.process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.stdout.close()
+
+
+class JSRuntimePool(object):
+    """ A thread-safe pool of ``node`` processes.
+
+    Processes are started on demand, up to ``size`` of them, and every one of them loads the scripts
+    registered with :meth:`define` before its first call. A process that exits is replaced by a new one,
+    and the call that has found it dead is retried once. A process that doesn't respond in ``timeout`` seconds
+    is killed, and so is a process whose call has been interrupted by any other exception,
+    because its response would be read by the next call.
+    """
+
+    def __init__(self, size: int = 2, command: Sequence[str] = ('node',), timeout: Optional[float] = 60):
+        """
+        :param size: maximum number of processes
+        :param command: command that starts the runtime
+        :param timeout: maximum time of a call, in seconds, or None
+        """
+        if size < 1:
+            raise ValueError('size must be a positive number')
+        self.size = size
+        self.command = tuple(command)
+        self.timeout = timeout
+        self.scripts: Dict[str, str] = {}
+        self._idle: 'queue.LifoQueue[_Worker]' = queue.LifoQueue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # the number of processes that have been started to replace the exited ones
+        self.restarts = 0
+
+    def define(self, name: str, script: str) -> None:
+        """ Registers a script that every process runs in its own context before calling its functions.
+        """
+        self.scripts[name] = script
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked child must not share pipes with the processes of its parent
+                self._pid = os.getpid()
+                self._idle = queue.LifoQueue()
+                self._workers = []
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                if len(self._workers) < self.size:
+                    worker = _Worker(self.command)
+                    self._workers.append(worker)
+                    return worker
+            idle = self._idle
+        return idle.get()
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.close()
+        new_worker = _Worker(self.command)
+        with self._lock:
+            if worker in self._workers:
+                self._workers[self._workers.index(worker)] = new_worker
+            else:
+                self._workers.append(new_worker)
+            self.restarts += 1
+        return new_worker
+
+    def _call(self, worker: _Worker, name: str, function: str, args: Sequence[Any]) -> Dict[str, Any]:
+        if name not in worker.loaded:
+            response = worker.request({'op': 'load', 'name': name, 'script': self.scripts[name]}, self.timeout)
+            if 'error' in response:
+                return response
+            worker.loaded.add(name)
+        return worker.request({'op': 'call', 'name': name, 'function': function, 'args': list(args)}, self.timeout)
+
+    def call(self, name: str, function: str, *args: Any) -> Any:
+        """ Calls a function of the script, and returns its result.
+
+        :param name: name of a script registered with :meth:`define`
+        :param function: name of the function in the global scope of the script, such as ``CoffeeScript.compile``
+        :param args: JSON-serializable arguments
+        :raises plim.errors.JavaScriptError: if the function throws an error, the call times out,
+                                            or the runtime exits twice
+        """
+        if name not in self.scripts:
+            raise KeyError(name)
+        worker = self._acquire()
+        try:
+            try:
+                response = self._call(worker, name, function, args)
+            except TimeoutError:
+                raise
+            except (OSError, ValueError):
+                worker = self._replace(worker)
+                response = self._call(worker, name, function, args)
+        except BaseException as e:
+            # the process may still be working on the request, so it must not serve another one
+            self._idle.put(self._replace(worker))
+            if isinstance(e, (OSError, ValueError)):
+                raise errors.JavaScriptError(str(e))
+            raise
+        self._idle.put(worker)
+        if 'error' in response:
+            raise errors.JavaScriptError(response['error'])
+        return response['result']
+
+    def close(self) -> None:
+        """ Stops all the processes. The pool starts new ones if it is used again.
+        """
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._idle = queue.LifoQueue()
+            if self._pid != os.getpid():
+                return
+        for worker in workers:
+            worker.close()
+
+
+_default_pool: Optional[JSRuntimePool] = None
+_default_pool_configured = False
+_default_pool_lock = threading.Lock()
+
+
+def default_pool() -> Optional[JSRuntimePool]:
+    """ Returns the pool shared by the extensions, or None if ``node`` is not available
+    or the pool is disabled.
+    """
+    global _default_pool, _default_pool_configured
+    if not _default_pool_configured:
+        with _default_pool_lock:
+            if not _default_pool_configured:
+                size = int(os.environ.get('PLIM_JS_POOL_SIZE', 2))
+                if size and shutil.which('node') is not None:
+                    _default_pool = JSRuntimePool(size)
+                _default_pool_configured = True
+    return _default_pool
+
+
+def configure(size: int = 2, command: Sequence[str] = ('node',),
+              timeout: Optional[float] = 60) -> Optional[JSRuntimePool]:
+    """ Replaces the pool shared by the extensions. A ``size`` of ``0`` disables the pool.
+    """
+    global _default_pool, _default_pool_configured
+    with _default_pool_lock:
+        if _default_pool is not None:
+            _default_pool.close()
+        _default_pool = JSRuntimePool(size, command, timeout) if size else None
+        _default_pool_configured = True
+    return _default_pool
+
+
+@atexit.register
+def _close_default_pool() -> None:
+    if _default_pool is not None:
+        _default_pool.close()
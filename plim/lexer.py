@@ -2,17 +2,16 @@
 """Plim lexer"""
 import functools
 import re
-from typing import Optional, Tuple, Any, Mapping, Callable, Iterator, Sequence
+import time
+from array import array
+from typing import Optional, Tuple, Any, Callable, Collection, Dict, List, Mapping, Sequence, Iterator, Generator
 
-import markdown2
 from pyrsistent import v
 
 from . import errors
-from .util import StringIO, MAXSIZE, joined, space_separated, u
-from .extensions import rst_to_html
-from .extensions import coffee_to_js
-from .extensions import scss_to_css
-from .extensions import stylus_to_css
+from . import nodes
+from .util import MAXSIZE, joined, u
+from . import extensions
 
 
 # Preface
@@ -111,20 +110,37 @@ ATTRIBUTE_VALUE_TERMINATORS_WITH_PARENTHESES = v(
     NEWLINE
 )
 
+DYNAMIC_ATTRIBUTES_TERMINATORS = frozenset([
+    WHITESPACE,
+    NEWLINE,
+    LITERAL_CONTENT_PREFIX,
+    LITERAL_CONTENT_SPACE_PREFIX,
+    # we want to terminate extract_identifier() by DYNAMIC_ATTRIBUTES_PREFIX,
+    # but it contains two characters, whereas the function checks only one character.
+    # Therefore, we use a single asterisk terminator here instead of DYNAMIC_ATTRIBUTES_PREFIX.
+    '*',
+    INLINE_TAG_SEPARATOR,
+    LINE_BREAK
+])
+
+DYNAMIC_ATTRIBUTES_TERMINATORS_WITH_PARENTHESES = DYNAMIC_ATTRIBUTES_TERMINATORS | {CLOSE_BRACE}
+
 STATEMENT_TERMINATORS = {INLINE_TAG_SEPARATOR, NEWLINE}
 
-PYTHON_EXPR_OPEN_BRACES_RE = re.compile('(?P<start_brace>\(|\{|\[).*')
-PYTHON_EXPR_CLOSING_BRACES_RE = re.compile('\)|\}|\].*')
+WHITESPACE_RE = re.compile('\s*')
+
+PYTHON_EXPR_OPEN_BRACES_RE = re.compile('(?P<start_brace>\(|\{|\[)')
+PYTHON_EXPR_CLOSING_BRACES_RE = re.compile('\)|\}|\]')
 
-MAKO_EXPR_START_BRACE_RE = re.compile('(?P<start_brace>\$\{).*')
+MAKO_EXPR_START_BRACE_RE = re.compile('(?P<start_brace>\$\{)')
 MAKO_EXPR_COUNT_OPEN_BRACES_RE = re.compile('\{')
 MAKO_EXPR_COUNT_CLOSING_BRACES_RE = re.compile('\}')
-QUOTES_RE = re.compile('(?P<quote_type>\'\'\'|"""|\'|").*') # order matters!
+QUOTES_RE = re.compile('(?P<quote_type>\'\'\'|"""|\'|")') # order matters!
 
 EMBEDDING_QUOTE = '`'
 EMBEDDING_QUOTE_ESCAPE = EMBEDDING_QUOTE * 2
 EMBEDDING_QUOTE_END = '`_'
-EMBEDDING_QUOTES_RE = re.compile('(?P<quote_type>{quote_symbol}).*'.format(quote_symbol=EMBEDDING_QUOTE))
+EMBEDDING_QUOTES_RE = re.compile('(?P<quote_type>{quote_symbol})'.format(quote_symbol=EMBEDDING_QUOTE))
 
 
 # ============================================================================================
@@ -146,16 +162,18 @@ EMBEDDING_QUOTES_RE = re.compile('(?P<quote_type>{quote_symbol}).*'.format(quote
 #    2) ``current_line`` - a line which is being parsed. This is the line that has been matched by
 #       ``matched`` object at the previous parsing step.
 #    3) ``matched`` - an instance of ``re.MatchObject`` of the regex associated with the current parser.
-#    4) ``source`` - an instance of an enumerated object returned by :func:`enumerate_source`.
+#    4) ``source`` - an instance of :class:`SourceCursor` returned by :func:`enumerate_source`.
 #    5) ``syntax`` - an instance of one of :class:`plim.syntax.BaseSyntax` children.
 #
 #    Every parser MUST return a 4-tuple of:
-#    1) parsed_data - a string of successfully parsed data
+#    1) parsed_data - a node of :mod:`plim.nodes` (or a plain string) that represents
+#       the successfully parsed data. The tree is rendered into the target syntax by
+#       :meth:`plim.syntax.BaseSyntax.emit`.
 #    2) tail_indent - an indentation level of the ``tail line``
 #    3) tail_line - a line which indentation level (``tail_indent``) is lower or equal to
 #       the input ``indent_level``.
-#    4) ``source`` - an instance of enumerated object returned by :func:`enumerate_source`
-#       which represents the remaining (untouched) plim markup.
+#    4) ``source`` - the same :class:`SourceCursor` instance. Its current position points
+#       to the remaining (untouched) plim markup.
 # ------------------------------
 #
 # -- EXTRACTORS are "light" versions of parsers. Their input arguments
@@ -166,38 +184,446 @@ EMBEDDING_QUOTES_RE = re.compile('(?P<quote_type>{quote_symbol}).*'.format(quote
 #        If the attempt is successful, the extractor captures all the input characters up to
 #        the termination sequence.
 #      - The return value of the succeeded extractor MUST contain not only the extracted value,
-#        but also an instance of enumerated object returned by :func:`enumerate_source`.
+#        but also the :class:`SourceCursor` instance returned by :func:`enumerate_source`.
+#      - Extractors scan their input by index. Their private ``_scan_*`` counterparts accept
+#        a ``(line, pos)`` pair and return the new ``(line, pos)`` pair instead of the tail string.
 # ------------------------------
 #
-# P.S. I intentionally did not use "for" statements in conjunction with iterators.
-# I wanted to make all parsers free from implicit side-effects.
-# Therefore, you can find a number of "while True" and "try/except StopIteration" constructs below.
+# P.S. All parsers read the source through a single stateful :class:`SourceCursor`.
+# When the source is exhausted, :meth:`SourceCursor.advance` returns None,
+# so you can find a number of "while True" loops with explicit end-of-source checks below.
+
+# Source cursor
+# ==================================================================================
+class SourceCursor(object):
+    """ A stateful cursor over the lines of a template source.
+
+    The cursor keeps the source string and a table of line start offsets, and slices
+    a line out of the source only when that line is requested. Line numbers start from 1.
+    ``lineno`` is the number of the last line returned by :meth:`advance` (0 before the first line).
+
+    The indentation of every line is computed once, when the cursor is created, so that parsers
+    can find the ends of indented blocks without looking at the lines themselves
+    (see :meth:`scan_next` and :meth:`find_dedent`).
+
+    For backward compatibility the cursor also implements the iterator protocol
+    of ``enumerate(StringIO(source), start=1)``.
+    """
+    __slots__ = ('source', 'line_offsets', 'indents', 'lineno')
+
+    def __init__(self, source: str):
+        self.source = source
+        self.lineno = 0
+        # line N spans source[line_offsets[N - 1]:line_offsets[N]]
+        line_offsets = array('q', [0])
+        # indents[N - 1] is the indentation width of line N, or -1 if the line is blank
+        indents = array('i')
+        lines = source.split(NEWLINE)
+        if not lines[-1]:
+            # the source ends with a newline character (or it is empty)
+            lines.pop()
+        offset = 0
+        for line in lines:
+            offset += len(line) + 1
+            line_offsets.append(offset)
+            stripped = line.lstrip()
+            indents.append(len(line) - len(stripped) if stripped else -1)
+        if offset > len(source):
+            line_offsets[-1] = len(source)
+        self.line_offsets = line_offsets
+        self.indents = indents
+
+    @property
+    def line_count(self) -> int:
+        return len(self.line_offsets) - 1
+
+    def line(self, lineno: int) -> str:
+        """ Returns the line with the given number, including the trailing newline character.
+        """
+        if not 0 < lineno < len(self.line_offsets):
+            raise IndexError(lineno)
+        return self.source[self.line_offsets[lineno - 1]:self.line_offsets[lineno]]
+
+    def peek(self) -> Optional[str]:
+        """ Returns the next line without moving the cursor, or None if the source is exhausted.
+        """
+        lineno = self.lineno + 1
+        if lineno < len(self.line_offsets):
+            return self.source[self.line_offsets[lineno - 1]:self.line_offsets[lineno]]
+        return None
+
+    def advance(self) -> Optional[str]:
+        """ Moves the cursor to the next line and returns it, or returns None if the source is exhausted.
+        """
+        lineno = self.lineno + 1
+        if lineno < len(self.line_offsets):
+            self.lineno = lineno
+            return self.source[self.line_offsets[lineno - 1]:self.line_offsets[lineno]]
+        return None
+
+    def jump(self, lineno: int) -> None:
+        """ Moves the cursor so that the next call to :meth:`advance` returns the line ``lineno``.
+        """
+        if not 0 < lineno <= len(self.line_offsets):
+            raise IndexError(lineno)
+        self.lineno = lineno - 1
+
+    def indent(self, lineno: int) -> int:
+        """ Returns the indentation width of the line with the given number, or -1 if the line is blank.
+        """
+        if not 0 < lineno < len(self.line_offsets):
+            raise IndexError(lineno)
+        return self.indents[lineno - 1]
+
+    def scan_next(self) -> Tuple[Optional[int], Optional[str]]:
+        """ Moves the cursor to the next line and returns the result of :func:`scan_line` for it,
+        or (None, None) if the source is exhausted. Blank lines are returned as (0, '').
+        """
+        lineno = self.lineno + 1
+        line_offsets = self.line_offsets
+        if lineno < len(line_offsets):
+            self.lineno = lineno
+            indent = self.indents[lineno - 1]
+            if indent < 0:
+                return 0, ''
+            end = line_offsets[lineno]
+            if self.source[end - 1] == NEWLINE:
+                end -= 1
+            return indent, self.source[line_offsets[lineno - 1] + indent:end]
+        return None, None
+
+    def find_dedent(self, indent_level: int) -> int:
+        """ Returns the number of the first non-blank line after the current one that is indented
+        at most by ``indent_level``, or ``line_count + 1`` if there is no such line.
+        The cursor doesn't move.
+        """
+        indents = self.indents
+        for index in range(self.lineno, len(indents)):
+            if 0 <= indents[index] <= indent_level:
+                return index + 1
+        return len(indents) + 1
+
+    def release(self) -> None:
+        """ Tells the cursor that the lines up to the current one won't be requested anymore.
+        In-memory sources ignore it.
+        """
+
+    def __iter__(self) -> 'SourceCursor':
+        return self
+
+    def __next__(self) -> Tuple[int, str]:
+        line = self.advance()
+        if line is None:
+            raise StopIteration
+        return self.lineno, line
+
+
+class StreamSourceCursor(SourceCursor):
+    """ A :class:`SourceCursor` that reads lines from a file object on demand.
+
+    The cursor keeps the lines that have been read but not yet released by :meth:`release`,
+    so its memory usage doesn't depend on the size of the source. ``line_count`` is the number
+    of lines read so far.
+    """
+    __slots__ = ('stream', 'lines', 'first_lineno')
+
+    def __init__(self, stream: Any):
+        """
+        :param stream: a text file object
+        """
+        self.stream = stream
+        self.lineno = 0
+        # lines[0] is the line number ``first_lineno``
+        self.lines: list[str] = []
+        self.first_lineno = 1
+
+    def _read_line(self) -> bool:
+        line = self.stream.readline()
+        if not line:
+            return False
+        if line.endswith('\r\n'):
+            # see the same fix for in-memory sources in compile_plim_source()
+            line = line[:-2] + NEWLINE
+        self.lines.append(line)
+        return True
+
+    @property
+    def line_count(self) -> int:
+        return self.first_lineno - 1 + len(self.lines)
+
+    def line(self, lineno: int) -> str:
+        index = lineno - self.first_lineno
+        if index < 0:
+            raise IndexError(lineno)
+        while index >= len(self.lines):
+            if not self._read_line():
+                raise IndexError(lineno)
+        return self.lines[index]
+
+    def peek(self) -> Optional[str]:
+        try:
+            return self.line(self.lineno + 1)
+        except IndexError:
+            return None
+
+    def advance(self) -> Optional[str]:
+        line = self.peek()
+        if line is not None:
+            self.lineno += 1
+        return line
+
+    def jump(self, lineno: int) -> None:
+        if lineno < self.first_lineno:
+            raise IndexError(lineno)
+        self.lineno = lineno - 1
+
+    def release(self) -> None:
+        del self.lines[:self.lineno - self.first_lineno + 1]
+        self.first_lineno = self.lineno + 1
+
+    def indent(self, lineno: int) -> int:
+        line = self.line(lineno)
+        stripped = line.lstrip()
+        return len(line) - len(stripped) if stripped else -1
+
+    def scan_next(self) -> Tuple[Optional[int], Optional[str]]:
+        line = self.advance()
+        if line is None:
+            return None, None
+        stripped = line.lstrip()
+        if not stripped:
+            return 0, ''
+        return len(line) - len(stripped), stripped.rstrip(NEWLINE)
+
+    def find_dedent(self, indent_level: int) -> int:
+        lineno = self.lineno + 1
+        while True:
+            try:
+                indent = self.indent(lineno)
+            except IndexError:
+                return lineno
+            if 0 <= indent <= indent_level:
+                return lineno
+            lineno += 1
+
+
+class LimitedSourceCursor(SourceCursor):
+    """ A :class:`SourceCursor` that raises :class:`plim.errors.CompileLimitExceeded`
+    when it moves to the next line after the ``timeout`` has expired.
+    :func:`_run` calls :meth:`check_deadline` between the nested blocks of a line as well.
+    """
+    __slots__ = ('timeout', 'deadline')
+
+    def __init__(self, source: str, timeout: float, started_at: Optional[float] = None):
+        """
+        :param source:
+        :param timeout: maximum time of compilation, in seconds
+        :param started_at: the value of :func:`time.perf_counter` when compilation has started
+        """
+        if started_at is None:
+            started_at = time.perf_counter()
+        super(LimitedSourceCursor, self).__init__(source)
+        self.timeout = timeout
+        self.deadline = started_at + timeout
+
+    def check_deadline(self) -> None:
+        now = time.perf_counter()
+        if now > self.deadline:
+            raise errors.CompileLimitExceeded('timeout', now - self.deadline + self.timeout,
+                                              self.timeout, max(self.lineno, 1))
+
+    def advance(self) -> Optional[str]:
+        self.check_deadline()
+        return super(LimitedSourceCursor, self).advance()
+
+    def scan_next(self) -> Tuple[Optional[int], Optional[str]]:
+        self.check_deadline()
+        return super(LimitedSourceCursor, self).scan_next()
+
+
+class LimitedStreamSourceCursor(StreamSourceCursor):
+    """ A :class:`StreamSourceCursor` that checks every line of the source against :class:`Limits`
+    as soon as it is read, and raises :class:`plim.errors.CompileLimitExceeded`
+    when it moves to the next line after the timeout has expired.
+    """
+    __slots__ = ('limits', 'size', 'levels', 'started_at')
+
+    def __init__(self, stream: Any, limits: 'Limits', started_at: Optional[float] = None):
+        """
+        :param stream: a text file object
+        :param limits:
+        :param started_at: the value of :func:`time.perf_counter` when compilation has started
+        """
+        if started_at is None:
+            started_at = time.perf_counter()
+        super(LimitedStreamSourceCursor, self).__init__(stream)
+        self.limits = limits
+        # number of characters read so far
+        self.size = 0
+        # indents of the enclosing lines of the last non-blank line
+        self.levels: List[int] = []
+        self.started_at = started_at
+
+    def _read_line(self) -> bool:
+        if not super(LimitedStreamSourceCursor, self)._read_line():
+            return False
+        limits = self.limits
+        line = self.lines[-1]
+        lineno = self.line_count
+        self.size += len(line)
+        if limits.max_source_size is not None and self.size > limits.max_source_size:
+            raise errors.CompileLimitExceeded('max_source_size', self.size, limits.max_source_size, lineno)
+        length = len(line) - line.endswith(NEWLINE)
+        if limits.max_line_length is not None and length > limits.max_line_length:
+            raise errors.CompileLimitExceeded('max_line_length', length, limits.max_line_length, lineno)
+        stripped = line.lstrip()
+        if limits.max_depth is not None and stripped:
+            indent = len(line) - len(stripped)
+            levels = self.levels
+            while levels and levels[-1] >= indent:
+                levels.pop()
+            levels.append(indent)
+            if len(levels) > limits.max_depth:
+                raise errors.CompileLimitExceeded('max_depth', len(levels), limits.max_depth, lineno)
+        return True
+
+    def check_deadline(self) -> None:
+        timeout = self.limits.timeout
+        if timeout is None:
+            return
+        elapsed = time.perf_counter() - self.started_at
+        if elapsed > timeout:
+            raise errors.CompileLimitExceeded('timeout', elapsed, timeout, max(self.lineno, 1))
+
+    def advance(self) -> Optional[str]:
+        self.check_deadline()
+        return super(LimitedStreamSourceCursor, self).advance()
+
+
+class Limits(object):
+    """ Limits of compilation of a single template, so that a malformed or a huge template
+    fails with :class:`plim.errors.CompileLimitExceeded` instead of keeping a process busy.
+    Every limit is optional.
+
+    The size of the source, the lengths of its lines, and the depth of its indentation
+    are checked before parsing, or as the lines are read if the source is a file object (see :meth:`open_stream`).
+    The timeout is checked between lines: every time the parser moves to the next line of the source,
+    and between the nested blocks of a line, such as ``div: p: a``, and once more after the template
+    is compiled. A single step of parsing, such as a long attribute list, or compilation of a block
+    of a markup language is not interrupted.
+    """
+    __slots__ = ('max_source_size', 'max_line_length', 'max_depth', 'timeout')
+
+    def __init__(self, max_source_size: Optional[int] = None, max_line_length: Optional[int] = None,
+                 max_depth: Optional[int] = None, timeout: Optional[float] = None):
+        """
+        :param max_source_size: maximum number of characters of the source
+        :param max_line_length: maximum number of characters of a line, including its indentation
+        :param max_depth: maximum number of nested levels of indentation. Lines without indentation
+                          are at the first level.
+        :param timeout: maximum time of compilation, in seconds
+        """
+        self.max_source_size = max_source_size
+        self.max_line_length = max_line_length
+        self.max_depth = max_depth
+        self.timeout = timeout
+
+    def __repr__(self) -> str:
+        return 'Limits({})'.format(', '.join(
+            '{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__
+            if getattr(self, name) is not None
+        ))
+
+    def open(self, source: str) -> SourceCursor:
+        """ Checks the source and returns a cursor over it that enforces the timeout.
+
+        :raises plim.errors.CompileLimitExceeded: if the source exceeds a limit
+        """
+        started_at = time.perf_counter()
+        if self.max_source_size is not None and len(source) > self.max_source_size:
+            raise errors.CompileLimitExceeded('max_source_size', len(source), self.max_source_size,
+                                              source.count(NEWLINE, 0, self.max_source_size) + 1)
+        if self.max_line_length is not None:
+            lengths = [len(line) for line in source.split(NEWLINE)]
+            longest = max(lengths)
+            if longest > self.max_line_length:
+                lineno = next(index for index, length in enumerate(lengths, 1) if length > self.max_line_length)
+                raise errors.CompileLimitExceeded('max_line_length', lengths[lineno - 1],
+                                                  self.max_line_length, lineno)
+        if self.timeout is not None:
+            cursor: SourceCursor = LimitedSourceCursor(source, self.timeout, started_at)
+        else:
+            cursor = SourceCursor(source)
+        if self.max_depth is not None:
+            # indents of the enclosing lines of the current one
+            levels: list[int] = []
+            for index, indent in enumerate(cursor.indents):
+                if indent < 0:
+                    continue
+                while levels and levels[-1] >= indent:
+                    levels.pop()
+                levels.append(indent)
+                if len(levels) > self.max_depth:
+                    raise errors.CompileLimitExceeded('max_depth', len(levels), self.max_depth, index + 1)
+        return cursor
+
+    def open_stream(self, stream: Any) -> SourceCursor:
+        """ Returns a cursor over the lines of a text file object that checks every line as soon as
+        it is read, and enforces the timeout.
+
+        Unlike :meth:`open`, the source isn't read before parsing, so a limit may be exceeded
+        after a part of the template has been compiled. The value of an exceeded ``max_source_size``
+        is the number of characters read so far.
+        """
+        return LimitedStreamSourceCursor(stream, self)
+
+    def check_time(self, source: SourceCursor) -> None:
+        """ Checks the timeout of a cursor returned by :meth:`open` or :meth:`open_stream`.
+        """
+        if isinstance(source, (LimitedSourceCursor, LimitedStreamSourceCursor)):
+            source.check_deadline()
+
+
+def _next_line_or_fail(source: SourceCursor, line: str) -> str:
+    """ Returns the next line of a construct that cannot end with the source.
+    """
+    next_line = source.advance()
+    if next_line is None:
+        raise errors.PlimSyntaxError('Unexpected end of source', line)
+    return next_line
+
 
 # Searchers
 # ==================================================================================
-SourceIter = Iterator[tuple[int, str]]
-Parsed = Tuple[str, int, str, str]
+Parsed = Tuple[Any, int, str, SourceCursor]
+# Block parsers are generators that yield their node as soon as it is created, then (indent, line)
+# of child lines, and return (parsed_data, tail_indent, tail_line)
+BlockParser = Generator[Any, Tuple[Any, int, str], Tuple[Any, int, str]]
 
-def search_quotes(line: str, escape_char: str = '\\', quotes_re = QUOTES_RE) -> Optional[int]:
+def search_quotes(line: str, escape_char: str = '\\', quotes_re = QUOTES_RE, pos: int = 0) -> Optional[int]:
     """
     :param line: may be empty
     :param escape_char:
+    :param pos: position of the opening quote in ``line``
+    :return: position right after the closing quote
     """
-    match = quotes_re.match(line)
+    match = quotes_re.match(line, pos)
     if not match: return None
 
     find_seq = match.group('quote_type')
-    find_seq_len = len(find_seq)
-    pos = find_seq_len
-    line_len = len(line)
-
-    while pos < line_len:
-        if line[pos] == escape_char:
-            pos += 2
-            continue
-        if line[pos:].startswith(find_seq):
-            return pos + find_seq_len
-        pos += 1
+    pos = match.end('quote_type')
+
+    # Jump straight to the next closing quote candidate, and then check whether there are
+    # escape characters between the current position and that candidate.
+    # Every escape character skips the character that follows it.
+    quote_pos = line.find(find_seq, pos)
+    while quote_pos >= 0:
+        escape_pos = line.find(escape_char, pos, quote_pos)
+        if escape_pos < 0:
+            return quote_pos + len(find_seq)
+        pos = escape_pos + 2
+        if pos > quote_pos:
+            quote_pos = line.find(find_seq, pos)
     return None
 
 
@@ -208,109 +634,140 @@ def search_parser(lineno, line, syntax) -> Tuple[Any, Any]:
     :param line:
     :type syntax: :class:`plim.syntax.BaseSyntax`
     """
-    for template, parser in syntax.parsers:
+    for template, parser in syntax.parsers_for(line):
         matched = template.match(line)
         if matched:
             return matched, parser
     raise errors.ParserNotFound(lineno, line)
 
 
+def has_parser(line: str, syntax: Any) -> bool:
+    """ Checks whether any parser of the syntax accepts the line, without raising :class:`plim.errors.ParserNotFound`.
+
+    :param line:
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    """
+    for template, _ in syntax.parsers_for(line):
+        if template.match(line):
+            return True
+    return False
+
+
 # Extractors
 # ==================================================================================
-def extract_embedding_quotes(content) -> Optional[Tuple[Any, Any, Any]]:
-    """
-    ``content`` may be empty
+def _scan_embedding_quotes(content: str, pos: int) -> Optional[Tuple[str, int]]:
+    """ Index-based version of :func:`extract_embedding_quotes`.
 
     :param content:
-    :param escape_seq:
+    :param pos: position of the opening embedding quote in ``content``
+    :return: 2-tuple of (embedded_string, position right after the closing quote)
     """
-    match = EMBEDDING_QUOTES_RE.match(content)
-    if not match:
+    if not EMBEDDING_QUOTES_RE.match(content, pos):
         return None
 
-    original_string = [EMBEDDING_QUOTE]
     embedded_string = []
-    tail = content[1:]
-
-    while tail:
-        if tail.startswith(EMBEDDING_QUOTE_ESCAPE):
-            original_string.append(EMBEDDING_QUOTE_ESCAPE)
-            embedded_string.append(EMBEDDING_QUOTE)
-            tail = tail[len(EMBEDDING_QUOTE_ESCAPE):]
+    original_start = pos
+    pos += len(EMBEDDING_QUOTE)
+    start = pos
+    while True:
+        pos = content.find(EMBEDDING_QUOTE, pos)
+        if pos < 0:
+            original_string = content[original_start:]
+            raise errors.PlimSyntaxError(
+                u('Embedding quote is not closed: "{}"').format(original_string), len(original_string)
+            )
+
+        if content.startswith(EMBEDDING_QUOTE_ESCAPE, pos):
+            embedded_string.extend([content[start:pos], EMBEDDING_QUOTE])
+            pos += len(EMBEDDING_QUOTE_ESCAPE)
+            start = pos
             continue
 
-        if tail.startswith(EMBEDDING_QUOTE):
-            append_seq = EMBEDDING_QUOTE_END if tail.startswith(EMBEDDING_QUOTE_END) else EMBEDDING_QUOTE
-            original_string.append(append_seq)
-            original_string_str = joined(original_string)
-            content = content[len(original_string_str):]
-            embedded_string_str = joined(embedded_string)
-            return embedded_string_str, original_string_str, content
-
-        current_char = tail[0]
-        original_string.append(current_char)
-        embedded_string.append(current_char)
-        tail = tail[1:]
+        embedded_string.append(content[start:pos])
+        end_seq = EMBEDDING_QUOTE_END if content.startswith(EMBEDDING_QUOTE_END, pos) else EMBEDDING_QUOTE
+        return joined(embedded_string), pos + len(end_seq)
 
-    original_string_str = joined(original_string)
-    pos = len(original_string_str)
-    raise errors.PlimSyntaxError(u('Embedding quote is not closed: "{}"').format(original_string_str), pos)
 
+def extract_embedding_quotes(content) -> Optional[Tuple[Any, Any, Any]]:
+    """
+    ``content`` may be empty
 
-def _extract_braces_expression(
-    line: str, source: SourceIter, starting_braces_re, open_braces_re, closing_braces_re
-) -> Optional[Tuple[Any, Any, Any]]:
+    :param content:
     """
+    result = _scan_embedding_quotes(content, 0)
+    if result is None:
+        return None
+    embedded_string, end = result
+    return embedded_string, content[:end], content[end:]
 
-    :param line: may be empty
-    :param source:
-    :param starting_braces_re:
-    :param open_braces_re:
-    :param closing_braces_re:
+
+def _scan_braces_expression(
+    line: str, pos: int, source: SourceCursor, starting_braces_re, open_braces_re, closing_braces_re
+) -> Optional[Tuple[list[str], str, int, SourceCursor]]:
+    """ Index-based version of :func:`_extract_braces_expression`. Instead of slicing the line
+    on every character, it advances ``pos`` and slices only once per consumed line.
+
+    :return: 4-tuple of (expression_chunks, line, pos, source), where ``expression_chunks`` contains
+             one chunk per source line, and ``line[pos:]`` is the remainder of the last consumed line.
     """
-    match = starting_braces_re.match(line)
+    match = starting_braces_re.match(line, pos)
     if not match:
         return None
 
-    open_brace = match.group('start_brace')
-    buf = [open_brace]
-    tail = line[len(open_brace):]
+    chunks = []
+    start = pos
+    pos = match.end('start_brace')
     braces_counter = 1
 
     while True:
-        if not tail:
-            _, tail = next(source)
-            tail = tail.lstrip()
-
-        while tail:
-            current_char = tail[0]
+        line_len = len(line)
+        while pos < line_len:
+            current_char = line[pos]
             if closing_braces_re.match(current_char):
                 braces_counter -= 1
-                buf.append(current_char)
+                pos += 1
                 if braces_counter:
-                    tail = tail[1:]
                     continue
-                return joined(buf), tail[1:], source
+                chunks.append(line[start:pos])
+                return chunks, line, pos, source
 
             if current_char == NEWLINE:
-                _, tail = next(source)
-                tail = tail.lstrip()
-                continue
+                break
 
             if open_braces_re.match(current_char):
                 braces_counter += 1
-                buf.append(current_char)
-                tail = tail[1:]
+                pos += 1
                 continue
 
-            result = search_quotes(tail)
+            result = search_quotes(line, pos=pos)
             if result is not None:
-                buf.append(tail[:result])
-                tail = tail[result:]
+                pos = result
                 continue
 
-            buf.append(current_char)
-            tail = tail[1:]
+            pos += 1
+
+        # the expression continues on the next line
+        chunks.append(line[start:pos])
+        line = _next_line_or_fail(source, joined(chunks)).lstrip()
+        start = pos = 0
+
+
+def _extract_braces_expression(
+    line: str, source: SourceCursor, starting_braces_re, open_braces_re, closing_braces_re
+) -> Optional[Tuple[Any, Any, Any]]:
+    """
+
+    :param line: may be empty
+    :param source:
+    :param starting_braces_re:
+    :param open_braces_re:
+    :param closing_braces_re:
+    """
+    result = _scan_braces_expression(line, 0, source, starting_braces_re, open_braces_re, closing_braces_re)
+    if result is None:
+        return None
+    chunks, line, pos, source = result
+    return joined(chunks), line[pos:], source
 
 
 extract_braces = lambda line, source: _extract_braces_expression(line, source,
@@ -325,6 +782,63 @@ extract_mako_expression = lambda line, source: _extract_braces_expression(line,
     MAKO_EXPR_COUNT_CLOSING_BRACES_RE
 )
 
+_scan_braces = lambda line, pos, source: _scan_braces_expression(line, pos, source,
+    PYTHON_EXPR_OPEN_BRACES_RE,
+    PYTHON_EXPR_OPEN_BRACES_RE,
+    PYTHON_EXPR_CLOSING_BRACES_RE
+)
+
+_scan_mako_expression = lambda line, pos, source: _scan_braces_expression(line, pos, source,
+    MAKO_EXPR_START_BRACE_RE,
+    MAKO_EXPR_COUNT_OPEN_BRACES_RE,
+    MAKO_EXPR_COUNT_CLOSING_BRACES_RE
+)
+
+
+def _scan_identifier(line: str, pos: int, source, identifier_start: str,
+                     terminators: Collection[str]) -> Optional[Tuple[str, str, int, Any]]:
+    """ Index-based version of :func:`extract_identifier`.
+
+    :return: 4-tuple of (identifier, line, pos, source), where ``line[pos:]`` is the tail.
+    """
+    if pos >= len(line) or not line.startswith(identifier_start, pos):
+        return None
+
+    buf = []
+    start = pos
+    pos += len(identifier_start)
+    while pos < len(line):
+        for terminator in terminators:
+            if line.startswith(terminator, pos):
+                buf.append(line[start:pos])
+                return joined(buf).rstrip(), line, pos, source
+
+        # Let's try to find "mako variable" part of possible css-identifier
+        result = _scan_mako_expression(line, pos, source)
+        if result is None:
+            # Check for a string object
+            result_pos = search_quotes(line, pos=pos)
+            if result_pos is not None:
+                pos = result_pos
+                continue
+            # Try to search braces of function calls etc
+            result = _scan_braces(line, pos, source)
+
+        if result is not None:
+            chunks, next_line, pos_after, source = result
+            if len(chunks) > 1:
+                # the expression has consumed several lines of the source
+                buf.append(line[start:pos])
+                buf.extend(chunks)
+                start = pos_after
+            line, pos = next_line, pos_after
+            continue
+
+        pos += 1
+
+    buf.append(line[start:pos])
+    return joined(buf).rstrip(), line, pos, source
+
 
 def extract_identifier(line: str, source, identifier_start: str = '#',
                        terminators: Sequence[str] = v('.', ' ', CLOSE_BRACE, INLINE_TAG_SEPARATOR)
@@ -337,47 +851,52 @@ def extract_identifier(line: str, source, identifier_start: str = '#',
     :param identifier_start:
     :param terminators:
     """
-    if not line or not line.startswith(identifier_start):
+    result = _scan_identifier(line, 0, source, identifier_start, terminators)
+    if result is None:
         return None
+    identifier, line, pos, source = result
+    return identifier, line[pos:], source
 
-    pos = len(identifier_start)
-    buf = [identifier_start]
-    tail = line[pos:]
-    while tail:
-        for terminator in terminators:
-            if tail.startswith(terminator):
-                return joined(buf).rstrip(), tail, source
 
-        # Let's try to find "mako variable" part of possible css-identifier
-        result = extract_mako_expression(tail, source)
-        if result:
-            expr, tail, source = result
-            buf.append(expr)
-            continue
+def _scan_digital_attr_value(line: str, pos: int) -> Optional[Tuple[str, int]]:
+    result = NUMERIC_VALUE_RE.match(line, pos)
+    if result:
+        return result.group('value'), result.end()
+    return None
 
-        # Check for a string object
-        result_pos = search_quotes(tail)
-        if result_pos is not None:
-            buf.append(tail[:result_pos])
-            tail = tail[result_pos:]
-            continue
 
-        # Try to search braces of function calls etc
-        result = extract_braces(tail, source)
-        if result:
-            result, tail, source = result
-            buf.append(result)
-            continue
-        current_char = tail[0]
-        buf.append(current_char)
-        tail = tail[1:]
-    return joined(buf).rstrip(), tail, source
+def extract_digital_attr_value(line):
+    result = _scan_digital_attr_value(line, 0)
+    if result:
+        value, pos = result
+        return value, line[pos:]
+    return None
 
 
-def extract_digital_attr_value(line):
-    result = NUMERIC_VALUE_RE.match(line)
+def _unquote_attr_value(line: str, pos: int, end: int, remove_escape_seq: bool) -> str:
+    """
+    :param line:
+    :param pos: position of the opening quote
+    :param end: position right after the closing quote
+    :param remove_escape_seq:
+    """
+    if line.startswith('"""', pos) or line.startswith("'''", pos):
+        skip = 3
+    else:
+        skip = 1
+    # remove quotes from value
+    value = line[pos + skip:end - skip]
+    # We have to remove backslash escape sequences from the value, but
+    # at the same time, preserve unicode escape sequences like "\u4e2d\u6587".
+    if remove_escape_seq:
+        value = value.encode('raw_unicode_escape').decode('unicode_escape')
+    return value
+
+
+def _scan_quoted_attr_value(line: str, pos: int) -> Optional[Tuple[str, int]]:
+    result = search_quotes(line, pos=pos)
     if result:
-        return result.group('value'), line[result.end():]
+        return _unquote_attr_value(line, pos, result, True), result
     return None
 
 
@@ -392,154 +911,156 @@ def extract_quoted_attr_value(line, search_quotes=search_quotes, remove_escape_s
     """
     result = search_quotes(line)
     if result:
-        if line.startswith('"""') or line.startswith("'''"):
-            skip = 3
-        else:
-            skip = 1
-        # remove quotes from value
-        value = line[skip:result - skip]
-        # We have to remove backslash escape sequences from the value, but
-        # at the same time, preserve unicode escape sequences like "\u4e2d\u6587".
-        if remove_escape_seq:
-            value = value.encode('raw_unicode_escape')
-            value = value.decode('unicode_escape')
-        return value, line[result:]
+        return _unquote_attr_value(line, 0, result, remove_escape_seq), line[result:]
     return None
 
 
-def extract_dynamic_attr_value(line, source, terminators, syntax):
-    result = extract_identifier(line, source, '', terminators)
-    if result is None:
+def _scan_dynamic_attr_value(line: str, pos: int, source, terminators, syntax) -> Optional[Tuple[str, str, int, Any]]:
+    identifier = _scan_identifier(line, pos, source, '', terminators)
+    if identifier is None:
         return None
-    result, tail, source = result
-    if MAKO_EXPR_START_BRACE_RE.match(line):
+    result, tail_line, tail_pos, source = identifier
+    if MAKO_EXPR_START_BRACE_RE.match(line, pos):
         # remove VARIABLE_PLACEHOLDER_START_SEQUENCE and VARIABLE_PLACEHOLDER_END_SEQUENCE from variable
         value = result[len(syntax.VARIABLE_PLACEHOLDER_START_SEQUENCE):-len(syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE)]
-    elif line.startswith(OPEN_BRACE):
+    elif line.startswith(OPEN_BRACE, pos):
         # remove "(" and ")" from variable
         value = result[1:-1]
     else:
         value = result
-    return value, tail, source
+    return value, tail_line, tail_pos, source
 
 
-def extract_dynamic_tag_attributes(line: str, source: str, syntax, inside_parentheses=False) -> Optional[Tuple[Any, Any, Any]]:
-    """
-    Extract one occurrence of ``**dynamic_attributes``
-    :param line:
-    :param source:
-    :param inside_parentheses:
-    """
-    if not line.startswith(DYNAMIC_ATTRIBUTES_PREFIX):
+def extract_dynamic_attr_value(line, source, terminators, syntax):
+    result = _scan_dynamic_attr_value(line, 0, source, terminators, syntax)
+    if result is None:
         return None
-    line = line[len(DYNAMIC_ATTRIBUTES_PREFIX):]
+    value, line, pos, source = result
+    return value, line[pos:], source
 
-    terminators = {
-        WHITESPACE,
-        NEWLINE,
-        LITERAL_CONTENT_PREFIX,
-        LITERAL_CONTENT_SPACE_PREFIX,
-        # we want to terminate extract_identifier() by DYNAMIC_ATTRIBUTES_PREFIX,
-        # but it contains two characters, whereas the function checks only one character.
-        # Therefore, we use a single asterisk terminator here instead of DYNAMIC_ATTRIBUTES_PREFIX.
-        '*',
-        INLINE_TAG_SEPARATOR,
-        LINE_BREAK
-    }
-    if inside_parentheses:
-        terminators.add(CLOSE_BRACE)
 
-    result = extract_identifier(line, source, '', terminators)
+def _scan_dynamic_tag_attributes(line: str, pos: int, source, syntax,
+                                 inside_parentheses=False) -> Optional[Tuple[nodes.Attr, str, int, Any]]:
+    if not line.startswith(DYNAMIC_ATTRIBUTES_PREFIX, pos):
+        return None
+    pos += len(DYNAMIC_ATTRIBUTES_PREFIX)
+
+    terminators = inside_parentheses and DYNAMIC_ATTRIBUTES_TERMINATORS_WITH_PARENTHESES or DYNAMIC_ATTRIBUTES_TERMINATORS
+    result = _scan_identifier(line, pos, source, '', terminators)
     if result is None:
         return None
 
-    expr, tail, source = result
-    attributes = u(
-        '\n%for __plim_key__, __plim_value__ in {expr}.items():\n'
-        '{var_start}__plim_key__{var_end}="{var_start}__plim_value__{var_end}"\n'
-        '%endfor\n'
-    ).format(
-        expr=expr,
-        var_start=syntax.VARIABLE_PLACEHOLDER_START_SEQUENCE,
-        var_end=syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE
-    )
-    return attributes, tail, source
+    expr, line, pos, source = result
+    return nodes.Attr(None, expr, nodes.ATTR_SPREAD), line, pos, source
 
 
-def extract_tag_attribute(line: str, source: str, syntax, inside_parentheses=False):
+def extract_dynamic_tag_attributes(line: str, source: str, syntax, inside_parentheses=False) -> Optional[Tuple[Any, Any, Any]]:
     """
-
+    Extract one occurrence of ``**dynamic_attributes``
     :param line:
     :param source:
     :param inside_parentheses:
-    :return:
+    """
+    result = _scan_dynamic_tag_attributes(line, 0, source, syntax, inside_parentheses)
+    if result is None:
+        return None
+    attribute, line, pos, source = result
+    return syntax.emit_attr(attribute), line[pos:], source
+
+
+def _scan_tag_attribute(line: str, pos: int, source, syntax,
+                        inside_parentheses=False) -> Optional[Tuple[nodes.Attr, str, int, Any]]:
+    """ Index-based version of :func:`extract_tag_attribute`.
     """
     terminators = inside_parentheses and ATTRIBUTE_TERMINATORS_WITH_PARENTHESES or ATTRIBUTE_TERMINATORS
-    result = extract_identifier(line, source, '', terminators)
+    result = _scan_identifier(line, pos, source, '', terminators)
     if result and result[0]:
-        result, tail, source = result
-        attr_name = result
-        if tail.startswith(ATTRIBUTE_VALUE_DELIMITER):
+        attr_name, line, pos, source = result
+        if line.startswith(ATTRIBUTE_VALUE_DELIMITER, pos):
             # value is presented in a form of
             # =${dynamic_value} or =dynamic_value or ="value with spaces"
             # ------------------------------------------------------------------
             # remove ATTRIBUTE_VALUE_DELIMITER
-            tail = tail[1:]
+            pos += 1
             # 1. Try to parse quoted literal value
             # -------------------------------------
-            result = extract_quoted_attr_value(tail)
-            if result:
-                value, tail = result
+            quoted = _scan_quoted_attr_value(line, pos)
+            if quoted:
+                value, pos = quoted
                 # remove possible newline character
                 value = value.rstrip()
-                return u('{attr_name}="{value}"').format(attr_name=attr_name, value=value), tail, source
+                return nodes.Attr(attr_name, [value]), line, pos, source
 
             # 2. Try to parse digital value
             # -------------------------------------
-            result = extract_digital_attr_value(tail)
-            if result:
-                value, tail = result
-                return u('{attr_name}="{value}"').format(attr_name=attr_name, value=value), tail, source
+            digital = _scan_digital_attr_value(line, pos)
+            if digital:
+                value, pos = digital
+                return nodes.Attr(attr_name, [value]), line, pos, source
 
             # 3. Try to parse dynamic value
             # -------------------------------------
             terminators = inside_parentheses and ATTRIBUTE_VALUE_TERMINATORS_WITH_PARENTHESES or ATTRIBUTE_VALUE_TERMINATORS
-            result = extract_dynamic_attr_value(tail, source, terminators, syntax)
+            dynamic = _scan_dynamic_attr_value(line, pos, source, terminators, syntax)
 
-            if result:
-                value, tail, source = result
+            if dynamic:
+                value, line, pos, source = dynamic
                 # remove possible newline character
                 value = value.rstrip()
-                if tail.startswith(BOOLEAN_ATTRIBUTE_MARKER):
+                if line.startswith(BOOLEAN_ATTRIBUTE_MARKER, pos):
                     # selected=dynamic_variable?
-                    value = u("""{start_var}({value}) and '{attr_name}="{attr_name}"' or ''|n{end_var}""").format(
-                        value=value,
-                        attr_name=attr_name,
-                        start_var=syntax.VARIABLE_PLACEHOLDER_START_SEQUENCE,
-                        end_var=syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE
-                    )
-                    attribute = value
-                    tail = tail[1:]
+                    attribute = nodes.Attr(attr_name, value, nodes.ATTR_TOGGLE)
+                    pos += 1
                 else:
-                    attribute = u('{attr_name}="{start_var}{value}{end_var}"').format(
-                        attr_name=attr_name,
-                        value=value,
-                        start_var=syntax.VARIABLE_PLACEHOLDER_START_SEQUENCE,
-                        end_var=syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE
-                    )
-                return attribute, tail, source
+                    attribute = nodes.Attr(attr_name, [nodes.Expr(value)])
+                return attribute, line, pos, source
             return None
 
-        elif inside_parentheses and tail.startswith(ATTRIBUTES_DELIMITER) or tail.startswith(CLOSE_BRACE):
+        elif inside_parentheses and line.startswith(ATTRIBUTES_DELIMITER, pos) or line.startswith(CLOSE_BRACE, pos):
             # attribute is presented in a form of boolean attribute
             # which should be converted to attr="attr"
-            return u('{attr_name}="{attr_name}"').format(attr_name=attr_name), tail, source
+            return nodes.Attr(attr_name, [attr_name]), line, pos, source
         else:
             return None
     return None
 
 
-def extract_line_break(tail, source: SourceIter):
+def extract_tag_attribute(line: str, source: str, syntax, inside_parentheses=False):
+    """
+
+    :param line:
+    :param source:
+    :param inside_parentheses:
+    :return:
+    """
+    result = _scan_tag_attribute(line, 0, source, syntax, inside_parentheses)
+    if result is None:
+        return None
+    attribute, line, pos, source = result
+    return syntax.emit_attr(attribute), line[pos:], source
+
+
+def _skip_whitespace(line: str, pos: int) -> int:
+    """ Returns the position of the first non-whitespace character of ``line`` starting from ``pos``
+    """
+    return WHITESPACE_RE.match(line, pos).end()  # type: ignore[union-attr]
+
+
+def _scan_line_break(line: str, pos: int, source: SourceCursor) -> Tuple[bool, str, int, SourceCursor]:
+    """ Index-based version of :func:`extract_line_break`.
+    """
+    found = False
+    while line.startswith(LINE_BREAK, pos):
+        found = True
+        next_line = source.advance()
+        if next_line is None:
+            return found, '', 0, source
+        line = next_line.lstrip()
+        pos = 0
+    return found, line, pos, source
+
+
+def extract_line_break(tail, source: SourceCursor):
     """
     Checks the first character of the tail.
 
@@ -547,21 +1068,11 @@ def extract_line_break(tail, source: SourceIter):
     :param source:
     :return:
     """
-    found = False
-    while True:
-        if tail.startswith(LINE_BREAK):
-            found = True
-            try:
-                _, tail = next(source)
-            except StopIteration:
-                return found, '', source
-            tail = tail.lstrip()
-            continue
-        break
-    return found, tail, source
+    found, line, pos, source = _scan_line_break(tail, 0, source)
+    return found, line[pos:], source
 
 
-def extract_statement_expression(tail: str, source: SourceIter) -> Tuple[str, str]:
+def extract_statement_expression(tail: str, source: SourceCursor) -> Tuple[str, str]:
     """
 
     :param tail:
@@ -571,199 +1082,179 @@ def extract_statement_expression(tail: str, source: SourceIter) -> Tuple[str, st
     buf = []
     # Ensure that tail ends with a newline character
     # (required by extract_braces() to properly handle multi-line expressions)
-    tail = tail.strip() + '\n'
-    while tail:
-        # Try to search braces of function calls etc
-        found, tail, source = extract_line_break(tail, source)
+    line = tail.strip() + '\n'
+    pos = start = 0
+    while pos < len(line):
+        found, next_line, pos_after, source = _scan_line_break(line, pos, source)
         if found:
-            buf.append(' ')
-        result = extract_braces(tail, source)
+            buf.extend([line[start:pos], ' '])
+            line, pos = next_line, pos_after
+            start = pos
+        # Try to search braces of function calls etc
+        result = _scan_braces(line, pos, source)
         if result:
-            head, tail, source = result
-            buf.append(head)
+            chunks, next_line, pos_after, source = result
+            if len(chunks) > 1:
+                buf.append(line[start:pos])
+                buf.extend(chunks)
+                start = pos_after
+            line, pos = next_line, pos_after
             continue
-        buf.append(tail[0])
-        tail = tail[1:]
+        pos += 1
+    buf.append(line[start:pos])
     return joined(buf).strip(), source
 
 
-def extract_tag_line(line, source, syntax):
-    """
-    Returns a 3-tuple of inline tags sequence, closing tags sequence, and a dictionary of
-    last tag components (name, attributes, content)
+def _scan_tag_line(line: str, source: SourceCursor, syntax) -> Tuple[nodes.Tag, str, SourceCursor]:
+    """ Parses a tag definition: the tag name, css shortcuts, attributes, and inline content.
 
-    :param line:
-    :type line: str
-    :param source:
-    :type source: enumerate
-    :param parsers: 2-tuple of (parser_regex, parser_callable)
-    :type parsers: tuple
+    :return: 3-tuple of (tag, tail, source), where ``tag.children`` contains the inline content,
+             and ``tail`` is the remainder of the line after the inline tag separator.
     """
-    buf = []
-    close_buf = []
-    components = {}
-    tail = line
-
-    while tail:
-        tag_composer = ['<']
-        # Get tag name
-        match = TAG_RE.match(tail)
-        if match:
-            html_tag = match.group('html_tag').lower()
-            tail = tail[match.end():]
-        else:
-            html_tag = 'div'
-        tag_composer.append(html_tag)
-        components['name'] = html_tag
-
-        # 1. Parse css id
-        # --------------------------------------------
-        result = extract_identifier(tail, source, CSS_ID_SHORTCUT_DELIMITER, CSS_ID_SHORTCUT_TERMINATORS)
-        if result is None:
-            css_id = ''
-        else:
-            result, tail, source = result
-            # remove the preceding '#' character
-            css_id = result[1:].rstrip()
+    tag_line = line
+    # Get tag name
+    match = TAG_RE.match(line)
+    if match:
+        html_tag = match.group('html_tag').lower()
+        pos = match.end()
+    else:
+        html_tag = 'div'
+        pos = 0
+    tag = nodes.Tag(html_tag)
+
+    # 1. Parse css id
+    # --------------------------------------------
+    scanned = _scan_identifier(line, pos, source, CSS_ID_SHORTCUT_DELIMITER, CSS_ID_SHORTCUT_TERMINATORS)
+    if scanned is None:
+        css_id = ''
+    else:
+        identifier, line, pos, source = scanned
+        # remove the preceding '#' character
+        css_id = identifier[1:].rstrip()
 
-        # 2. Parse css class shortcut
-        # --------------------------------------------
-        class_identifiers = []
-        while True:
-            result = extract_identifier(tail, source, CSS_CLASS_SHORTCUT_DELIMITER, CSS_CLASS_SHORTCUT_TERMINATORS)
-            if result:
-                result, tail, source = result
-                # remove the preceding '.' character
-                class_identifiers.append(result[1:].rstrip())
-                continue
-            break
+    # 2. Parse css class shortcut
+    # --------------------------------------------
+    class_identifiers: List[Any] = []
+    while True:
+        scanned = _scan_identifier(line, pos, source, CSS_CLASS_SHORTCUT_DELIMITER, CSS_CLASS_SHORTCUT_TERMINATORS)
+        if scanned:
+            identifier, line, pos, source = scanned
+            # remove the preceding '.' character
+            class_identifiers.append([identifier[1:].rstrip()])
+            continue
+        break
 
-        # 3. Parse tag attributes
-        # -----------------------------------
-        _, tail, source = extract_line_break(tail.lstrip(), source)
-        inside_parentheses = tail.startswith(OPEN_BRACE)
-        if inside_parentheses:
-            tail = tail[1:].lstrip()
+    # 3. Parse tag attributes
+    # -----------------------------------
+    _, line, pos, source = _scan_line_break(line, _skip_whitespace(line, pos), source)
+    inside_parentheses = line.startswith(OPEN_BRACE, pos)
+    if inside_parentheses:
+        pos = _skip_whitespace(line, pos + 1)
 
-        attributes = []
-        while True:
-            _, tail, source = extract_line_break(tail.lstrip(), source)
+    attributes = tag.attrs
+    while True:
+        _, line, pos, source = _scan_line_break(line, _skip_whitespace(line, pos), source)
 
-            # 3.1 try to get and unpack dynamic attributes
-            result = extract_dynamic_tag_attributes(tail, source, syntax, inside_parentheses)
-            if result:
-                dynamic_attrs, tail, source = result
-                attributes.append(dynamic_attrs)
-                continue
+        # 3.1 try to get and unpack dynamic attributes
+        dynamic = _scan_dynamic_tag_attributes(line, pos, source, syntax, inside_parentheses)
+        if dynamic:
+            dynamic_attrs, line, pos, source = dynamic
+            attributes.append(dynamic_attrs)
+            continue
 
-            # 3.2. get attribute-value pairs until the end of the section (indicated by terminators)
-            result = extract_tag_attribute(tail, source, syntax, inside_parentheses)
-            if result:
-                attribute_pair, tail, source = result
-                if attribute_pair.startswith('id="') and css_id:
-                    raise errors.PlimSyntaxError('Your template has two "id" attribute definitions', line)
-                if attribute_pair.startswith('class="'):
-                    # len('class="') == 7
-                    class_identifiers.append(attribute_pair[7:-1])
+        # 3.2. get attribute-value pairs until the end of the section (indicated by terminators)
+        scanned_attribute = _scan_tag_attribute(line, pos, source, syntax, inside_parentheses)
+        if scanned_attribute:
+            attribute, line, pos, source = scanned_attribute
+            if attribute.kind == nodes.ATTR_VALUE:
+                if attribute.name == 'id' and css_id:
+                    raise errors.PlimSyntaxError('Your template has two "id" attribute definitions', tag_line)
+                if attribute.name == 'class':
+                    class_identifiers.append(attribute.value)
                     continue
 
-                attributes.append(attribute_pair)
-                continue
-            else:
-                if inside_parentheses and not tail:
-                    # We have reached the end of the line.
-                    # Try to parse multiline attributes list.
-                    lineno, tail = next(source)
-                    continue
-                if css_id:
-                    attributes.append(u('id="{ids}"').format(ids=css_id))
-                if class_identifiers:
-                    class_identifiers_str = space_separated(class_identifiers)
-                    attributes.append(u('class="{classes}"').format(classes=class_identifiers_str))
-            break
-        attributes_str = space_separated(attributes)
-        components['attributes'] = attributes_str
-        if attributes_str:
-            tag_composer.extend([' ', attributes_str])
-
-        # 3.2 syntax check
-        if inside_parentheses:
-            if tail.startswith(CLOSE_BRACE):
-                # We have reached the end of attributes definition
-                tail = tail[1:].lstrip()
-            else:
-                raise errors.PlimSyntaxError("Unexpected end of line", tail)
+            attributes.append(attribute)
+            continue
         else:
-            if tail.startswith(' '):
-                tail = tail.lstrip()
+            if inside_parentheses and pos >= len(line):
+                # We have reached the end of the line.
+                # Try to parse multiline attributes list.
+                line = _next_line_or_fail(source, tag_line)
+                pos = 0
+                continue
+            if css_id:
+                attributes.append(nodes.Attr('id', [css_id]))
+            if class_identifiers:
+                classes: List[Any] = []
+                for identifier in class_identifiers:
+                    if classes:
+                        classes.append(' ')
+                    classes.extend(identifier)
+                attributes.append(nodes.Attr('class', classes))
+        break
 
-        if html_tag in EMPTY_TAGS:
-            tag_composer.append('/>')
+    # 3.2 syntax check
+    if inside_parentheses:
+        if line.startswith(CLOSE_BRACE, pos):
+            # We have reached the end of attributes definition
+            pos = _skip_whitespace(line, pos + 1)
         else:
-            tag_composer.append('>')
-            close_buf.append(u('</{tag}>').format(tag=html_tag))
-        buf.append(joined(tag_composer))
+            raise errors.PlimSyntaxError("Unexpected end of line", line[pos:])
+    else:
+        if line.startswith(' ', pos):
+            pos = _skip_whitespace(line, pos)
 
-        if tail.startswith(INLINE_TAG_SEPARATOR):
-            tail = tail[1:].lstrip()
-            break
+    if line.startswith(INLINE_TAG_SEPARATOR, pos):
+        return tag, line[_skip_whitespace(line, pos + 1):], source
 
-        # 3.3 The remainder of the line will be treated as content
-        # ------------------------------------------------------------------
-        components['content'] = ''
-        if tail:
-            if tail.startswith(DYNAMIC_CONTENT_PREFIX):
+    # 3.3 The remainder of the line will be treated as content
+    # ------------------------------------------------------------------
+    tail = line[pos:]
+    if tail:
+        if tail.startswith(DYNAMIC_CONTENT_PREFIX):
+            tail = tail[1:]
+            # case for the '==' prefix
+            prevent_escape = tail.startswith(DYNAMIC_CONTENT_PREFIX)
+            if prevent_escape:
                 tail = tail[1:]
-                if tail.startswith(DYNAMIC_CONTENT_PREFIX):
-                    # case for the '==' prefix
-                    tail = _inject_n_filter(tail)
-                    if tail.startswith(DYNAMIC_CONTENT_SPACE_PREFIX):
-                        # ensure that a single whitespace is appended
-                        tail, source = extract_statement_expression(tail[2:], source)
-                        buf.append(u("{start_var}{content}{end_var} ").format(
-                            content=tail,
-                            start_var=syntax.VARIABLE_PLACEHOLDER_START_SEQUENCE,
-                            end_var=syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE
-                        ))
-                    else:
-                        tail, source = extract_statement_expression(tail[1:], source)
-                        buf.append(u("{start_var}{content}{end_var}").format(
-                            content=tail,
-                            start_var=syntax.VARIABLE_PLACEHOLDER_START_SEQUENCE,
-                            end_var=syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE
-                        ))
-                else:
-                    if tail.startswith(LITERAL_CONTENT_SPACE_PREFIX):
-                        # ensure that a single whitespace is appended
-                        tail, source = extract_statement_expression(tail[1:], source)
-                        buf.append(u("{start_var}{content}{end_var} ").format(
-                            content=tail,
-                            start_var=syntax.VARIABLE_PLACEHOLDER_START_SEQUENCE,
-                            end_var=syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE
-                        ))
-                    else:
-                        tail, source = extract_statement_expression(tail, source)
-                        buf.append(u("{start_var}{content}{end_var}").format(
-                            content=tail,
-                            start_var=syntax.VARIABLE_PLACEHOLDER_START_SEQUENCE,
-                            end_var=syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE
-                        ))
+            # ensure that a single whitespace is appended
+            explicit_space = tail.startswith(LITERAL_CONTENT_SPACE_PREFIX)
+            if explicit_space:
+                tail = tail[1:]
+            tail, source = extract_statement_expression(tail, source)
+            tag.children.append(nodes.Expr(tail, prevent_escape, explicit_space))
 
-            elif tail.startswith(LITERAL_CONTENT_PREFIX):
-                tail = _parse_embedded_markup(tail[1:].strip(), syntax)
-                buf.append(tail)
+        elif tail.startswith(LITERAL_CONTENT_PREFIX):
+            tag.children.append(_parse_embedded_markup(tail[1:].strip(), syntax))
 
-            elif tail.startswith(LITERAL_CONTENT_SPACE_PREFIX):
-                tail = _parse_embedded_markup(tail[1:].strip(), syntax)
-                buf.append(u("{content} ").format(content=tail))
+        elif tail.startswith(LITERAL_CONTENT_SPACE_PREFIX):
+            tag.children.extend([_parse_embedded_markup(tail[1:].strip(), syntax), nodes.Text(' ')])
 
-            else:
-                tail = _parse_embedded_markup(tail.strip(), syntax)
-                buf.append(tail)
-            components['content'] = buf[-1]
-        tail = ''
+        else:
+            tag.children.append(_parse_embedded_markup(tail.strip(), syntax))
+    return tag, '', source
 
-    return joined(buf), joined(reversed(close_buf)), components, tail, source
+
+def extract_tag_line(line, source, syntax):
+    """
+    Returns a 3-tuple of inline tags sequence, closing tags sequence, and a dictionary of
+    last tag components (name, attributes, content)
+
+    :param line:
+    :type line: str
+    :param source:
+    :type source: SourceCursor
+    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    """
+    tag, tail, source = _scan_tag_line(line, source, syntax)
+    content = syntax.emit(tag.children)
+    components = {
+        'name': tag.name,
+        'attributes': syntax.emit_attrs(tag.attrs),
+        'content': content
+    }
+    return syntax.emit_open_tag(tag) + content, syntax.emit_close_tag(tag), components, tail, source
 
 
 # Parsers
@@ -780,17 +1271,14 @@ def parse_style_script(indent_level, current_line, matched, source, syntax):
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    extracted_html_line, close_buf, _, tail, source = extract_tag_line(current_line, source, syntax)
-    buf = [extracted_html_line, '\n']
-    parsed_data, tail_indent, tail_line, source = parse_explicit_literal_no_embedded(
+    tag, _, source = _scan_tag_line(current_line, source, syntax)
+    parsed_data, tail_indent, tail_line, source = _scan_explicit_literal(
         indent_level,
         LITERAL_CONTENT_PREFIX,
-        matched,
-        source,
-        syntax
+        source
     )
-    buf.extend([parsed_data, close_buf])
-    return joined(buf), tail_indent, tail_line, source
+    tag.children.extend([nodes.Text('\n'), nodes.Text(parsed_data)])
+    return tag, tail_indent, tail_line, source
 
 
 def parse_doctype(indent_level, current_line, ___, source, syntax):
@@ -806,10 +1294,10 @@ def parse_doctype(indent_level, current_line, ___, source, syntax):
     """
     match = syntax.PARSE_DOCTYPE_RE.match(current_line.strip())
     doctype = match.group('type')
-    return DOCTYPES.get(doctype, DOCTYPES['5']), indent_level, '', source
+    return nodes.Text(DOCTYPES.get(doctype, DOCTYPES['5'])), indent_level, '', source
 
 
-def parse_handlebars(indent_level: int, current_line, ___, source: SourceIter, syntax) -> Parsed:
+def _parse_handlebars(indent_level: int, current_line, ___, source: SourceCursor, syntax) -> BlockParser:
     """
 
     :param indent_level:
@@ -820,19 +1308,14 @@ def parse_handlebars(indent_level: int, current_line, ___, source: SourceIter, s
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    processed_tag, tail_indent, tail_line, source = parse_tag_tree(indent_level, current_line, ___, source, syntax)
-    assert processed_tag.startswith("<handlebars") and processed_tag.endswith("</handlebars>")
-    # We don't want to use str.replace() here, therefore
-    # len("<handlebars") == len("handlebars>") == 11
-    processed_tag = u(
-        '<script type="text/x-handlebars"{content}script>'
-    ).format(
-        content=processed_tag[11:-11]
-    )
-    return processed_tag, tail_indent, tail_line, source
+    tag, tail, source = _scan_tag_line(current_line.strip(), source, syntax)
+    assert tag.name == 'handlebars'
+    tag.name = 'script'
+    tag.attrs.insert(0, nodes.Attr('type', ['text/x-handlebars']))
+    return (yield from _parse_tag_children(indent_level, tag, tail, source))
 
 
-def parse_tag_tree(indent_level: int, current_line: str, ___: Any, source: SourceIter, syntax) -> Parsed:
+def _parse_tag_tree(indent_level: int, current_line: str, ___: Any, source: SourceCursor, syntax) -> BlockParser:
     """
 
     :param indent_level:
@@ -841,45 +1324,46 @@ def parse_tag_tree(indent_level: int, current_line: str, ___: Any, source: Sourc
     :param source:
     :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
     :type syntax: :class:`plim.syntax.BaseSyntax`
-    :return: 4-tuple
+    :return: 3-tuple
     """
-    buf = []
-    close_buf = []
     current_line = current_line.strip()
-    html_tag, close_seq, _, tail, source = extract_tag_line(current_line, source, syntax)
-    buf.append(html_tag)
-    close_buf.append(close_seq)
+    tag, tail, source = _scan_tag_line(current_line, source, syntax)
+    return (yield from _parse_tag_children(indent_level, tag, tail, source))
+
+
+def _parse_tag_children(indent_level: int, tag: nodes.Tag, tail: str, source: SourceCursor) -> BlockParser:
+    """ Parses the inline tail and the nested lines of a scanned tag.
+
+    :param indent_level:
+    :param tag: the tag returned by :func:`_scan_tag_line`
+    :param tail: the rest of the tag line
+    :param source:
+    :return: 3-tuple
+    """
+    yield tag
+    buf = tag.children
     if tail:
-        parsed, tail_indent, tail_line, source = parse_plim_tail(0, indent_level, tail, source, syntax)
+        tail_indent, tail_line = yield from _parse_plim_tail(indent_level, tail, buf)
         # at this point we have tail_indent <= indent_level
-        buf.extend(parsed)
-        buf.append(joined(close_buf))
-        return joined(buf), tail_indent, tail_line, source
+        return tag, tail_indent, tail_line
 
     while True:
-        try:
-            lineno, current_line = next(source)
-        except StopIteration:
+        tail_indent, tail_line = source.scan_next()
+        if tail_line is None:
             break
-
-        tail_indent, tail_line = scan_line(current_line)
         if not tail_line:
             continue
         if tail_indent <= indent_level:
-            buf.append(joined(close_buf))
-            return joined(buf), tail_indent, tail_line, source
+            return tag, tail_indent, tail_line
 
         # ----------------------------------------------------------
         while tail_line:
-            matched_obj, parse = search_parser(lineno, tail_line, syntax)
-            parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+            parsed_data, tail_indent, tail_line = yield tail_indent, tail_line
             buf.append(parsed_data)
             if tail_indent <= indent_level:
-                buf.append(joined(close_buf))
-                return joined(buf), tail_indent, tail_line, source
+                return tag, tail_indent, tail_line
 
-    buf.append(joined(close_buf))
-    return joined(buf), 0, '', source
+    return tag, 0, ''
 
 
 def parse_markup_languages(indent_level, __, matched, source, syntax):
@@ -893,18 +1377,14 @@ def parse_markup_languages(indent_level, __, matched, source, syntax):
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    markup_parser = MARKUP_LANGUAGES[matched.group('lang')]
-    parsed_data, tail_indent, tail_line, source = parse_explicit_literal_no_embedded(
+    lang = matched.group('lang')
+    parsed_data, tail_indent, tail_line, source = _scan_explicit_literal(
         indent_level,
         LITERAL_CONTENT_PREFIX,
-        matched,
-        source,
-        syntax
-        )
-    # This is slow but correct.
-    # Trying to remove redundant indentation
-    parsed_data = markup_parser(parsed_data)
-    return parsed_data.strip(), tail_indent, tail_line, source
+        source
+    )
+    # the block is compiled while the rest of the source is parsed, if the syntax has an executor
+    return nodes.MarkupBlock(lang, parsed_data, syntax.submit_markup(lang, parsed_data)), tail_indent, tail_line, source
 
 
 def parse_python(indent_level, __, matched, source, syntax):
@@ -919,27 +1399,19 @@ def parse_python(indent_level, __, matched, source, syntax):
     :return:
     """
     # TODO: merge with parse_mako_text()
-    if matched.group('python').endswith('!'):
-        buf = ['<%!\n']
-    else:
-        buf = ['<%\n']
+    module_level = matched.group('python').endswith('!')
     inline_statement = matched.group('expr')
     if inline_statement:
-        buf.extend([inline_statement.strip(), '\n'])
+        inline_statement = inline_statement.strip()
+    else:
+        inline_statement = None
 
-    parsed_data, tail_indent, tail_line, source = parse_explicit_literal_no_embedded(
+    parsed_data, tail_indent, tail_line, source = _scan_explicit_literal(
         indent_level,
         LITERAL_CONTENT_PREFIX,
-        matched,
-        source,
-        syntax
-        )
-    # do not render a python block if it's empty
-    if not inline_statement and not parsed_data:
-        return u(''), tail_indent, tail_line, source
-
-    buf.extend([u('{literal}\n').format(literal=parsed_data.rstrip()), '%>\n'])
-    return joined(buf), tail_indent, tail_line, source
+        source
+    )
+    return nodes.PythonBlock(inline_statement, parsed_data, module_level), tail_indent, tail_line, source
 
 
 def parse_python_new_style(indent_level, __, matched, source, syntax):
@@ -974,28 +1446,16 @@ def parse_mako_text(indent, __, matched, source, syntax) -> Parsed:
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    _, __, components, tail, source = extract_tag_line(matched.group('line').strip(), source, syntax)
-    buf = ['\n<%text']
-    if components['attributes']:
-        buf.extend([' ', components['attributes']])
-    buf.append('>\n')
-    if components['content']:
-        buf.extend([components['content'], '\n'])
-
-    parsed_data, tail_indent, tail_line, source = parse_explicit_literal_no_embedded(
+    tag, _, source = _scan_tag_line(matched.group('line').strip(), source, syntax)
+    parsed_data, tail_indent, tail_line, source = _scan_explicit_literal(
         indent,
         LITERAL_CONTENT_PREFIX,
-        matched,
-        source,
-        syntax
-        )
-    if parsed_data:
-        buf.append(u('{literal}\n').format(literal=parsed_data.rstrip()))
-    buf.append('</%text>\n')
-    return joined(buf), tail_indent, tail_line, source
+        source
+    )
+    return nodes.TextBlock(tag.attrs, tag.children, parsed_data), tail_indent, tail_line, source
 
 
-def parse_call(indent_level, current_line, matched, source, syntax):
+def _parse_call(indent_level, current_line, matched, source, syntax) -> BlockParser:
     """
 
     :param indent_level:
@@ -1006,37 +1466,29 @@ def parse_call(indent_level, current_line, matched, source, syntax):
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return: :raise:
     """
-    _, __, components, tail, source = extract_tag_line(matched.group('line').strip(), source, syntax)
-    tag = components['content'].strip()
-    if not tag:
+    tag, _, source = _scan_tag_line(matched.group('line').strip(), source, syntax)
+    if _is_blank(tag.children):
         raise errors.PlimSyntaxError("-call must contain namespace:defname declaration", current_line)
-    buf = [u('\n<%{tag}').format(tag=tag)]
-    if components['attributes']:
-        buf.extend([' ', components['attributes']])
-    buf.append('>\n')
+    call = nodes.CallBlock(tag.children, tag.attrs)
+    yield call
+    buf = call.children
 
     while True:
-        try:
-            lineno, tail_line = next(source)
-        except StopIteration:
+        tail_indent, tail_line = source.scan_next()
+        if tail_line is None:
             break
-
-        tail_indent, tail_line = scan_line(tail_line)
         if not tail_line:
             continue
         # Parse tree
         # --------------------------------------------------------
         while tail_line:
             if tail_indent <= indent_level:
-                buf.append(u('</%{tag}>\n').format(tag=tag))
-                return joined(buf), tail_indent, tail_line, source
+                return call, tail_indent, tail_line
 
             # tail_indent > indent_level
-            matched_obj, parse = search_parser(lineno, tail_line, syntax)
-            parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+            parsed_data, tail_indent, tail_line = yield tail_indent, tail_line
             buf.append(parsed_data)
-    buf.append(u('</%{tag}>\n').format(tag=tag))
-    return joined(buf), 0, '', source
+    return call, 0, ''
 
 
 def parse_comment(indent_level, __, ___, source, syntax):
@@ -1050,20 +1502,14 @@ def parse_comment(indent_level, __, ___, source, syntax):
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    while True:
-        try:
-            lineno, tail_line = next(source)
-        except StopIteration:
-            break
-        tail_indent, tail_line = scan_line(tail_line)
-        if not tail_line:
-            continue
-        if tail_indent <= indent_level:
-            return '', tail_indent, tail_line, source
-    return '', 0, '', source
+    source.jump(source.find_dedent(indent_level))
+    tail_indent, tail_line = source.scan_next()
+    if tail_line is None:
+        return nodes.Text(''), 0, '', source
+    return nodes.Text(''), tail_indent, tail_line, source
 
 
-def parse_statements(indent_level: int, __: Any, matched, source: SourceIter, syntax) -> Parsed:
+def _parse_statements(indent_level: int, __: Any, matched, source: SourceCursor, syntax) -> BlockParser:
     """
 
     :param indent_level:
@@ -1076,39 +1522,30 @@ def parse_statements(indent_level: int, __: Any, matched, source: SourceIter, sy
     """
     stmnt = matched.group('stmnt')
     expr = matched.group('expr')
-    buf = [u('\n{statement_start}{statement}').format(
-        statement_start=syntax.STATEMENT_START_START_SEQUENCE,
-        statement=stmnt
-    )]
+    statement = nodes.Statement(stmnt)
+    # children of the current branch of the statement
+    buf = statement.children
     if expr:
         expr, source = extract_statement_expression(expr, source)
         expr, tail_line, source = extract_identifier(expr, source, '', STATEMENT_TERMINATORS)
-        expr = expr.lstrip()
+        statement.expr = expr.lstrip()
+        yield statement
         tail_line = tail_line[1:].lstrip()
-        parsed, tail_indent, tail_line, source = parse_plim_tail(0, indent_level, tail_line, source, syntax)
-        buf.append(joined([' ', expr, syntax.STATEMENT_START_END_SEQUENCE, '\n', joined(parsed)]))
+        tail_indent, tail_line = yield from _parse_plim_tail(indent_level, tail_line, buf)
     else:
+        yield statement
         # So far only the "-try" statement has empty ``expr`` part
-        buf.extend([syntax.STATEMENT_START_END_SEQUENCE, '\n'])
-        try:
-            lineno, tail_line = next(source)
-        except StopIteration:
+        tail_line = source.advance()
+        if tail_line is None:
             tail_indent = 0
             tail_line = ''
         else:
             tail_indent, tail_line = scan_line(tail_line)
 
-    def complete_statement(
-        buf: list[str], tail_indent: int, tail_line: str, source, statement: str, syntax
-    ) -> Parsed:
-        buf.extend([
-            '\n',
-            syntax.STATEMENT_END_START_SEQUENCE,
-            u('end{statement}').format(statement=statement),
-            syntax.STATEMENT_END_END_SEQUENCE,
-            '\n'
-        ])
-        return joined(buf), tail_indent, tail_line, source
+    def add_clause(control: str, expr: Optional[str] = None) -> list:
+        clause = nodes.Clause(control, expr)
+        statement.clauses.append(clause)
+        return clause.children
 
     while True:
         # Parse tree
@@ -1124,15 +1561,8 @@ def parse_statements(indent_level: int, __: Any, matched, source: SourceIter, sy
                             expr, tail_line, source = extract_identifier(expr, source, '', STATEMENT_TERMINATORS)
                             expr = expr.lstrip()
                             tail_line = tail_line[1:].lstrip()
-                            parsed, tail_indent, tail_line, source = parse_plim_tail(0, indent_level, tail_line, source, syntax)
-                            buf.append(joined([
-                                '\n',
-                                syntax.STATEMENT_START_START_SEQUENCE,
-                                u('elif {expr}').format(expr=expr),
-                                syntax.STATEMENT_START_END_SEQUENCE,
-                                '\n',
-                                joined(parsed)
-                            ]))
+                            buf = add_clause('elif', expr)
+                            tail_indent, tail_line = yield from _parse_plim_tail(indent_level, tail_line, buf)
                             if tail_line:
                                 continue
                             break
@@ -1143,35 +1573,21 @@ def parse_statements(indent_level: int, __: Any, matched, source: SourceIter, sy
                             if result:
                                 expr, tail_line, source = extract_identifier(expr, source, '', STATEMENT_TERMINATORS)
                                 tail_line = tail_line[1:].lstrip()
-                                parsed, tail_indent, tail_line, source = parse_plim_tail(0, indent_level, tail_line, source, syntax)
-                                buf.append(joined([
-                                    '\n',
-                                    syntax.STATEMENT_START_START_SEQUENCE,
-                                    'else',
-                                    syntax.STATEMENT_START_END_SEQUENCE,
-                                    '\n',
-                                    joined(parsed)
-                                ]))
+                                buf = add_clause('else')
+                                tail_indent, tail_line = yield from _parse_plim_tail(indent_level, tail_line, buf)
                                 if tail_line:
                                     continue
-                            buf.append(joined([
-                                '\n',
-                                syntax.STATEMENT_START_START_SEQUENCE,
-                                'else',
-                                syntax.STATEMENT_START_END_SEQUENCE,
-                                '\n'
-                            ]))
+                            buf = add_clause('else')
                             break
                     else:
                         # elif/else is not found, finalize and return buffer
-                        return complete_statement(buf, tail_indent, tail_line, source, stmnt, syntax)
+                        return statement, tail_indent, tail_line
 
                 elif tail_indent < indent_level:
-                    return complete_statement(buf, tail_indent, tail_line, source, stmnt, syntax)
+                    return statement, tail_indent, tail_line
 
                 # tail_indent > indent_level
-                matched_obj, parse = search_parser(lineno, tail_line, syntax)
-                parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+                parsed_data, tail_indent, tail_line = yield tail_indent, tail_line
                 buf.append(parsed_data)
 
             elif stmnt == 'try':
@@ -1181,47 +1597,43 @@ def parse_statements(indent_level: int, __: Any, matched, source: SourceIter, sy
                     if match:
                         if match.group('control') == 'except':
                             expr, source = extract_statement_expression(match.group('expr'), source)
-                            buf.append(u('\n%except {expr}:\n').format(expr=expr))
+                            buf = add_clause('except', expr)
                             break
                         elif match.group('control') == 'else':
-                            buf.append('\n%else:\n')
+                            buf = add_clause('else')
                             break
                         else:
                             # "-finally" is found
-                            buf.append('\n%finally:\n')
+                            buf = add_clause('finally')
                             break
                     else:
                         # elif/else is not found, finalize and return the buffer
-                        return complete_statement(buf, tail_indent, tail_line, source, stmnt, syntax)
+                        return statement, tail_indent, tail_line
 
                 elif tail_indent < indent_level:
-                    return complete_statement(buf, tail_indent, tail_line, source, stmnt, syntax)
+                    return statement, tail_indent, tail_line
 
                 # tail_indent > indent_level
-                matched_obj, parse = search_parser(lineno, tail_line, syntax)
-                parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+                parsed_data, tail_indent, tail_line = yield tail_indent, tail_line
                 buf.append(parsed_data)
 
             else: # stmnt == for/while
                 if tail_indent <= indent_level:
-                    return complete_statement(buf, tail_indent, tail_line, source, stmnt, syntax)
+                    return statement, tail_indent, tail_line
 
                 # tail_indent > indent_level
-                matched_obj, parse = search_parser(lineno, tail_line, syntax)
-                parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+                parsed_data, tail_indent, tail_line = yield tail_indent, tail_line
                 buf.append(parsed_data)
 
-        try:
-            lineno, tail_line = next(source)
-        except StopIteration:
+        tail_indent, tail_line = source.scan_next()
+        if tail_line is None:
             break
-        tail_indent, tail_line = scan_line(tail_line)
 
-    return complete_statement(buf, 0, '', source, stmnt, syntax)
+    return statement, 0, ''
 
 
 
-def parse_foreign_statements(indent_level: int, __: Any, matched, source: SourceIter, syntax):
+def _parse_foreign_statements(indent_level: int, __: Any, matched, source: SourceCursor, syntax) -> BlockParser:
     """
 
     :param indent_level:
@@ -1239,21 +1651,17 @@ def parse_foreign_statements(indent_level: int, __: Any, matched, source: Source
     buf.append(joined([expr, ')']))
 
     matched = syntax.PARSE_STATEMENTS_RE.match(joined(buf))
-    return parse_statements(indent_level, __, matched, source, syntax)
+    return (yield from _parse_statements(indent_level, __, matched, source, syntax))
 
 
-def parse_explicit_literal(indent_level, current_line, ___, source, syntax, parse_embedded) -> Parsed:
+def _scan_explicit_literal(indent_level: int, current_line: str, source: SourceCursor) -> Tuple[str, int, str, SourceCursor]:
     """
-    Parses lines and blocks started with the "|" (pipe) or "," (comma) character.
+    Returns the text of a literal block started with the "|" (pipe) or "," (comma) character.
 
     :param indent_level:
     :param current_line:
-    :param ___:
     :param source:
-    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
-    :type syntax: :class:`plim.syntax.BaseSyntax`
-    :param parse_embedded: whether to parse possible embedded Plim markup
-    :type parse_embedded: bool
+    :return: 4-tuple of (text, tail_indent, tail_line, source)
     """
     # Get rid of the pipe character
     trailing_space_required = current_line[0] == LITERAL_CONTENT_SPACE_PREFIX
@@ -1263,8 +1671,6 @@ def parse_explicit_literal(indent_level, current_line, ___, source, syntax, pars
         result = joined(buf).rstrip()
         if trailing_space_required:
             result = u("{} ").format(result)
-        if parse_embedded:
-            result = _parse_embedded_markup(result, syntax)
         return result
 
     # --------------------------------
@@ -1273,67 +1679,121 @@ def parse_explicit_literal(indent_level, current_line, ___, source, syntax, pars
     # Add line and trailing newline character
     buf = [current_line.strip(), striped_line and "\n" or ""]
 
+    end = source.find_dedent(indent_level)
     align = MAXSIZE
-    while True:
-        try:
-            lineno, current_line = next(source)
-        except StopIteration:
-            break
-        indent, line = scan_line(current_line)
-        if not line or indent is None:
+    for lineno in range(source.lineno + 1, end):
+        indent = source.indent(lineno)
+        if indent < 0:
             buf.append('\n')
             continue
-        if indent <= indent_level:
-            result = prepare_result(buf)
-            return result, indent, line, source
-
-        new_align = len(current_line) - len(current_line.lstrip())
-        if align > new_align:
-            align = new_align
+        if align > indent:
+            align = indent
         # remove preceding spaces
-        ne_line = current_line[align:].rstrip()
-        buf.extend([ne_line.rstrip(), "\n"])
+        buf.extend([source.line(lineno)[align:].rstrip(), "\n"])
 
+    source.jump(end)
+    indent, line = source.scan_next()
     result = prepare_result(buf)
-    return result, 0, '', source
+    if line is None:
+        return result, 0, '', source
+    return result, indent, line, source
+
+
+def parse_explicit_literal(indent_level, current_line, ___, source, syntax, parse_embedded) -> Parsed:
+    """
+    Parses lines and blocks started with the "|" (pipe) or "," (comma) character.
+
+    :param indent_level:
+    :param current_line:
+    :param ___:
+    :param source:
+    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    :param parse_embedded: whether to parse possible embedded Plim markup
+    :type parse_embedded: bool
+    """
+    result, tail_indent, tail_line, source = _scan_explicit_literal(indent_level, current_line, source)
+    if parse_embedded:
+        return _parse_embedded_markup(result, syntax), tail_indent, tail_line, source
+    return nodes.Text(result), tail_indent, tail_line, source
 
 parse_explicit_literal_with_embedded_markup = functools.partial(parse_explicit_literal, parse_embedded=True)
 parse_explicit_literal_no_embedded = functools.partial(parse_explicit_literal, parse_embedded=False)
 
 
-def _parse_embedded_markup(content: str, syntax) -> str:
+def _parse_embedded_markup(content: str, syntax) -> nodes.Fragment:
     """
 
     :param content:
     :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
     :type syntax: :class:`plim.syntax.BaseSyntax`
-    :return:
+    :return: text nodes mixed with the trees of embedded markup
     """
+    result = nodes.Fragment()
     buf = []
-    tail = content
-    while tail:
-        if tail.startswith(EMBEDDING_QUOTE_ESCAPE):
-            tail = tail[len(EMBEDDING_QUOTE_ESCAPE):]
+    pos = 0
+    while True:
+        quote_pos = content.find(EMBEDDING_QUOTE, pos)
+        if quote_pos < 0:
+            buf.append(content[pos:])
+            break
+        buf.append(content[pos:quote_pos])
+        pos = quote_pos
+
+        if content.startswith(EMBEDDING_QUOTE_ESCAPE, pos):
+            pos += len(EMBEDDING_QUOTE_ESCAPE)
             buf.append(EMBEDDING_QUOTE)
             continue
-        result = extract_embedding_quotes(tail)
-        if result:
-            embedded, original, tail = result
-            embedded = embedded.strip()
-            if embedded:
-                try:
-                    embedded = compile_plim_source(embedded, syntax, False)
-                except errors.ParserNotFound:
-                    # invalid plim markup, leave things as is
-                    buf.append(original)
-                else:
-                    buf.append(embedded)
-            continue
 
-        buf.append(tail[0])
-        tail = tail[1:]
+        embedded, end = _scan_embedding_quotes(content, pos)
+        original = content[pos:end]
+        pos = end
+        embedded = embedded.strip()
+        if embedded:
+            embedded = syntax.parse_embedded_snippet(embedded)
+            if embedded is None:
+                # invalid plim markup, leave things as is
+                buf.append(original)
+            else:
+                result.children.extend([nodes.Text(joined(buf)), embedded])
+                buf = []
+
+    result.children.append(nodes.Text(joined(buf)))
+    return result
 
-    return joined(buf)
+
+def parse_embedded_snippet(snippet: str, syntax: Any) -> Optional[nodes.Fragment]:
+    """ Parses the markup embedded into a literal, or returns None if the markup is not a valid plim source.
+    Syntax instances memoize the results of this function (see ``parse_embedded_snippet`` of
+    :class:`plim.syntax.BaseSyntax`), so the trees it returns are shared and must not be changed.
+
+    :param snippet: stripped content of the embedding quotes
+    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children.
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    """
+    # Most of the snippets that aren't plim markup are rejected by their first line,
+    # without compiling them and unwinding the exception.
+    if not has_parser(snippet.replace('\r\n', NEWLINE).split(NEWLINE, 1)[0], syntax):
+        return None
+    try:
+        return parse_plim_source(snippet, syntax)
+    except errors.ParserNotFound:
+        return None
+
+
+def _is_blank(children: nodes.Children) -> bool:
+    """ Checks whether the given nodes consist of whitespace text only.
+    """
+    for child in children:
+        if isinstance(child, nodes.Fragment):
+            if not _is_blank(child.children):
+                return False
+        elif isinstance(child, nodes.Text):
+            if child.value.strip():
+                return False
+        else:
+            return False
+    return True
 
 
 def _inject_n_filter(line: str) -> str:
@@ -1355,7 +1815,7 @@ def _inject_n_filter(line: str) -> str:
     return line
 
 
-def parse_variable(indent_level: int, __, matched, source: SourceIter, syntax) -> Parsed:
+def parse_variable(indent_level: int, __, matched, source: SourceCursor, syntax) -> Parsed:
     """ = variable or == variable
 
     :param indent_level:
@@ -1366,31 +1826,20 @@ def parse_variable(indent_level: int, __, matched, source: SourceIter, syntax) -
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    explicit_space = matched.group('explicit_space') and ' ' or ''
-    prevent_escape = matched.group('prevent_escape')
-    buf = [syntax.VARIABLE_PLACEHOLDER_START_SEQUENCE, matched.group('line')]
+    explicit_space = bool(matched.group('explicit_space'))
+    prevent_escape = bool(matched.group('prevent_escape'))
+    buf = [matched.group('line')]
     while True:
-        try:
-            lineno, current_line = next(source)
-        except StopIteration:
+        indent, line = source.scan_next()
+        if line is None:
             break
-        indent, line = scan_line(current_line)
         if not line:
             continue
         if indent <= indent_level:
-            buf_str = joined(buf)
-            if prevent_escape:
-                buf_str = _inject_n_filter(buf_str)
-            # add a closing brace to complete variable expression syntax ("${}" in case of mako).
-            buf_str += syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE + explicit_space
-            return buf_str, indent, line, source
+            return nodes.Expr(joined(buf), prevent_escape, explicit_space), indent, line, source
         buf.append(line.strip())
 
-    buf_str = joined(buf)
-    if prevent_escape:
-        buf_str = _inject_n_filter(buf_str)
-    buf_str += syntax.VARIABLE_PLACEHOLDER_END_SEQUENCE + explicit_space
-    return buf_str, 0, '', source
+    return nodes.Expr(joined(buf), prevent_escape, explicit_space), 0, '', source
 
 
 def parse_early_return(indent_level, __, matched, source, syntax) -> Parsed:
@@ -1404,10 +1853,10 @@ def parse_early_return(indent_level, __, matched, source, syntax) -> Parsed:
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    return u('\n<% {keyword} %>\n').format(keyword=matched.group('keyword')), indent_level, '', source
+    return nodes.EarlyReturn(matched.group('keyword')), indent_level, '', source
 
 
-def parse_implicit_literal(indent_level, __, matched, source: SourceIter, syntax) -> Parsed:
+def parse_implicit_literal(indent_level, __, matched, source: SourceCursor, syntax) -> Parsed:
     """
 
     :param indent_level:
@@ -1427,7 +1876,7 @@ def parse_implicit_literal(indent_level, __, matched, source: SourceIter, syntax
     )
 
 
-def parse_raw_html(indent_level, current_line, ___, source, syntax) -> Parsed:
+def _parse_raw_html(indent_level, current_line, ___, source, syntax) -> BlockParser:
     """
 
     :param indent_level:
@@ -1438,27 +1887,26 @@ def parse_raw_html(indent_level, current_line, ___, source, syntax) -> Parsed:
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    buf = [current_line.strip(), '\n']
+    fragment = nodes.Fragment([nodes.Text(current_line.strip() + '\n')])
+    yield fragment
+    buf = fragment.children
     while True:
-        try:
-            lineno, tail_line = next(source)
-        except StopIteration:
+        tail_indent, tail_line = source.scan_next()
+        if tail_line is None:
             break
-        tail_indent, tail_line = scan_line(tail_line)
         if not tail_line:
             continue
         # Parse a tree
         # --------------------------------------------------------
         while tail_line:
             if tail_indent <= indent_level:
-                return joined(buf), tail_indent, tail_line, source
+                return fragment, tail_indent, tail_line
 
             # tail_indent > indent_level
-            matched_obj, parse = search_parser(lineno, tail_line, syntax)
-            parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+            parsed_data, tail_indent, tail_line = yield tail_indent, tail_line
             buf.append(parsed_data)
 
-    return joined(buf), 0, '', source
+    return fragment, 0, ''
 
 
 def parse_mako_one_liners(indent_level, __, matched, source, syntax) -> Parsed:
@@ -1472,17 +1920,11 @@ def parse_mako_one_liners(indent_level, __, matched, source, syntax) -> Parsed:
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    _, __, components, tail, source = extract_tag_line(matched.group('line').strip(), source, syntax)
-    buf = [u('<%{tag}').format(tag=components['name'])]
-    if components['content']:
-        buf.append(u(' file="{name}"').format(name=components['content']))
-    if components['attributes']:
-        buf.extend([' ', components['attributes']])
-    buf.append('/>')
-    return joined(buf), indent_level, '', source
+    tag, _, source = _scan_tag_line(matched.group('line').strip(), source, syntax)
+    return nodes.Directive(tag.name, tag.children, tag.attrs), indent_level, '', source
 
 
-def parse_def_block(indent_level: int, __, matched, source: str, syntax) -> Parsed:
+def _parse_def_block(indent_level: int, __, matched, source: SourceCursor, syntax) -> BlockParser:
     """
 
     :param indent_level:
@@ -1493,40 +1935,137 @@ def parse_def_block(indent_level: int, __, matched, source: str, syntax) -> Pars
     :type syntax: :class:`plim.syntax.BaseSyntax`
     :return:
     """
-    _, __, components, tail, source = extract_tag_line(matched.group('line'), source, syntax)
-    tag = components['name']
-    buf = [u('<%{def_or_block}').format(def_or_block=tag)]
-    if components['content']:
-        buf.append(u(' name="{name}"').format(name=components['content'].strip()))
-    if components['attributes']:
-        buf.extend([' ', components['attributes']])
-    buf.append('>\n')
+    tag, _, source = _scan_tag_line(matched.group('line'), source, syntax)
+    block = nodes.DefBlock(tag.name, tag.children, tag.attrs)
+    yield block
+    buf = block.children
 
     while True:
-        try:
-            lineno, tail_line = next(source)
-        except StopIteration:
+        tail_indent, tail_line = source.scan_next()
+        if tail_line is None:
             break
-        tail_indent, tail_line = scan_line(tail_line)
         if not tail_line or tail_indent is None:
             continue
         # Parse a tree
         # --------------------------------------------------------
         while tail_line:
             if tail_indent <= indent_level:
-                buf.append(u('</%{def_or_block}>\n').format(def_or_block=tag))
-                return joined(buf), tail_indent, tail_line, source
+                return block, tail_indent, tail_line
 
             # tail_indent > indent_level
-            matched_obj, parse = search_parser(lineno, tail_line, syntax)
-            parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+            parsed_data, tail_indent, tail_line = yield tail_indent, tail_line
             buf.append(parsed_data)
 
-    buf.append(u('</%{def_or_block}>\n').format(def_or_block=tag))
-    return joined(buf), 0, '', source
+    return block, 0, ''
 
 
-def parse_plim_tail(lineno: int, indent_level, tail_line, source: SourceIter, syntax) -> Parsed:
+def _parse_plim_tail(indent_level: int, tail_line: str, buf: list) -> Generator[Tuple[int, str], Tuple[Any, int, str], Tuple[int, str]]:
+    """ Parses the rest of a line and the lines that follow it until the indentation
+    goes back to ``indent_level``. Parsed nodes are appended to ``buf``.
+
+    :return: 2-tuple of (tail_indent, tail_line)
+    """
+    tail_indent = indent_level
+    while tail_line:
+        parsed_data, tail_indent, tail_line = yield indent_level, tail_line
+        buf.append(parsed_data)
+        if tail_indent <= indent_level:
+            break
+    return tail_indent, tail_line
+
+
+def _run(parser, source: SourceCursor, syntax, stream: Optional['_StreamWriter'] = None) -> Any:
+    """ Drives a block parser generator and all the nested block parsers it requests
+    with an explicit stack, so that the depth of a template is not limited by
+    the depth of the Python call stack.
+
+    Block parsers (see :data:`_BLOCK_PARSERS`) yield their node first, then 2-tuples of (indent, line)
+    for every child line they want to be parsed, and receive 3-tuples of
+    (parsed_data, tail_indent, tail_line) in return.
+
+    :param parser: a started or not started generator of a block parser
+    :param stream: a writer that receives the nodes of the running parsers, or None
+    :type stream: :class:`_StreamWriter`
+    :return: the return value of ``parser``
+    """
+    stack: List[Generator[Any, Any, Any]] = []
+    result = None
+    if stream is not None:
+        stream.push()
+    # cursors of Limits check the timeout between lines, and here between the blocks of a line
+    check_deadline = getattr(source, 'check_deadline', None)
+    while True:
+        if check_deadline is not None:
+            check_deadline()
+        try:
+            request = parser.send(result)
+        except StopIteration as e:
+            if stream is not None:
+                stream.pop()
+            if not stack:
+                return e.value
+            parser = stack.pop()
+            result = e.value
+            continue
+
+        if request.__class__ is not tuple:
+            # the node of the running block parser
+            if stream is not None:
+                stream.open(request)
+            result = None
+            continue
+        if stream is not None:
+            # the parser may have added the previous child or a clause to its node
+            stream.flush()
+
+        child_indent, child_line = request
+        matched_obj, parse = search_parser(source.lineno, child_line, syntax)
+        block_parser = _BLOCK_PARSERS.get(parse)
+        if block_parser is not None:
+            stack.append(parser)
+            if stream is not None:
+                stream.push()
+            parser = block_parser(child_indent, child_line, matched_obj, source, syntax)
+            result = None
+        else:
+            parsed_data, tail_indent, tail_line, source = parse(child_indent, child_line, matched_obj, source, syntax)
+            result = parsed_data, tail_indent, tail_line
+
+
+def _block_parser(generator_function):
+    """ Wraps a block parser generator into a function that follows the public parser protocol.
+    """
+    @functools.wraps(generator_function)
+    def parse(indent_level, current_line, matched, source, syntax):
+        parsed_data, tail_indent, tail_line = _run(
+            generator_function(indent_level, current_line, matched, source, syntax), source, syntax
+        )
+        return parsed_data, tail_indent, tail_line, source
+    return parse
+
+
+parse_handlebars = _block_parser(_parse_handlebars)
+parse_tag_tree = _block_parser(_parse_tag_tree)
+parse_call = _block_parser(_parse_call)
+parse_statements = _block_parser(_parse_statements)
+parse_foreign_statements = _block_parser(_parse_foreign_statements)
+parse_raw_html = _block_parser(_parse_raw_html)
+parse_def_block = _block_parser(_parse_def_block)
+
+# Public block parsers mapped to their generators. The mapping is used by :func:`_run`
+# to parse nested blocks without recursion.
+_BLOCK_PARSERS: Dict[Callable[..., Any], Callable[..., Any]] = {
+    parse_handlebars: _parse_handlebars,
+    parse_tag_tree: _parse_tag_tree,
+    parse_call: _parse_call,
+    parse_statements: _parse_statements,
+    parse_foreign_statements: _parse_foreign_statements,
+    parse_raw_html: _parse_raw_html,
+    parse_def_block: _parse_def_block,
+}
+
+
+def parse_plim_tail(lineno: int, indent_level, tail_line, source: SourceCursor, syntax) -> Parsed:
     """
 
     :param lineno:
@@ -1538,25 +2077,19 @@ def parse_plim_tail(lineno: int, indent_level, tail_line, source: SourceIter, sy
     :return:
     """
     buf = []
-    tail_indent = indent_level
-    while tail_line:
-        matched_obj, parse = search_parser(lineno, tail_line, syntax)
-        parsed_data, tail_indent, tail_line, source = parse(indent_level, tail_line, matched_obj, source, syntax)
-        buf.append(parsed_data)
-        if tail_indent <= indent_level:
-            break
+    tail_indent, tail_line = _run(_parse_plim_tail(indent_level, tail_line, buf), source, syntax)
     return buf, tail_indent, tail_line, source
 
 
 # Miscellaneous utilities
 # ==================================================================================
-def enumerate_source(source: str) -> SourceIter:
+def enumerate_source(source: str) -> SourceCursor:
     """
 
     :param source:
-    :return:
+    :return: a :class:`SourceCursor` positioned before the first line of the source
     """
-    return enumerate(StringIO(source), start=1)
+    return SourceCursor(source)
 
 
 def scan_line(line: str) -> Tuple[Optional[int], Optional[str]]:
@@ -1568,56 +2101,277 @@ def scan_line(line: str) -> Tuple[Optional[int], Optional[str]]:
     return None, None
 
 
-def compile_plim_source(source: str, syntax: Any, strip=True) -> str:
+def _iter_plim_source(source: SourceCursor, syntax: Any) -> Iterator[Any]:
+    """ Yields the top-level nodes of the source one by one, as soon as they are parsed.
     """
+    while True:
+        tail_indent, tail_line = source.scan_next()
+        if tail_line is None:
+            break
+        while tail_line:
+            matched_obj, parse = search_parser(source.lineno, tail_line, syntax)
+            parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+            yield parsed_data
+
+
+def parse_plim_source(source: str, syntax: Any, limits: Optional[Limits] = None) -> nodes.Fragment:
+    """ Parses the source into a tree of :mod:`plim.nodes`.
 
     :param source:
     :param syntax: a syntax instance
     :type syntax: :class:`plim.syntax.BaseSyntax`
-    :param strip: for embedded markup we don't want to strip whitespaces from result
-    :type strip: bool
-    :return:
+    :param limits: limits of compilation, or None
+    :type limits: :class:`Limits`
+    :return: the root of the tree
     """
     # A quick fix for templates with windows-style newlines.
     # If you see any issues with it, consider altering lexer's NEWLINE.
     source = source.replace('\r\n', '\n')
-    source = enumerate_source(source)
-    result = []
-    while True:
-        try:
-            lineno, line = next(source)
-        except StopIteration:
-            break
+    cursor = enumerate_source(source) if limits is None else limits.open(source)
+    return nodes.Fragment(list(_iter_plim_source(cursor, syntax)))
 
-        tail_indent, tail_line = scan_line(line)
-        if not line:
-            continue
-        while tail_line:
-            matched_obj, parse = search_parser(lineno, tail_line, syntax)
-            parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
-            result.append(parsed_data)
 
-    result_str = joined(result)
+def compile_plim_source(source: str, syntax: Any, strip=True, limits: Optional[Limits] = None) -> str:
+    """
+
+    :param source:
+    :param syntax: a syntax instance
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    :param strip: for embedded markup we don't want to strip whitespaces from result
+    :type strip: bool
+    :param limits: limits of compilation, or None
+    :type limits: :class:`Limits`
+    :raises plim.errors.CompileLimitExceeded: if the template exceeds a limit
+    :return:
+    """
+    if limits is None:
+        result_str = syntax.emit(parse_plim_source(source, syntax))
+    else:
+        source = source.replace('\r\n', '\n')
+        cursor = limits.open(source)
+        result_str = syntax.emit(nodes.Fragment(list(_iter_plim_source(cursor, syntax))))
+        limits.check_time(cursor)
     if strip:
         result_str = result_str.strip()
     return result_str
 
 
+class _StreamFrame(object):
+    """ The state of a block parser run by :func:`_run` for a :class:`_StreamWriter`.
+    """
+    __slots__ = ('node', 'parts', 'clauses', 'live', 'position', 'streamed')
+
+    def __init__(self) -> None:
+        # the node of the block parser, or None if the node is written by the enclosing frame
+        self.node: Any = None
+        # the result of BaseSyntax.emit_parts() for the node and the number of clauses it was computed for
+        self.parts: Sequence[Any] = ()
+        self.clauses = 0
+        # indices of the parts that are lists of children of the node
+        self.live: List[int] = []
+        # index of the first part that hasn't been written completely
+        self.position = 0
+        # the last child that has been written by its own frame
+        self.streamed: Any = None
+
+
+class _StreamWriter(object):
+    """ Writes the output of :func:`compile_stream` while the source is being parsed.
+
+    :func:`_run` reports every block parser it starts and finishes, and every child the parser adds
+    to its node. The writer writes the parts of a node that precede its children (e.g. an open tag)
+    as soon as the node is created, and every child as soon as it is complete. Written children are
+    removed from the node, so the memory usage depends on the depth of the template
+    rather than on its size.
+
+    Nodes whose emitters don't return the lists of their children (see :meth:`plim.syntax.BaseSyntax.emit_parts`)
+    are written as a whole when they are complete.
+    """
+    __slots__ = ('source', 'syntax', 'sink', 'strip', 'started', 'pending', 'frames')
+
+    def __init__(self, source: SourceCursor, sink: Callable[[str], Any], syntax: Any, strip: bool):
+        self.source = source
+        self.sink = sink
+        self.syntax = syntax
+        self.strip = strip
+        self.started = not strip
+        # trailing whitespaces are written only if they are followed by something else
+        self.pending = ''
+        # frames of the running block parsers, after the frame of the top level of the source
+        self.frames = [_StreamFrame()]
+
+    def write(self, chunk: str) -> None:
+        if not self.strip:
+            if chunk:
+                self.sink(chunk)
+            return
+        if not self.started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return
+            self.started = True
+        stripped = chunk.rstrip()
+        if stripped:
+            self.sink(self.pending + stripped)
+            self.pending = chunk[len(stripped):]
+        else:
+            self.pending += chunk
+
+    def write_node(self, node: Any) -> None:
+        """ Writes a top-level node, unless it has already been written by its frame.
+        """
+        root = self.frames[0]
+        if node is root.streamed:
+            root.streamed = None
+        else:
+            self.write(self.syntax.emit(node))
+        self.source.release()
+
+    def push(self) -> None:
+        self.frames.append(_StreamFrame())
+
+    def open(self, node: Any) -> None:
+        frame = self.frames[-1]
+        if len(self.frames) > 2 and self.frames[-2].node is None:
+            # the enclosing node is written as a whole, and so is this one
+            return
+        frame.node = node
+        self._update(frame)
+        if frame.live:
+            self._flush(frame, False)
+        else:
+            frame.node = None
+
+    def flush(self) -> None:
+        frame = self.frames[-1]
+        if frame.node is not None:
+            self._flush(frame, False)
+            self.source.release()
+
+    def pop(self) -> None:
+        frame = self.frames.pop()
+        if frame.node is not None:
+            self._flush(frame, True)
+            self.frames[-1].streamed = frame.node
+
+    def _update(self, frame: _StreamFrame) -> None:
+        """ Emits the parts of the node of the frame, unless they are up to date.
+        """
+        node = frame.node
+        clauses = getattr(node, 'clauses', ())
+        if frame.parts and len(clauses) == frame.clauses:
+            return
+        children = [node.children]
+        children.extend([clause.children for clause in clauses])
+        parts = self.syntax.emit_parts(node)
+        if any(parts is items for items in children):
+            parts = (parts,)
+        frame.parts = parts
+        frame.clauses = len(clauses)
+        frame.live = [index for index, part in enumerate(parts) if any(part is items for items in children)]
+
+    def _flush(self, frame: _StreamFrame, final: bool) -> None:
+        """ Writes the parts of the node of the frame up to its last list of children,
+        or all the remaining parts if the node is complete.
+        """
+        self._update(frame)
+        parts = frame.parts
+        live = frame.live
+        last = len(parts) - 1 if final else live[-1]
+        emit = self.syntax.emit
+        buf = []
+        position = frame.position
+        while position <= last:
+            part = parts[position]
+            if position in live:
+                for child in part:
+                    if child is frame.streamed:
+                        frame.streamed = None
+                    else:
+                        buf.append(emit(child))
+                del part[:]
+                if position == last and not final:
+                    break
+            else:
+                buf.append(emit(part))
+            position += 1
+        frame.position = position
+        self.write(joined(buf))
+
+
+def compile_stream(source: Any, sink: Any, syntax: Any, strip=True, limits: Optional[Limits] = None) -> None:
+    """ Compiles the source and writes the result to the sink chunk by chunk.
+    The beginning of every block (e.g. an open tag) is written as soon as the block is parsed,
+    and the rest of the block after each of its children, so a template with a single root element
+    is written incrementally too. The lines of a file object source are read on demand.
+
+    If compilation fails, the output written so far is incomplete.
+
+    :param source: a string or a text file object
+    :param sink: a text file object or a callable that accepts strings
+    :param syntax: a syntax instance
+    :type syntax: :class:`plim.syntax.BaseSyntax`
+    :param strip: whether to strip leading and trailing whitespaces from the result
+    :type strip: bool
+    :param limits: limits of compilation, or None. The lines of a file object source are checked
+                   as they are read (see :meth:`Limits.open_stream`).
+    :type limits: :class:`Limits`
+    """
+    if isinstance(source, str):
+        source = source.replace('\r\n', '\n')
+        source = enumerate_source(source) if limits is None else limits.open(source)
+    elif limits is not None:
+        source = limits.open_stream(source)
+    else:
+        source = StreamSourceCursor(source)
+    stream = _StreamWriter(source, getattr(sink, 'write', sink), syntax, strip)
+    while True:
+        tail_indent, tail_line = source.scan_next()
+        if tail_line is None:
+            break
+        while tail_line:
+            matched_obj, parse = search_parser(source.lineno, tail_line, syntax)
+            block_parser = _BLOCK_PARSERS.get(parse)
+            if block_parser is None:
+                parsed_data, tail_indent, tail_line, source = parse(tail_indent, tail_line, matched_obj, source, syntax)
+            else:
+                parsed_data, tail_indent, tail_line = _run(
+                    block_parser(tail_indent, tail_line, matched_obj, source, syntax), source, syntax, stream
+                )
+            stream.write_node(parsed_data)
+
+
 # Acknowledgements
 # ============================================================================================
 
 EMPTY_TAGS = {'meta', 'img', 'link', 'input', 'area', 'base', 'col', 'br', 'hr'}
 
-MARKUP_LANGUAGES: Mapping[str, Callable[[Any], str]] = {
-    'md': markdown2.markdown,
-    'markdown': markdown2.markdown,
-    'rst': rst_to_html,
-    'rest': rst_to_html,
-    'coffee': coffee_to_js,
-    'scss': scss_to_css,
-    'sass': scss_to_css,
-    'stylus': stylus_to_css
-}
+# Compilers of markup languages are imported on their first use.
+# Third-party packages may add languages with entry points (see :mod:`plim.extensions`).
+MARKUP_LANGUAGES = extensions.MarkupLanguages(
+    {
+        'md': extensions.markdown_to_html,
+        'markdown': extensions.markdown_to_html,
+        'rst': extensions.rst_to_html,
+        'rest': extensions.rst_to_html,
+        'coffee': extensions.coffee_to_js,
+        'scss': extensions.scss_to_css,
+        'sass': extensions.scss_to_css,
+        'stylus': extensions.stylus_to_css,
+    },
+    distributions={
+        'md': 'markdown2',
+        'markdown': 'markdown2',
+        'rst': 'docutils',
+        'rest': 'docutils',
+        'coffee': 'CoffeeScript',
+        'scss': 'pyScss',
+        'sass': 'pyScss',
+        'stylus': 'stylus',
+    }
+)
+
+MARKUP_LANGUAGES_RE = extensions.MarkupLanguagesPattern(MARKUP_LANGUAGES)
 
 DOCTYPES: Mapping[str, str] = {
     'html': '<!DOCTYPE html>',
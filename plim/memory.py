@@ -0,0 +1,197 @@
+""" Memory accounting of compilation.
+
+A :class:`MemoryMonitor` traces the memory allocated while a syntax compiles templates with :mod:`tracemalloc`,
+and reports the peak, the number of memory blocks that are alive at the peak, and the lines of :mod:`plim.lexer`
+that have allocated most of the memory. With a budget, compilation fails with
+:class:`plim.errors.MemoryBudgetExceeded` as soon as it allocates more memory than the budget allows,
+before the process runs out of memory:
+
+.. code-block:: python
+
+    from plim import preprocessor
+    from plim.memory import MemoryMonitor
+
+    with MemoryMonitor(preprocessor.keywords['syntax'], budget=64 * 1024 * 1024) as monitor:
+        preprocessor(source)
+    print(monitor.format_report())
+
+The memory is checked every time a parser starts to parse a line, and once more at the end.
+Tracing slows compilation down, so that the monitor is meant for diagnostics and for batches of
+untrusted templates rather than for every compilation.
+"""
+import linecache
+import os
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import errors
+from . import lexer
+from .lexer import compile_plim_source
+from .profiling import Instrumentation
+
+
+# Number of frames stored for every traced memory block. Blocks allocated by other modules
+# on behalf of the lexer (such as nodes) are attributed to the nearest frame of the lexer.
+# Every frame makes tracing slower.
+TRACEBACK_LIMIT = 4
+
+
+class MemoryMonitor(Instrumentation):
+    """ Traces the memory allocated by compilation while it is enabled.
+
+    Tracing starts when the monitor is enabled, unless :mod:`tracemalloc` is tracing already, and stops
+    when it is disabled. The memory allocated by compilation is counted from the moment the monitor is enabled.
+    """
+
+    def __init__(self, syntax: Any, budget: Optional[int] = None, snapshot_growth: float = 1.1):
+        """
+        :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children
+        :param budget: maximum number of bytes allocated by compilation, or None for no limit
+        :param snapshot_growth: a snapshot of the traced blocks is taken every time the allocated memory
+                                grows by this factor since the previous snapshot. The allocation sites
+                                are reported from the largest snapshot.
+        """
+        super(MemoryMonitor, self).__init__(syntax)
+        self.budget = budget
+        self.snapshot_growth = snapshot_growth
+        self.peak = 0
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_size = 0
+        self._baseline = 0
+        self._started_tracing = False
+
+    def enter_parser(self, index: int, source: Any) -> Any:
+        self.checkpoint(source.lineno)
+        return None
+
+    def checkpoint(self, lineno: Optional[int] = None) -> None:
+        """ Checks the memory allocated since the monitor has been enabled, and takes a snapshot
+        of the traced blocks if it has grown enough.
+
+        :param lineno: the line of the template being compiled
+        :raises plim.errors.MemoryBudgetExceeded: if the allocated memory exceeds the budget
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        allocated = current - self._baseline
+        self.peak = max(self.peak, peak - self._baseline)
+        if self.budget is not None and self.peak > self.budget:
+            raise errors.MemoryBudgetExceeded(self.peak, self.budget, lineno)
+        if allocated > 0 and allocated > self._snapshot_size * self.snapshot_growth:
+            self.snapshot = tracemalloc.take_snapshot()
+            self._snapshot_size = allocated
+
+    def enable(self) -> None:
+        """ Starts tracing and instruments the parsers of the syntax.
+        """
+        if self.enabled:
+            return
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(TRACEBACK_LIMIT)
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        self.peak = 0
+        self.snapshot = None
+        self._snapshot_size = 0
+        super(MemoryMonitor, self).enable()
+
+    def disable(self) -> None:
+        """ Restores the parsers of the syntax and stops tracing. The peak and the snapshot are kept.
+        """
+        if not self.enabled:
+            return
+        super(MemoryMonitor, self).disable()
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak - self._baseline)
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        self.disable()
+        if exc_type is None and self.budget is not None and self.peak > self.budget:
+            raise errors.MemoryBudgetExceeded(self.peak, self.budget)
+
+    # Reports
+    # ----------------------------------
+    def allocation_sites(self, top: int = 10) -> Tuple[int, List[Dict[str, Any]]]:
+        """ Returns a 2-tuple of (number_of_live_blocks, sites) of the largest snapshot, where
+        ``number_of_live_blocks`` is the number of memory blocks that are alive in the snapshot (rather than
+        the number of allocations made by compilation), and ``sites`` are the ``top`` lines of :mod:`plim.lexer`
+        that have allocated most of the memory, as dictionaries of ``lineno``, ``line``, ``size`` (in bytes),
+        and ``count`` (of live memory blocks).
+        """
+        if self.snapshot is None:
+            return 0, []
+        lexer_file = os.path.normcase(os.path.splitext(lexer.__file__)[0])
+        blocks = 0
+        sites: Dict[int, List[int]] = {}
+        for trace in self.snapshot.traces:
+            blocks += 1
+            # frames are sorted from the oldest to the most recent one
+            for frame in reversed(trace.traceback):
+                if os.path.normcase(os.path.splitext(frame.filename)[0]) == lexer_file:
+                    site = sites.setdefault(frame.lineno, [0, 0])
+                    site[0] += trace.size
+                    site[1] += 1
+                    break
+        largest = sorted(sites.items(), key=lambda item: -item[1][0])[:top]
+        return blocks, [{
+            'lineno': lineno,
+            'line': linecache.getline(lexer.__file__, lineno).strip(),
+            'size': size,
+            'count': count,
+        } for lineno, (size, count) in largest]
+
+    def report(self, top: int = 10) -> Dict[str, Any]:
+        """ Returns a dictionary of:
+
+        * ``peak``: the peak size of the memory allocated by compilation, in bytes;
+        * ``budget``: the budget, or None;
+        * ``live_blocks``: the number of memory blocks that are alive at the largest snapshot,
+          which is taken near the peak;
+        * ``sites``: the ``top`` allocation sites in :mod:`plim.lexer` (see :meth:`allocation_sites`).
+        """
+        live_blocks, sites = self.allocation_sites(top)
+        return {
+            'peak': self.peak,
+            'budget': self.budget,
+            'live_blocks': live_blocks,
+            'sites': sites,
+        }
+
+    def format_report(self, top: int = 10) -> str:
+        """ Returns a human-readable summary of :meth:`report`.
+        """
+        report = self.report(top)
+        buf = ['peak memory: {:,.1f} KiB{}, {:,} live blocks at peak'.format(
+            report['peak'] / 1024,
+            '' if report['budget'] is None else ' of {:,.1f} KiB budget'.format(report['budget'] / 1024),
+            report['live_blocks'],
+        )]
+        if report['sites']:
+            buf.append('')
+            buf.append('{:<12} {:>12} {:>11}  {}'.format('site', 'size', 'live blocks', 'line'))
+            for site in report['sites']:
+                buf.append('{:<12} {:>8,.1f} KiB {:>11,}  {}'.format(
+                    'lexer.py:{}'.format(site['lineno']), site['size'] / 1024, site['count'], site['line'][:60]
+                ))
+        return '\n'.join(buf)
+
+
+def measure(source: str, syntax: Any, budget: Optional[int] = None, strip: bool = True,
+            top: int = 10) -> Tuple[str, Dict[str, Any]]:
+    """ Compiles the source with a :class:`MemoryMonitor` enabled.
+
+    :param source: template source
+    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children
+    :param budget: maximum number of bytes allocated by compilation, or None for no limit
+    :param strip: see :func:`plim.lexer.compile_plim_source`
+    :param top: number of the reported allocation sites
+    :return: 2-tuple of (compiled_template, report). See :meth:`MemoryMonitor.report` for the report format.
+    :raises plim.errors.MemoryBudgetExceeded: if compilation exceeds the budget
+    """
+    with MemoryMonitor(syntax, budget) as monitor:
+        result = compile_plim_source(source, syntax, strip)
+        monitor.checkpoint()
+    return result, monitor.report(top)
@@ -0,0 +1,229 @@
+""" Intermediate representation of Plim templates.
+
+Parsers in :mod:`plim.lexer` build a tree of these nodes, and syntax backends in :mod:`plim.syntax`
+walk the tree to produce the target markup (see :meth:`plim.syntax.BaseSyntax.emit`).
+Plain strings are valid leaves of the tree as well: they are emitted verbatim.
+This is what custom parsers return.
+"""
+from typing import Any, Iterator, Optional, List, Tuple, Union
+
+
+class Node(object):
+    __slots__: Tuple[str, ...] = ()
+
+    def __eq__(self, other: Any) -> bool:
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __ne__(self, other: Any) -> bool:
+        return not self == other
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return '{cls}({fields})'.format(
+            cls=type(self).__name__,
+            fields=', '.join(repr(getattr(self, name)) for name in self.__slots__)
+        )
+
+
+Children = List[Union[str, Node]]
+
+
+class Fragment(Node):
+    """ A sequence of sibling nodes. The root of a compiled template is a fragment too.
+    """
+    __slots__ = ('children',)
+
+    def __init__(self, children: Optional[Children] = None):
+        self.children = children if children is not None else []
+
+
+class Text(Node):
+    """ A piece of output text that doesn't depend on a target syntax.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value: str):
+        self.value = value
+
+
+class Expr(Node):
+    """ A python expression which value is written to the output: ``= expr`` and ``== expr``.
+    """
+    __slots__ = ('code', 'raw', 'trailing_space')
+
+    def __init__(self, code: str, raw: bool = False, trailing_space: bool = False):
+        """
+        :param code: python expression
+        :param raw: whether the value must not be escaped (the ``==`` prefix)
+        :param trailing_space: whether a single whitespace must follow the value (the ``=,`` prefix)
+        """
+        self.code = code
+        self.raw = raw
+        self.trailing_space = trailing_space
+
+
+# Kinds of tag attributes
+ATTR_VALUE = 'value'
+ATTR_TOGGLE = 'toggle'
+ATTR_SPREAD = 'spread'
+
+
+class Attr(Node):
+    """ A tag attribute.
+
+    - ``ATTR_VALUE`` attributes render as ``name="value"``, where ``value`` is a list
+      of strings and :class:`Expr` nodes;
+    - ``ATTR_TOGGLE`` attributes (``name=expr?``) render as ``name="name"`` only when
+      the expression ``value`` is true;
+    - ``ATTR_SPREAD`` attributes (``**expr``) render all items of the dictionary ``value``.
+      They don't have a name.
+    """
+    __slots__ = ('name', 'value', 'kind')
+
+    def __init__(self, name: Optional[str], value: Any, kind: str = ATTR_VALUE):
+        self.name = name
+        self.value = value
+        self.kind = kind
+
+
+class Tag(Node):
+    """ An HTML tag. Tags from :data:`plim.lexer.EMPTY_TAGS` don't have closing sequences,
+    and their children are rendered right after them.
+    """
+    __slots__ = ('name', 'attrs', 'children')
+
+    def __init__(self, name: str, attrs: Optional[List[Attr]] = None, children: Optional[Children] = None):
+        self.name = name
+        self.attrs = attrs if attrs is not None else []
+        self.children = children if children is not None else []
+
+
+class Clause(Node):
+    """ A continuation of a compound statement: ``-elif``, ``-else``, ``-except``, and ``-finally``.
+    """
+    __slots__ = ('keyword', 'expr', 'children')
+
+    def __init__(self, keyword: str, expr: Optional[str] = None, children: Optional[Children] = None):
+        self.keyword = keyword
+        self.expr = expr
+        self.children = children if children is not None else []
+
+
+class Statement(Node):
+    """ A control statement: ``-if``, ``-for``, ``-while``, ``-with``, and ``-try``.
+    ``expr`` is None for statements without an expression part, such as ``-try``.
+    """
+    __slots__ = ('keyword', 'expr', 'children', 'clauses')
+
+    def __init__(self, keyword: str, expr: Optional[str] = None, children: Optional[Children] = None,
+                 clauses: Optional[List[Clause]] = None):
+        self.keyword = keyword
+        self.expr = expr
+        self.children = children if children is not None else []
+        self.clauses = clauses if clauses is not None else []
+
+
+class EarlyReturn(Node):
+    """ ``-return``, ``-continue``, and ``-break``.
+    """
+    __slots__ = ('keyword',)
+
+    def __init__(self, keyword: str):
+        self.keyword = keyword
+
+
+class DefBlock(Node):
+    """ ``-def`` and ``-block``. ``name`` is the list of nodes that renders the name (and signature)
+    of the definition.
+    """
+    __slots__ = ('kind', 'name', 'attrs', 'children')
+
+    def __init__(self, kind: str, name: Children, attrs: List[Attr], children: Optional[Children] = None):
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+        self.children = children if children is not None else []
+
+
+class CallBlock(Node):
+    """ ``-call namespace:defname``. ``target`` is the list of nodes that renders the call target.
+    """
+    __slots__ = ('target', 'attrs', 'children')
+
+    def __init__(self, target: Children, attrs: List[Attr], children: Optional[Children] = None):
+        self.target = target
+        self.attrs = attrs
+        self.children = children if children is not None else []
+
+
+class Directive(Node):
+    """ One-line Mako directives: ``-include``, ``-inherit``, ``-page``, and ``-namespace``.
+    ``file`` is the list of nodes that renders the value of the ``file`` attribute.
+    """
+    __slots__ = ('name', 'file', 'attrs')
+
+    def __init__(self, name: str, file: Children, attrs: List[Attr]):
+        self.name = name
+        self.file = file
+        self.attrs = attrs
+
+
+class TextBlock(Node):
+    """ ``-text``: a block of text that the template engine must not process.
+    """
+    __slots__ = ('attrs', 'content', 'body')
+
+    def __init__(self, attrs: List[Attr], content: Children, body: str):
+        self.attrs = attrs
+        self.content = content
+        self.body = body
+
+
+class PythonBlock(Node):
+    """ ``-py`` and ``---`` blocks. Module-level blocks (``-py!`` and ``---!``) are executed
+    once per template module.
+    """
+    __slots__ = ('inline', 'body', 'module_level')
+
+    def __init__(self, inline: Optional[str], body: str, module_level: bool = False):
+        self.inline = inline
+        self.body = body
+        self.module_level = module_level
+
+
+class MarkupBlock(Node):
+    """ A block of markup written in one of :data:`plim.lexer.MARKUP_LANGUAGES`.
+    The markup is compiled when the tree is emitted, unless it is being compiled
+    in the background already (see :meth:`plim.syntax.BaseSyntax.submit_markup`).
+    """
+    __slots__ = ('lang', 'source', 'compiled')
+
+    def __init__(self, lang: str, source: str, compiled: Any = None):
+        """
+        :param lang: name of the markup language
+        :param source: markup
+        :param compiled: a :class:`concurrent.futures.Future` of the compiled markup, or None
+        """
+        self.lang = lang
+        self.source = source
+        self.compiled = compiled
+
+
+def walk(node: Any) -> Iterator[Node]:
+    """ Yields all nodes of the tree in document order, starting with the ``node`` itself.
+    Strings and lists of nodes are traversed as well, but only nodes are yielded.
+    """
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(reversed(item))
+        elif isinstance(item, Node):
+            yield item
+            stack.extend(reversed([
+                value for value in (getattr(item, name) for name in item.__slots__)
+                if isinstance(value, (list, Node))
+            ]))
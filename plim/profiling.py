@@ -0,0 +1,381 @@
+""" Per-parser profiling of compilation.
+
+A :class:`Profiler` instruments a syntax instance: every parser of :attr:`plim.syntax.BaseSyntax.parsers`
+(including custom ones) counts its calls and measures its time, every pattern counts the attempts
+to match a line and the matches, and the compilers of markup languages measure their time.
+The syntax is not changed until the profiler is enabled, so compilation doesn't pay for profiling
+when it's off.
+
+.. code-block:: python
+
+    from plim import preprocessor
+    from plim.profiling import Profiler
+
+    with Profiler(preprocessor.keywords['syntax']) as profiler:
+        preprocessor(source)
+    print(profiler.format_report())
+
+Blocks of markup languages that are taken from a cache (see :func:`plim.cache.compile_markup`)
+are not compiled, so they are not reported. Counters are not synchronized: profile one compilation
+at a time.
+"""
+import functools
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from . import lexer
+from .lexer import compile_plim_source
+
+
+class ParserStats(object):
+    """ Counters of a parser of a syntax and of its pattern.
+    """
+    __slots__ = ('name', 'pattern', 'calls', 'seconds', 'own_seconds',
+                 'match_attempts', 'match_hits', 'match_seconds')
+
+    def __init__(self, name: str, pattern: str):
+        self.name = name
+        self.pattern = pattern
+        self.reset()
+
+    def reset(self) -> None:
+        self.calls = 0
+        # time of the calls, including the nested parsers
+        self.seconds = 0.0
+        # time of the calls, except the nested parsers
+        self.own_seconds = 0.0
+        self.match_attempts = 0
+        self.match_hits = 0
+        self.match_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class MarkupStats(object):
+    """ Counters of a compiler of a markup language.
+    """
+    __slots__ = ('name', 'calls', 'seconds')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class _PatternProbe(object):
+    """ A pattern of a parser that counts the attempts to match a line, and the matches.
+    """
+    def __init__(self, pattern: Any, stats: ParserStats):
+        self.wrapped = pattern
+        self.stats = stats
+        self.pattern = getattr(pattern, 'pattern', pattern)
+        self.flags = getattr(pattern, 'flags', 0)
+
+    def match(self, string: str, *args: Any) -> Any:
+        stats = self.stats
+        started_at = time.perf_counter()
+        matched = self.wrapped.match(string, *args)
+        stats.match_seconds += time.perf_counter() - started_at
+        stats.match_attempts += 1
+        if matched:
+            stats.match_hits += 1
+        return matched
+
+
+class _ProfiledLanguages(Mapping):
+    """ A view of a registry of markup languages whose compilers measure their time.
+    """
+    def __init__(self, languages: Mapping[str, Any], profiler: 'Profiler'):
+        self.languages = languages
+        self.profiler = profiler
+
+    def __getitem__(self, name: str) -> Callable[[str], str]:
+        compiler = self.languages[name]
+        stats = self.profiler._markup_stats(name)
+
+        @functools.wraps(compiler)
+        def profiled_compiler(source: str) -> str:
+            started_at = time.perf_counter()
+            try:
+                return compiler(source)
+            finally:
+                stats.seconds += time.perf_counter() - started_at
+                stats.calls += 1
+        return profiled_compiler
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.languages)
+
+    def __len__(self) -> int:
+        return len(self.languages)
+
+
+def parser_name(parser: Any) -> str:
+    """ Returns a readable name of a parser callable.
+    """
+    while isinstance(parser, functools.partial):
+        parser = parser.func
+    module = getattr(parser, '__module__', None)
+    name = getattr(parser, '__qualname__', None)
+    if name is None:
+        return repr(parser)
+    if module and module != lexer.__name__:
+        return '{}.{}'.format(module, name)
+    if parser in lexer._BLOCK_PARSERS:
+        # block parsers take the names of their generators, which start with an underscore
+        return name.lstrip('_')
+    return name
+
+
+class Instrumentation(object):
+    """ A base class of the tools that wrap the parsers of a syntax while they are enabled.
+
+    Every parser of :attr:`plim.syntax.BaseSyntax.parsers` calls :meth:`enter_parser` before it parses
+    a line (and its block), and :meth:`exit_parser` after that. The syntax is restored when the instrumentation
+    is disabled. Instrumentations of the same syntax must be disabled in the reverse order.
+    It is also a context manager that enables it.
+    """
+
+    def __init__(self, syntax: Any):
+        """
+        :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children
+        """
+        self.syntax = syntax
+        self.enabled = False
+        self._original: Optional[Tuple[Any, ...]] = None
+        self._block_parsers: List[Any] = []
+
+    def wrap_pattern(self, index: int, pattern: Any) -> Any:
+        """ Returns the pattern that replaces the pattern of the ``index``-th parser.
+        """
+        return pattern
+
+    def enter_parser(self, index: int, source: Any) -> Any:
+        """ Called before the ``index``-th parser parses the current line of the source
+        (a :class:`plim.lexer.SourceCursor`). The result is passed to :meth:`exit_parser`.
+        """
+        return None
+
+    def exit_parser(self, index: int, token: Any) -> None:
+        """ Called after the ``index``-th parser has parsed its line (and its block), or has raised an error.
+        """
+
+    def _wrap_parser(self, index: int, parser: Any) -> Any:
+        enter_parser = self.enter_parser
+        exit_parser = self.exit_parser
+
+        @functools.wraps(parser)
+        def instrumented_parser(indent_level, current_line, matched, source, syntax):
+            token = enter_parser(index, source)
+            try:
+                return parser(indent_level, current_line, matched, source, syntax)
+            finally:
+                exit_parser(index, token)
+
+        generator_function = lexer._BLOCK_PARSERS.get(parser)
+        if generator_function is not None:
+            # nested blocks are parsed by the generators of block parsers (see :func:`plim.lexer._run`).
+            # A generator is exited on its return, after the lines of its block.
+            @functools.wraps(generator_function)
+            def instrumented_generator(indent_level, current_line, matched, source, syntax):
+                token = enter_parser(index, source)
+                try:
+                    return (yield from generator_function(indent_level, current_line, matched, source, syntax))
+                finally:
+                    exit_parser(index, token)
+
+            lexer._BLOCK_PARSERS[instrumented_parser] = instrumented_generator
+            self._block_parsers.append(instrumented_parser)
+        return instrumented_parser
+
+    def enable(self) -> None:
+        """ Instruments the parsers of the syntax.
+        """
+        if self.enabled:
+            return
+        syntax = self.syntax
+        self._original = (syntax.parsers, syntax.parsers_index)
+        syntax.parsers = tuple([
+            (self.wrap_pattern(index, pattern), self._wrap_parser(index, parser))
+            for index, (pattern, parser) in enumerate(syntax.parsers)
+        ])
+        # buckets of the dispatch index are filled again with the instrumented parsers
+        syntax.parsers_index = {}
+        self.enabled = True
+
+    def disable(self) -> None:
+        """ Restores the parsers of the syntax.
+        """
+        if not self.enabled:
+            return
+        syntax = self.syntax
+        assert self._original is not None
+        syntax.parsers, syntax.parsers_index = self._original
+        for instrumented_parser in self._block_parsers:
+            del lexer._BLOCK_PARSERS[instrumented_parser]
+        self._block_parsers = []
+        self._original = None
+        self.enabled = False
+
+    def format_report(self) -> str:
+        """ Returns a human-readable summary of the collected data.
+        """
+        return ''
+
+    def __enter__(self) -> Any:
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.disable()
+
+
+class Profiler(Instrumentation):
+    """ Collects counters of the parsers of a syntax while it is enabled.
+
+    The profiler may be enabled and disabled many times: the counters are accumulated
+    until :meth:`reset`.
+    """
+
+    def __init__(self, syntax: Any):
+        """
+        :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children
+        """
+        super(Profiler, self).__init__(syntax)
+        self.lookups = 0
+        self.parsers: List[ParserStats] = []
+        self.markup_languages: Dict[str, MarkupStats] = {}
+        self._markup_languages: Any = None
+        self._local = threading.local()
+
+    # Instrumentation
+    # ----------------------------------
+    def _markup_stats(self, name: str) -> MarkupStats:
+        stats = self.markup_languages.get(name)
+        if stats is None:
+            stats = self.markup_languages[name] = MarkupStats(name)
+        return stats
+
+    def wrap_pattern(self, index: int, pattern: Any) -> Any:
+        return _PatternProbe(pattern, self.parsers[index])
+
+    def enter_parser(self, index: int, source: Any) -> Any:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        return time.perf_counter()
+
+    def exit_parser(self, index: int, token: Any) -> None:
+        elapsed = time.perf_counter() - token
+        stack = self._local.stack
+        nested = stack.pop() if stack else 0.0
+        if stack:
+            stack[-1] += elapsed
+        stats = self.parsers[index]
+        stats.calls += 1
+        stats.seconds += elapsed
+        stats.own_seconds += elapsed - nested
+
+    def enable(self) -> None:
+        """ Instruments the parsers, the patterns, and the compilers of markup languages of the syntax.
+        """
+        if self.enabled:
+            return
+        syntax = self.syntax
+        for pattern, parser in syntax.parsers[len(self.parsers):]:
+            self.parsers.append(ParserStats(parser_name(parser), str(getattr(pattern, 'pattern', pattern))))
+        self._local.stack = []
+        super(Profiler, self).enable()
+        parsers_for = type(syntax).parsers_for
+
+        def profiled_parsers_for(line: str) -> Tuple[Any, ...]:
+            self.lookups += 1
+            return parsers_for(syntax, line)
+        syntax.parsers_for = profiled_parsers_for
+        self._markup_languages = syntax.markup_languages
+        # the compilers that run in other processes can't report their time
+        if not isinstance(syntax.markup_executor, ProcessPoolExecutor):
+            syntax.markup_languages = _ProfiledLanguages(syntax.markup_languages, self)
+
+    def disable(self) -> None:
+        """ Restores the parsers of the syntax. The counters are kept.
+        """
+        if not self.enabled:
+            return
+        syntax = self.syntax
+        syntax.markup_languages = self._markup_languages
+        del syntax.parsers_for
+        super(Profiler, self).disable()
+
+    def reset(self) -> None:
+        """ Resets the counters.
+        """
+        self.lookups = 0
+        for stats in self.parsers:
+            stats.reset()
+        self.markup_languages.clear()
+
+    # Reports
+    # ----------------------------------
+    def report(self) -> Dict[str, Any]:
+        """ Returns the counters as a dictionary of:
+
+        * ``lookups``: the number of lookups of parsers for a line (see :func:`plim.lexer.search_parser`);
+        * ``match_seconds``: the total time of the attempts to match lines;
+        * ``parsers``: a list of dictionaries of the counters of every parser (see :class:`ParserStats`),
+          sorted by time in descending order;
+        * ``markup_languages``: a list of dictionaries of the counters of every compiler of markup languages
+          (see :class:`MarkupStats`), sorted by time in descending order.
+        """
+        return {
+            'lookups': self.lookups,
+            'match_seconds': sum(stats.match_seconds for stats in self.parsers),
+            'parsers': [stats.as_dict() for stats in sorted(self.parsers, key=lambda s: -s.seconds)],
+            'markup_languages': [
+                stats.as_dict() for stats in sorted(self.markup_languages.values(), key=lambda s: -s.seconds)
+            ],
+        }
+
+    def format_report(self) -> str:
+        """ Returns a human-readable table of the counters.
+        """
+        report = self.report()
+        buf = ['{:<44} {:>7} {:>10} {:>10} {:>9} {:>7} {:>10}'.format(
+            'parser', 'calls', 'total ms', 'own ms', 'attempts', 'hits', 'match ms'
+        )]
+        for row in report['parsers']:
+            if not row['calls'] and not row['match_attempts']:
+                continue
+            buf.append('{:<44} {:>7} {:>10.3f} {:>10.3f} {:>9} {:>7} {:>10.3f}'.format(
+                row['name'][:44], row['calls'], row['seconds'] * 1000, row['own_seconds'] * 1000,
+                row['match_attempts'], row['match_hits'], row['match_seconds'] * 1000
+            ))
+        buf.append('{} lookups of parsers, {:.3f} ms of matching'.format(
+            report['lookups'], report['match_seconds'] * 1000
+        ))
+        if report['markup_languages']:
+            buf.append('')
+            buf.append('{:<44} {:>7} {:>10}'.format('markup language', 'calls', 'total ms'))
+            for row in report['markup_languages']:
+                buf.append('{:<44} {:>7} {:>10.3f}'.format('-' + row['name'], row['calls'], row['seconds'] * 1000))
+        return '\n'.join(buf)
+
+
+def profile(source: str, syntax: Any, strip: bool = True) -> Tuple[str, Dict[str, Any]]:
+    """ Compiles the source with a :class:`Profiler` enabled.
+
+    :param source: template source
+    :param syntax: an instance of one of :class:`plim.syntax.BaseSyntax` children
+    :param strip: see :func:`plim.lexer.compile_plim_source`
+    :return: 2-tuple of (compiled_template, report). See :meth:`Profiler.report` for the report format.
+    """
+    with Profiler(syntax) as profiler:
+        result = compile_plim_source(source, syntax, strip)
+    return result, profiler.report()
@@ -1,9 +1,20 @@
+import copy
+import functools
 import re
-from typing import Sequence, Any
+from typing import Sequence, Any, Optional, Tuple, List, Pattern, Mapping, Dict
 
 from pyrsistent import v, pvector
 
 from . import lexer as l
+from . import cache as _cache
+from . import nodes
+from .util import joined, space_separated, u
+
+try:
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:  # pragma: no cover
+    # Python < 3.11
+    import sre_parse  # type: ignore[no-redef, unused-ignore]
 
 PARSE_IMPLICIT_LITERAL_RE = re.compile(
     # Order matters
@@ -18,6 +29,111 @@ PARSE_IMPLICIT_LITERAL_RE = re.compile(
 )
 
 
+# Leading character analysis
+# ----------------------------------
+class _Unanalyzable(Exception):
+    pass
+
+
+_CATEGORY_CLASSES: Mapping[Any, str] = {
+    sre_parse.CATEGORY_DIGIT: r'\d',
+    sre_parse.CATEGORY_NOT_DIGIT: r'\D',
+    sre_parse.CATEGORY_SPACE: r'\s',
+    sre_parse.CATEGORY_NOT_SPACE: r'\S',
+    sre_parse.CATEGORY_WORD: r'\w',
+    sre_parse.CATEGORY_NOT_WORD: r'\W',
+}
+
+_REPEAT_OPS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)} - {None}
+_ZERO_WIDTH_OPS = {sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT}
+
+
+def _char_class(items) -> str:
+    buf = ['[']
+    for op, av in items:
+        if op is sre_parse.NEGATE:
+            buf.append('^')
+        elif op is sre_parse.LITERAL:
+            buf.append(re.escape(chr(av)))
+        elif op is sre_parse.RANGE:
+            buf.extend([re.escape(chr(av[0])), '-', re.escape(chr(av[1]))])
+        elif op is sre_parse.CATEGORY and av in _CATEGORY_CLASSES:
+            buf.append(_CATEGORY_CLASSES[av])
+        else:
+            raise _Unanalyzable(op)
+    buf.append(']')
+    return ''.join(buf)
+
+
+def _leading_atoms(items) -> Tuple[List[str], bool]:
+    """ Returns a 2-tuple of (single_character_regex_sources, may_match_empty_string)
+    for a parsed regex sequence.
+    """
+    atoms: List[str] = []
+    for op, av in items:
+        if op in _ZERO_WIDTH_OPS:
+            # Assertions can only narrow down the set of leading characters
+            continue
+        if op is sre_parse.LITERAL:
+            atoms.append(re.escape(chr(av)))
+            return atoms, False
+        if op is sre_parse.NOT_LITERAL:
+            atoms.append('[^{}]'.format(re.escape(chr(av))))
+            return atoms, False
+        if op is sre_parse.ANY:
+            atoms.append('.')
+            return atoms, False
+        if op is sre_parse.IN:
+            atoms.append(_char_class(av))
+            return atoms, False
+
+        if op is sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, sub_items = av
+            if add_flags or del_flags:
+                raise _Unanalyzable(op)
+            sub_atoms, nullable = _leading_atoms(sub_items)
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            sub_atoms, nullable = _leading_atoms(av)
+        elif op is sre_parse.BRANCH:
+            sub_atoms, nullable = [], False
+            for branch in av[1]:
+                branch_atoms, branch_nullable = _leading_atoms(branch)
+                sub_atoms.extend(branch_atoms)
+                nullable = nullable or branch_nullable
+        elif op in _REPEAT_OPS:
+            min_repeat, _, sub_items = av
+            sub_atoms, nullable = _leading_atoms(sub_items)
+            nullable = nullable or not min_repeat
+        else:
+            raise _Unanalyzable(op)
+
+        atoms.extend(sub_atoms)
+        if not nullable:
+            return atoms, False
+    return atoms, True
+
+
+def leading_char_re(template: Any) -> Optional[Pattern[str]]:
+    """ Returns a regex that matches every character that a string matched by ``template``
+    may start with, or None if that set cannot be determined (for instance, if the template
+    may match an empty string or is not a compiled regex at all). Regex-like objects that build
+    their regex on demand may provide a ``leading_regex``: a compiled regex that matches the beginning
+    of every string they match (see :class:`plim.extensions.MarkupLanguagesPattern`).
+
+    :param template: a parser regex
+    """
+    template = getattr(template, 'leading_regex', template)
+    if not isinstance(template, Pattern) or not isinstance(template.pattern, str):
+        return None
+    try:
+        atoms, nullable = _leading_atoms(sre_parse.parse(template.pattern, template.flags))
+    except (_Unanalyzable, re.error):
+        return None
+    if nullable or not atoms:
+        return None
+    return re.compile('|'.join(atoms), template.flags)
+
+
 class BaseSyntax(object):
     VARIABLE_PLACEHOLDER_START_SEQUENCE = '${'
     VARIABLE_PLACEHOLDER_END_SEQUENCE = '}'
@@ -49,11 +165,15 @@ class BaseSyntax(object):
     PARSE_MAKO_TEXT_RE = re.compile('-\s*(?P<line>text(?:\s+.*)?)')
     PARSE_CALL_RE = re.compile('-\s*(?P<line>call(?:\s+.*)?)')
     PARSE_EARLY_RETURN_RE = re.compile('-\s*(?P<keyword>return|continue|break)\s*')
-    PARSE_EXTENSION_LANGUAGES_RE = re.compile('-\s*(?P<lang>md|markdown|rst|rest|coffee|scss|sass|stylus)\s*')
+    # matches every language of :data:`plim.lexer.MARKUP_LANGUAGES`, including the ones registered later
+    PARSE_EXTENSION_LANGUAGES_RE = l.MARKUP_LANGUAGES_RE
 
     PARSE_ELIF_ELSE_RE = re.compile('-\s*(?P<control>elif|else)(?P<expr>.*)')
     PARSE_EXCEPT_ELSE_FINALLY_RE = re.compile('-\s*(?P<control>except|else|finally)(?P<expr>.*)')
 
+    # maximum number of memoized snippets of embedded markup (see :func:`plim.lexer.parse_embedded_snippet`)
+    EMBEDDED_MARKUP_MEMO_SIZE = 1024
+
     def __init__(self, custom_parsers: Sequence[Any] = v()):
         """
         :param custom_parsers: a list of 2-tuples of (parser_regex, parser_callable) or None
@@ -92,6 +212,277 @@ class BaseSyntax(object):
         # discard parsers with None pattern
         self.parsers = tuple([p for p in custom_parsers if p[0]])
 
+        # Dispatch index of parsers keyed by the leading character of a line.
+        # Every bucket preserves the order of ``self.parsers``. Parsers with an unknown set of
+        # leading characters (custom regex-like objects, patterns that may match an empty string)
+        # end up in every bucket.
+        self._leading_char_res = tuple([leading_char_re(p[0]) for p in self.parsers])
+        self.parsers_index: Dict[str, Tuple[Any, ...]] = {}
+        for code in range(128):
+            self.parsers_for(chr(code))
+        self.parsers_for('')
+        # Literals with inline links and other embedded markup tend to repeat the same snippets.
+        # Parsed snippets are memoized per syntax instance, because the result depends on its parsers.
+        self.parse_embedded_snippet = self._memoize_embedded_snippets()
+        # Caches of compiled blocks of markup languages, from the fastest to the slowest one
+        # (see :func:`plim.cache.compile_markup`). Assign an empty tuple to disable caching.
+        self.markup_caches: Sequence[Any] = (_cache.markup_cache,)
+        # Compilers of markup languages (see :data:`plim.lexer.MARKUP_LANGUAGES`)
+        self.markup_languages: Mapping[str, Any] = l.MARKUP_LANGUAGES
+        # An executor from :mod:`concurrent.futures` that compiles blocks of markup languages
+        # while the rest of the template is being parsed, or None to compile them one by one on emit.
+        self.markup_executor: Any = None
+        # bound emitter methods, resolved on the first call to emit()
+        self._emitters: Optional[Dict[type, Any]] = None
+
+    def _memoize_embedded_snippets(self) -> Any:
+        return functools.lru_cache(maxsize=self.EMBEDDED_MARKUP_MEMO_SIZE)(
+            functools.partial(l.parse_embedded_snippet, syntax=self)
+        )
+
+    def clone(self) -> 'BaseSyntax':
+        """ Returns a copy of the syntax that may be configured independently of this one,
+        e.g. with other :attr:`markup_caches`. The copy shares the parsers,
+        but memoizes embedded markup and resolves its emitters on its own.
+        """
+        syntax = copy.copy(self)
+        syntax.parse_embedded_snippet = syntax._memoize_embedded_snippets()
+        syntax._emitters = None
+        return syntax
+
+    def parsers_for(self, line: str) -> Tuple[Any, ...]:
+        """ Returns the parsers that may match the given line, in the same order as they appear
+        in :attr:`parsers`.
+
+        :param line: may be empty
+        """
+        leading_char = line[:1]
+        try:
+            return self.parsers_index[leading_char]
+        except KeyError:
+            candidates = tuple([
+                parser for parser, char_re in zip(self.parsers, self._leading_char_res)
+                if char_re is None or (leading_char and char_re.match(leading_char))
+            ])
+            # only ASCII characters are memoized, so that templates with many distinct
+            # non-ASCII leading characters don't grow the index without a bound
+            if leading_char < '\x80':
+                self.parsers_index[leading_char] = candidates
+            return candidates
+
+    # Emitters
+    # ----------------------------------
+    # Every emitter accepts a node and returns a sequence of strings, nodes, and lists of nodes,
+    # which are emitted in turn by :meth:`emit`.
+    EMITTERS: Mapping[type, str] = {
+        nodes.Fragment: 'emit_fragment',
+        nodes.Text: 'emit_text',
+        nodes.Expr: 'emit_expr',
+        nodes.Tag: 'emit_tag',
+        nodes.Statement: 'emit_statement',
+        nodes.EarlyReturn: 'emit_early_return',
+        nodes.DefBlock: 'emit_def_block',
+        nodes.CallBlock: 'emit_call_block',
+        nodes.Directive: 'emit_directive',
+        nodes.TextBlock: 'emit_text_block',
+        nodes.PythonBlock: 'emit_python_block',
+        nodes.MarkupBlock: 'emit_markup_block',
+    }
+
+    def emit(self, node: Any) -> str:
+        """ Renders a tree of :mod:`plim.nodes` into the target template language.
+
+        :param node: a node, a plain string, or a list of them
+        """
+        emitters = self._emitters
+        if emitters is None:
+            emitters = self._emitters = {cls: getattr(self, name) for cls, name in self.EMITTERS.items()}
+        buf = []
+        stack = [iter((node,))]
+        while stack:
+            for item in stack[-1]:
+                if isinstance(item, str):
+                    buf.append(item)
+                elif isinstance(item, list):
+                    stack.append(iter(item))
+                    break
+                else:
+                    stack.append(iter(emitters[type(item)](item)))
+                    break
+            else:
+                stack.pop()
+        return joined(buf)
+
+    def emit_parts(self, node: Any) -> Sequence[Any]:
+        """ Returns the sequence of strings, nodes, and lists of nodes that :meth:`emit` renders for the node.
+
+        :func:`plim.lexer.compile_stream` writes the parts that precede a list of children of a block
+        before the children are parsed, so emitters return the lists of children themselves rather than their copies.
+        """
+        emitters = self._emitters
+        if emitters is None:
+            emitters = self._emitters = {cls: getattr(self, name) for cls, name in self.EMITTERS.items()}
+        return emitters[type(node)](node)
+
+    def emit_fragment(self, node: nodes.Fragment) -> Sequence[Any]:
+        return node.children
+
+    def emit_text(self, node: nodes.Text) -> Sequence[Any]:
+        return (node.value,)
+
+    def emit_expr(self, node: nodes.Expr) -> Sequence[Any]:
+        code = node.code
+        if node.raw:
+            code = l._inject_n_filter(code)
+        return (
+            self.VARIABLE_PLACEHOLDER_START_SEQUENCE,
+            code,
+            self.VARIABLE_PLACEHOLDER_END_SEQUENCE,
+            node.trailing_space and ' ' or ''
+        )
+
+    def emit_attr(self, attr: nodes.Attr) -> str:
+        if attr.kind == nodes.ATTR_TOGGLE:
+            return u("""{start_var}({value}) and '{attr_name}="{attr_name}"' or ''|n{end_var}""").format(
+                value=attr.value,
+                attr_name=attr.name,
+                start_var=self.VARIABLE_PLACEHOLDER_START_SEQUENCE,
+                end_var=self.VARIABLE_PLACEHOLDER_END_SEQUENCE
+            )
+        if attr.kind == nodes.ATTR_SPREAD:
+            return u(
+                '\n%for __plim_key__, __plim_value__ in {expr}.items():\n'
+                '{var_start}__plim_key__{var_end}="{var_start}__plim_value__{var_end}"\n'
+                '%endfor\n'
+            ).format(
+                expr=attr.value,
+                var_start=self.VARIABLE_PLACEHOLDER_START_SEQUENCE,
+                var_end=self.VARIABLE_PLACEHOLDER_END_SEQUENCE
+            )
+        value = joined([part if isinstance(part, str) else self.emit(part) for part in attr.value])
+        return u('{attr_name}="{value}"').format(attr_name=attr.name, value=value)
+
+    def emit_attrs(self, attrs: Sequence[nodes.Attr]) -> str:
+        return space_separated([self.emit_attr(attr) for attr in attrs])
+
+    def emit_open_tag(self, node: nodes.Tag) -> str:
+        buf = ['<', node.name]
+        attributes = self.emit_attrs(node.attrs)
+        if attributes:
+            buf.extend([' ', attributes])
+        buf.append(node.name in l.EMPTY_TAGS and '/>' or '>')
+        return joined(buf)
+
+    def emit_close_tag(self, node: nodes.Tag) -> str:
+        if node.name in l.EMPTY_TAGS:
+            return ''
+        return u('</{tag}>').format(tag=node.name)
+
+    def emit_tag(self, node: nodes.Tag) -> Sequence[Any]:
+        return (self.emit_open_tag(node), node.children, self.emit_close_tag(node))
+
+    def emit_clause(self, statement: nodes.Statement, clause: nodes.Clause) -> str:
+        if statement.keyword == 'try':
+            # clauses of "-try" are written in Mako syntax
+            if clause.keyword == 'except':
+                return u('\n%except {expr}:\n').format(expr=clause.expr)
+            return u('\n%{control}:\n').format(control=clause.keyword)
+        buf = ['\n', self.STATEMENT_START_START_SEQUENCE, clause.keyword]
+        if clause.expr is not None:
+            buf.extend([' ', clause.expr])
+        buf.extend([self.STATEMENT_START_END_SEQUENCE, '\n'])
+        return joined(buf)
+
+    def emit_statement(self, node: nodes.Statement) -> Sequence[Any]:
+        buf: List[Any] = ['\n', self.STATEMENT_START_START_SEQUENCE, node.keyword]
+        if node.expr is not None:
+            buf.extend([' ', node.expr])
+        buf.extend([self.STATEMENT_START_END_SEQUENCE, '\n', node.children])
+        for clause in node.clauses:
+            buf.extend([self.emit_clause(node, clause), clause.children])
+        buf.extend([
+            '\n',
+            self.STATEMENT_END_START_SEQUENCE,
+            u('end{statement}').format(statement=node.keyword),
+            self.STATEMENT_END_END_SEQUENCE,
+            '\n'
+        ])
+        return buf
+
+    def emit_early_return(self, node: nodes.EarlyReturn) -> Sequence[Any]:
+        return (u('\n<% {keyword} %>\n').format(keyword=node.keyword),)
+
+    def emit_def_block(self, node: nodes.DefBlock) -> Sequence[Any]:
+        buf: List[Any] = [u('<%{def_or_block}').format(def_or_block=node.kind)]
+        name = self.emit(node.name)
+        if name:
+            buf.append(u(' name="{name}"').format(name=name.strip()))
+        attributes = self.emit_attrs(node.attrs)
+        if attributes:
+            buf.extend([' ', attributes])
+        buf.extend(['>\n', node.children, u('</%{def_or_block}>\n').format(def_or_block=node.kind)])
+        return buf
+
+    def emit_call_block(self, node: nodes.CallBlock) -> Sequence[Any]:
+        tag = self.emit(node.target).strip()
+        buf: List[Any] = [u('\n<%{tag}').format(tag=tag)]
+        attributes = self.emit_attrs(node.attrs)
+        if attributes:
+            buf.extend([' ', attributes])
+        buf.extend(['>\n', node.children, u('</%{tag}>\n').format(tag=tag)])
+        return buf
+
+    def emit_directive(self, node: nodes.Directive) -> Sequence[Any]:
+        buf = [u('<%{tag}').format(tag=node.name)]
+        file = self.emit(node.file)
+        if file:
+            buf.append(u(' file="{name}"').format(name=file))
+        attributes = self.emit_attrs(node.attrs)
+        if attributes:
+            buf.extend([' ', attributes])
+        buf.append('/>')
+        return buf
+
+    def emit_text_block(self, node: nodes.TextBlock) -> Sequence[Any]:
+        buf = ['\n<%text']
+        attributes = self.emit_attrs(node.attrs)
+        if attributes:
+            buf.extend([' ', attributes])
+        buf.append('>\n')
+        content = self.emit(node.content)
+        if content:
+            buf.extend([content, '\n'])
+        if node.body:
+            buf.append(u('{literal}\n').format(literal=node.body.rstrip()))
+        buf.append('</%text>\n')
+        return buf
+
+    def emit_python_block(self, node: nodes.PythonBlock) -> Sequence[Any]:
+        # do not render a python block if it's empty
+        if node.inline is None and not node.body:
+            return ()
+        buf = [node.module_level and '<%!\n' or '<%\n']
+        if node.inline is not None:
+            buf.extend([node.inline, '\n'])
+        buf.extend([u('{literal}\n').format(literal=node.body.rstrip()), '%>\n'])
+        return buf
+
+    def emit_markup_block(self, node: nodes.MarkupBlock) -> Sequence[Any]:
+        # This is slow but correct.
+        # Trying to remove redundant indentation
+        if node.compiled is not None:
+            return (node.compiled.result().strip(),)
+        return (_cache.compile_markup(node.lang, node.source, self.markup_caches, self.markup_languages).strip(),)
+
+    def submit_markup(self, lang: str, source: str) -> Any:
+        """ Starts compilation of a block of markup with :attr:`markup_executor`, and returns
+        a :class:`concurrent.futures.Future` of the result, or None if the syntax has no executor.
+        """
+        if self.markup_executor is None:
+            return None
+        return _cache.submit_markup(self.markup_executor, lang, source, self.markup_caches,
+                                    self.markup_languages)
+
     def __str__(self) -> str:
         return 'Base Syntax'
 
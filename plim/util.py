@@ -1,5 +1,8 @@
+import contextlib
+import os
+import secrets
 import sys
-from typing import Sequence, Iterable
+from typing import Any, IO, Iterable, Iterator, Optional, Sequence
 
 PY3K = sys.version_info >= (3, 0)
 
@@ -19,3 +22,51 @@ def space_separated(buf: Sequence[str]) -> str:
 
 u = str
 MAXSIZE = sys.maxsize
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'wb', encoding: Optional[str] = None, errors: Optional[str] = None,
+                 newline: Optional[str] = None) -> Iterator[IO[Any]]:
+    """ Opens a temporary file next to ``path`` for writing, and replaces ``path`` with it atomically
+    when the ``with`` block succeeds. The temporary file is removed if the block fails, so that
+    the file at ``path`` is never partially written. Missing directories are created,
+    and the file gets the default permissions of new files (see ``umask``).
+
+    :param mode: ``'wb'`` or ``'w'``. Other arguments are passed to :func:`open` in text mode.
+    """
+    directory = os.path.dirname(path) or os.curdir
+    os.makedirs(directory, exist_ok=True)
+    while True:
+        tmp_path = os.path.join(directory, '.tmp-' + secrets.token_hex(8))
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        except FileExistsError:
+            continue
+        break
+    try:
+        with open(fd, mode, encoding=encoding, errors=errors, newline=newline) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_if_changed(path: str, content: bytes) -> bool:
+    """ Writes the content to the file, unless the file already has exactly the same content.
+    The file is replaced atomically, and missing directories are created.
+
+    :return: whether the file has been written
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+    except (IOError, OSError):
+        pass
+    with atomic_write(path) as f:
+        f.write(content)
+    return True
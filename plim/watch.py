@@ -0,0 +1,171 @@
+""" Incremental recompilation of a directory of templates on changes.
+
+:class:`Watcher` polls the modification times of templates, and recompiles the changed templates
+along with the templates that depend on them (see :class:`plim.deps.DependencyGraph`).
+"""
+import codecs
+import os
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from .deps import DependencyGraph
+from .util import write_if_changed
+
+
+# ``changed`` are the URIs of changed, added, and removed templates, ``compiled`` are the URIs
+# of recompiled templates (changed and affected ones), ``written`` is the number of updated output files,
+# ``removed`` is the number of output files removed along with their templates,
+# ``failed`` maps URIs of the templates that failed to compile to exceptions,
+# and ``seconds`` is the duration of the rebuild.
+Rebuild = namedtuple('Rebuild', ['changed', 'compiled', 'written', 'removed', 'failed', 'seconds'])
+
+
+class Watcher(object):
+    """ Keeps compiled templates of a directory in sync with their sources.
+
+    Call :meth:`start` to compile all templates, and :meth:`poll` and :meth:`rebuild` (or :meth:`run`)
+    to recompile the templates affected by changes since then.
+    """
+
+    def __init__(self, source_dir: str, output_dir: str, preprocessor: Callable[[str], str],
+                 extension: str = '.plim', output_extension: str = '.mako', encoding: str = 'utf-8',
+                 syntax: Any = None):
+        """
+        :param source_dir: root directory of plim templates
+        :param output_dir: directory of compiled templates. It mirrors the tree of ``source_dir``.
+        :param preprocessor: preprocessor instance
+        :param extension: extension of plim templates
+        :param output_extension: extension of compiled templates
+        :param encoding: content encoding
+        :param syntax: syntax that is used to find dependencies between templates
+                       (the syntax of ``preprocessor`` by default).
+        :type syntax: :class:`plim.syntax.BaseSyntax`
+        """
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.preprocessor = preprocessor
+        self.extension = extension
+        self.output_extension = output_extension
+        self.encoding = encoding
+        if syntax is None:
+            syntax = getattr(preprocessor, 'keywords', {}).get('syntax')
+        self.graph = DependencyGraph(source_dir, extension, syntax, encoding)
+        # URI -> (mtime, size) of every template
+        self.snapshot: Dict[str, Tuple[int, int]] = {}
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        """ Returns the current (mtime, size) of every template. Like :func:`plim.deps.iter_template_uris`,
+        the scan doesn't follow symbolic links to directories.
+        """
+        result = {}
+        stack = [('', self.source_dir)]
+        while stack:
+            uri_prefix, directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    # such as a cycle of symbolic links
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink():
+                        stack.append((uri_prefix + '/' + entry.name, entry.path))
+                elif entry.name.endswith(self.extension):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    result[uri_prefix + '/' + entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return result
+
+    def output_path(self, uri: str) -> str:
+        """ Returns the path to the compiled template.
+        """
+        path = os.path.join(self.output_dir, *uri.lstrip('/').split('/'))
+        return path[:len(path) - len(self.extension)] + self.output_extension
+
+    def _read(self, uri: str) -> str:
+        with codecs.open(self.graph.path(uri), 'rb', self.encoding) as f:
+            return f.read()
+
+    def start(self) -> Rebuild:
+        """ Compiles all the templates of the directory.
+        """
+        self.snapshot = self.scan()
+        return self.rebuild(self.snapshot)
+
+    def poll(self) -> Set[str]:
+        """ Returns the URIs of templates that have been changed, added, or removed since the previous poll.
+        """
+        snapshot = self.scan()
+        previous = self.snapshot
+        self.snapshot = snapshot
+        changed = set(uri for uri, state in snapshot.items() if previous.get(uri) != state)
+        changed.update(uri for uri in previous if uri not in snapshot)
+        return changed
+
+    def rebuild(self, changed: Iterable[str]) -> Rebuild:
+        """ Recompiles the changed templates and the templates that depend on them.
+        Outputs of removed templates are removed as well.
+        """
+        started_at = time.perf_counter()
+        changed = set(changed)
+        removed = 0
+        sources = {}
+        for uri in changed:
+            if uri in self.snapshot:
+                try:
+                    sources[uri] = self._read(uri)
+                except (IOError, OSError):
+                    self.graph.update(uri)
+                else:
+                    self.graph.update(uri, sources[uri])
+            else:
+                self.graph.remove(uri)
+                try:
+                    os.remove(self.output_path(uri))
+                    removed += 1
+                except OSError:
+                    pass
+
+        compiled = sorted(uri for uri in self.graph.affected(changed) if uri in self.snapshot)
+        written = 0
+        failed = {}
+        for uri in compiled:
+            try:
+                source = sources[uri] if uri in sources else self._read(uri)
+                result = codecs.encode(self.preprocessor(source), self.encoding)
+                written += write_if_changed(self.output_path(uri), result)
+            except Exception as e:
+                failed[uri] = e
+        return Rebuild(sorted(changed), compiled, written, removed, failed, time.perf_counter() - started_at)
+
+    def run(self, report: Callable[[Rebuild], None], interval: float = 0.1, debounce: float = 0.05,
+            max_rebuilds: Optional[int] = None) -> None:
+        """ Polls the directory every ``interval`` seconds and rebuilds affected templates.
+        A rebuild starts when no more changes have been seen for ``debounce`` seconds,
+        so that a burst of saves is handled at once.
+
+        :param report: a callable that accepts every :class:`Rebuild`, including the initial one
+        :param max_rebuilds: stop after this number of rebuilds after the initial one (never stop by default)
+        """
+        report(self.start())
+        rebuilds = 0
+        pending: Set[str] = set()
+        last_change_at = 0.0
+        while max_rebuilds is None or rebuilds < max_rebuilds:
+            time.sleep(debounce if pending else interval)
+            changed = self.poll()
+            now = time.monotonic()
+            if changed:
+                pending.update(changed)
+                last_change_at = now
+            elif pending and now - last_change_at >= debounce:
+                report(self.rebuild(pending))
+                pending = set()
+                rebuilds += 1
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import io
 import os
 import codecs
 import unittest
@@ -63,6 +64,27 @@ class TestPreprocessorSyntax(TestCaseBase):
             self.check_relevant_chars(data.strip(), result.strip())
 
 
+    def test_compile_stream(self):
+        for test_case in ('if', 'try', 'def_block', 'style_script', 'embedded', 'dynamic_attributes'):
+            source = self.get_file_contents(test_case + '_test.plim')
+            sink = io.StringIO()
+            plim.compile_stream(io.StringIO(source), sink)
+            self.assertEqual(sink.getvalue(), plim.preprocessor(source))
+
+        chunks = []
+        plim.compile_stream(io.StringIO('\r\n\np a\r\n\r\n-if x\r\n  p b\r\n\r\n'), chunks.append)
+        self.assertEqual(chunks, ['<p>a', '</p>', '\n%if x:', '\n<p>b', '</p>', '\n%endif'])
+
+        django_preprocessor = plim.preprocessor_factory(syntax='django')
+        chunks = []
+        django_preprocessor.stream('p = x\np = y', chunks.append)
+        self.assertEqual(''.join(chunks), '<p>{{x}}</p><p>{{y}}</p>')
+
+        # nested blocks are written before their parents are complete
+        chunks = []
+        plim.compile_stream(io.StringIO('html\n  body\n    p a\n    p b\n'), chunks.append)
+        self.assertEqual(chunks, ['<html>', '<body>', '<p>a', '</p>', '<p>b', '</p>', '</body>', '</html>'])
+
     def test_dynamic_attributes(self):
         test_case = 'dynamic_attributes'
         source = self.get_file_contents(test_case + '_test.plim')
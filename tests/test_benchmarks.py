@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+
+from benchmarks import compile as compile_benchmark
+from benchmarks import render as render_benchmark
+from benchmarks.generators import GENERATORS
+from plim import syntax
+from plim.lexer import compile_plim_source
+from . import TestCaseBase
+
+
+class TestCompileBenchmark(TestCaseBase):
+
+    def test_generators(self):
+        for name, generator in GENERATORS.items():
+            source = generator(120)
+            self.assertEqual(source.count('\n') + 1, 120, name)
+            for syntax_ in (syntax.Mako(), syntax.Django()):
+                self.assertTrue(compile_plim_source(source, syntax_), name)
+
+    def test_scaling_exponent(self):
+        linear = [(size, size * 0.001) for size in (100, 200, 400)]
+        quadratic = [(size, size * size * 0.001) for size in (100, 200, 400)]
+        self.assertAlmostEqual(compile_benchmark.scaling_exponent(linear), 1.0)
+        self.assertAlmostEqual(compile_benchmark.scaling_exponent(quadratic), 2.0)
+
+    def test_measure_time(self):
+        syntaxes = []
+
+        def syntax_factory():
+            syntaxes.append(compile_benchmark.new_syntax('mako'))
+            return syntaxes[-1]
+
+        cold, warm = compile_benchmark.measure_time(GENERATORS['embedded_markup'](40), syntax_factory, 2)
+        self.assertTrue(cold > 0 and warm > 0)
+        # every cold compilation starts with a new syntax and an empty cache of markup blocks
+        self.assertEqual(len(syntaxes), 2)
+        self.assertIsNot(syntaxes[0].markup_caches[0], syntaxes[1].markup_caches[0])
+
+    def test_run(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        output = os.path.join(output_dir, 'results.json')
+        argv = ['-s', '20', '40', '-g', 'if_chains', '--syntax', 'mako', '-r', '1', '--max-exponent', '100', '-o', output]
+        self.assertEqual(compile_benchmark.main(argv), 0)
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual([row['lines'] for row in report['results']], [20, 40])
+        self.assertTrue(all(row['peak_memory'] > 0 for row in report['results']))
+        self.assertTrue(all(row['warm_seconds'] > 0 for row in report['results']))
+        self.assertEqual(len(report['scaling']), 1)
+
+        text = compile_benchmark.format_report(report, baseline=report)
+        self.assertIn('+0.0%', text)
+        report['scaling'][0]['superlinear'] = True
+        self.assertIn('SUPERLINEAR: if_chains (mako)', compile_benchmark.format_report(report))
+
+
+class TestRenderBenchmark(TestCaseBase):
+
+    def test_run(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        output = os.path.join(output_dir, 'results.json')
+        argv = ['-s', '5', '-r', '1', '--min-seconds', '0', '--fixtures', '-o', output]
+        self.assertEqual(render_benchmark.main(argv), 0)
+        with open(output) as f:
+            report = json.load(f)
+        cases = set(render_benchmark.CASES)
+        self.assertEqual(set((row['case'], row['variant']) for row in report['results']),
+                         set((case, variant) for case in cases for variant in ('plim', 'mako')))
+        for row in report['results']:
+            self.assertTrue(row['renders_per_second'] > 0)
+            self.assertTrue(row['writer_calls'] > 0)
+            self.assertTrue(row['render_writes'] > 0)
+        self.assertTrue(any('module_size' in row for row in report['fixtures']))
+
+        text = render_benchmark.format_report(report, baseline=report)
+        self.assertIn('+0.0%', text)
+        self.assertIn('for_test.plim', text)
+
+    def test_count_writes(self):
+        template = render_benchmark.Template('${a}\n% for i in b:\n${i}\n% endfor\n')
+        buf = render_benchmark.count_writes(template, {'a': 1, 'b': [2, 3]})
+        self.assertEqual(buf.getvalue(), '1\n2\n3\n')
+        self.assertEqual(buf.writes, 6)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from plim import preprocessor_factory
+from plim import cache
+from plim import lexer
+from plim import syntax
+from . import TestCaseBase
+
+
+def parse_custom(indent_level, current_line, matched, source, syntax):
+    return 'custom', indent_level, '', source
+
+
+class TestCache(TestCaseBase):
+
+    def test_lru_cache(self):
+        lru = cache.LRUCache(max_entries=2)
+        lru.set('a', 'A')
+        lru.set('b', 'B')
+        self.assertEqual(lru.get('a'), 'A')
+        lru.set('c', 'C')
+        # "b" is the least recently used entry
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('c'), 'C')
+        self.assertEqual((lru.hits, lru.misses, lru.evictions), (2, 1, 1))
+        self.assertEqual(len(lru), 2)
+
+        lru = cache.LRUCache(max_entries=10, max_bytes=4)
+        lru.set('a', u'аб')
+        lru.set('b', 'cd')
+        self.assertNotIn('a', lru)
+        self.assertEqual(lru.total_bytes, 2)
+        lru.set('c', 'too long')
+        self.assertNotIn('c', lru)
+        lru.clear()
+        self.assertEqual((len(lru), lru.total_bytes, lru.evictions), (0, 0, 0))
+        self.assertRaises(ValueError, cache.LRUCache, 0)
+
+    def test_syntax_fingerprint(self):
+        fingerprint = cache.syntax_fingerprint(syntax.Mako())
+        self.assertEqual(fingerprint, cache.syntax_fingerprint(syntax.Mako()))
+        self.assertNotEqual(fingerprint, cache.syntax_fingerprint(syntax.Django()))
+        custom_parsers = [(re.compile('^custom$'), parse_custom)]
+        self.assertNotEqual(fingerprint, cache.syntax_fingerprint(syntax.Mako(custom_parsers)))
+
+    def test_cached_preprocessor(self):
+        preprocessor = preprocessor_factory(cache_size=10)
+        source = self.get_file_contents('if_test.plim')
+        result = preprocessor(source)
+        self.check_relevant_chars(result, self.get_file_contents('if_result.mako'))
+        self.assertEqual(preprocessor(source), result)
+        self.assertEqual(preprocessor(source, strip=False).strip(), result)
+        self.assertEqual(
+            (preprocessor.cache.hits, preprocessor.cache.misses, len(preprocessor.cache)),
+            (1, 2, 2)
+        )
+        self.assertFalse(hasattr(preprocessor_factory(), 'cache'))
+
+    def test_disk_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        source = self.get_file_contents('if_test.plim')
+        preprocessor = preprocessor_factory(cache_dir=cache_dir)
+        result = preprocessor(source)
+        self.assertEqual((preprocessor.disk_cache.hits, preprocessor.disk_cache.misses), (0, 1))
+
+        # another process with the same syntax finds the template on disk
+        preprocessor = preprocessor_factory(cache_size=10, cache_dir=cache_dir)
+        self.assertEqual(preprocessor(source), result)
+        self.assertEqual(preprocessor(source), result)
+        self.assertEqual((preprocessor.cache.hits, preprocessor.disk_cache.hits), (1, 1))
+
+        files = [name for _, __, names in os.walk(cache_dir) for name in names]
+        self.assertEqual(len(files), 1)
+        self.assertFalse(files[0].startswith('.tmp'))
+
+        django_preprocessor = preprocessor_factory(syntax='django', cache_dir=cache_dir)
+        self.assertNotEqual(django_preprocessor(source), result)
+        self.assertEqual(django_preprocessor.disk_cache.hits, 0)
+
+    def test_cached_preprocessor_keeps_original(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        original = preprocessor_factory(segment_cache_size=10)
+        markup_caches = original.keywords['syntax'].markup_caches
+        for _ in range(3):
+            cached = cache.cached_preprocessor(original, cache_dir=cache_dir)
+        # the original preprocessor doesn't write blocks of markup languages to the directory
+        self.assertEqual(original.keywords['syntax'].markup_caches, markup_caches)
+        syntax = cached.keywords['syntax']
+        self.assertIsNot(syntax, original.keywords['syntax'])
+        self.assertEqual(syntax.markup_caches, tuple(markup_caches) + (cached.disk_cache,))
+        self.assertIs(cached.compiler.syntax, syntax)
+        source = self.get_file_contents('if_test.plim')
+        self.assertEqual(cached(source), original(source))
+
+        # blocks of markup languages are emitted by the copy even if the original has been used before
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        original = preprocessor_factory()
+        self.assertEqual(original('-md\n  # Title'), '<h1>Title</h1>')
+        cached = cache.cached_preprocessor(original, cache_dir=cache_dir)
+        self.assertEqual(cached('-md\n  # Title\n\n  text'), '<h1>Title</h1>\n\n<p>text</p>')
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(cache_dir)), 2)
+
+    def test_disk_cache_permissions(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        disk_cache = cache.DiskCache(cache_dir)
+        umask = os.umask(0o027)
+        try:
+            disk_cache.set('a' * 40, 'compiled')
+        finally:
+            os.umask(umask)
+        self.assertEqual(disk_cache.get('a' * 40), 'compiled')
+        if os.name == 'posix':
+            self.assertEqual(os.stat(disk_cache.path('a' * 40)).st_mode & 0o777, 0o640)
+
+    def test_cached_preprocessor_stream(self):
+        preprocessor = cache.cached_preprocessor(preprocessor_factory(), cache_size=10)
+        source = self.get_file_contents('if_test.plim')
+        output = io.StringIO()
+        preprocessor.stream(io.StringIO(source), output)
+        self.assertEqual(output.getvalue(), preprocessor(source))
+        self.assertEqual(preprocessor.cache.hits, 1)
+        self.assertRaises(TypeError, cache.cached_preprocessor, lambda source: source, cache_size=10)
+
+    def test_markup_cache(self):
+        calls = []
+
+        def markdown(source):
+            calls.append(source)
+            return '<p>{}</p>'.format(source.strip())
+
+        original = lexer.MARKUP_LANGUAGES['md']
+        lexer.MARKUP_LANGUAGES['md'] = markdown
+        self.addCleanup(lexer.MARKUP_LANGUAGES.__setitem__, 'md', original)
+
+        memory_cache = cache.LRUCache(10)
+        self.assertEqual(cache.compile_markup('md', 'text', [memory_cache]), '<p>text</p>')
+        self.assertEqual(cache.compile_markup('md', 'text', [memory_cache]), '<p>text</p>')
+        self.assertEqual(len(calls), 1)
+        self.assertNotEqual(cache.markup_cache_key('md', 'text'), cache.markup_cache_key('markdown', 'text'))
+        lexer.MARKUP_LANGUAGES['md'] = original
+        self.assertNotEqual(cache.compile_markup('md', 'text', [memory_cache]), '<p>text</p>')
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        lexer.MARKUP_LANGUAGES['md'] = markdown
+        source = '-md\n  changed block\n-md\n  unchanged block'
+        preprocessor = preprocessor_factory(cache_dir=cache_dir)
+        preprocessor(source)
+        self.assertEqual(len(calls), 3)
+        # the template is changed, but its second block is the same
+        preprocessor = preprocessor_factory(cache_dir=cache_dir)
+        preprocessor.keywords['syntax'].markup_caches = (preprocessor.disk_cache,)
+        self.assertEqual(preprocessor(source.replace('changed', 'edited', 1)), '<p>edited block</p><p>unchanged block</p>')
+        self.assertEqual(calls[3:], ['edited block'])
+
+    def test_markup_executor(self):
+        # every block waits for the others, so they can be compiled only at the same time
+        barrier = threading.Barrier(3, timeout=10)
+
+        def markdown(source):
+            barrier.wait()
+            return '<p>{}</p>'.format(source.strip())
+
+        original = lexer.MARKUP_LANGUAGES['md']
+        lexer.MARKUP_LANGUAGES['md'] = markdown
+        self.addCleanup(lexer.MARKUP_LANGUAGES.__setitem__, 'md', original)
+        executor = ThreadPoolExecutor(3)
+        self.addCleanup(executor.shutdown)
+
+        source = 'div\n  -md\n    one\np\n-md\n  two\n-md\n  three'
+        expected = '<div><p>one</p></div><p></p><p>two</p><p>three</p>'
+        for segment_cache_size in (0, 100):
+            preprocessor = preprocessor_factory(markup_executor=executor, segment_cache_size=segment_cache_size)
+            preprocessor.keywords['syntax'].markup_caches = ()
+            self.assertEqual(preprocessor(source), expected)
+
+        # cached blocks are not submitted
+        barrier = threading.Barrier(1)
+        memory_cache = cache.LRUCache(10)
+        future = cache.submit_markup(executor, 'md', 'four', [memory_cache])
+        self.assertEqual(future.result(), '<p>four</p>')
+        executor.shutdown()
+        # the executor doesn't accept new tasks anymore
+        self.assertEqual(cache.submit_markup(executor, 'md', 'four', [memory_cache]).result(), '<p>four</p>')
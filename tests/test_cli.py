@@ -5,8 +5,10 @@ import codecs
 import tempfile
 import shutil
 
+from mako.lookup import TemplateLookup
+
 from plim import syntax
-from plim.console import plimc
+from plim.console import plimc, plimc_watch
 from plim.util import PY3K
 from . import TestCaseBase
 
@@ -25,6 +27,55 @@ class TestCLI(TestCaseBase):
     def test_cli_html_output(self):
         plimc(['--html', 'tests/fixtures/unicode_attributes_test.plim'], stdout=self.stdout)
 
+    def test_cli_profile(self):
+        from io import StringIO
+        stderr = StringIO()
+        plimc(['--profile', 'tests/fixtures/for_test.plim'], stdout=self.stdout, stderr=stderr)
+        lines = stderr.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('parser'))
+        self.assertTrue(lines[1].startswith('parse_statements'))
+        self.assertIn('lookups of parsers', lines[-1])
+
+    def test_cli_memory(self):
+        from io import BytesIO, StringIO
+        stderr = StringIO()
+        status = plimc(['--memory', 'tests/fixtures/for_test.plim'], stdout=self.stdout, stderr=stderr)
+        self.assertEqual(status, 0)
+        self.assertTrue(stderr.getvalue().startswith('peak memory'))
+
+        stderr = StringIO()
+        status = plimc(['--memory-budget', '1K', 'tests/fixtures/for_test.plim'], stdout=BytesIO(), stderr=stderr)
+        self.assertEqual(status, 1)
+        self.assertIn('over the memory budget of 1024 bytes', stderr.getvalue())
+
+    def test_cli_cache_dir(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        output = os.path.join(cache_dir, 'result.mako')
+        results = []
+        for args in ([], ['--cache-dir', cache_dir], ['--cache-dir', cache_dir]):
+            plimc(args + ['-o', output, 'tests/fixtures/unicode_attributes_test.plim'])
+            with codecs.open(output, 'r', 'utf-8') as f:
+                results.append(f.read())
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(results[2], results[0])
+        self.assertEqual(len([name for name in os.listdir(cache_dir) if name != 'result.mako']), 1)
+
+    def test_cli_output_kept_on_error(self):
+        from plim.errors import PlimSyntaxError
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        source = os.path.join(tmp_dir, 'broken.plim')
+        with codecs.open(source, 'w', 'utf-8') as f:
+            f.write('div\n  p hello\na(href="x\n')
+        output = os.path.join(tmp_dir, 'result.mako')
+        with codecs.open(output, 'w', 'utf-8') as f:
+            f.write('previous')
+        self.assertRaises(PlimSyntaxError, plimc, ['-o', output, source])
+        with codecs.open(output, 'r', 'utf-8') as f:
+            self.assertEqual(f.read(), 'previous')
+        self.assertEqual(sorted(os.listdir(tmp_dir)), ['broken.plim', 'result.mako'])
+
     def test_custom_preprocessor(self):
         initial_cwd = os.getcwd()
         tmp_dir = tempfile.mkdtemp()
@@ -55,3 +106,112 @@ class TestCLI(TestCaseBase):
         # Cleanup
         os.chdir(initial_cwd)
         shutil.rmtree(tmp_dir)
+
+    def test_cli_build(self):
+        source_dir = tempfile.mkdtemp()
+        module_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        self.addCleanup(shutil.rmtree, module_dir)
+        os.mkdir(os.path.join(source_dir, 'pages'))
+        with codecs.open(os.path.join(source_dir, 'index.plim'), 'w', 'utf-8') as f:
+            f.write('div\n  p = title\n')
+        shutil.copy('tests/fixtures/unicode_attributes_test.plim', os.path.join(source_dir, 'pages', 'a.plim'))
+
+        status = plimc(['build', source_dir, '--module-dir', module_dir], stdout=self.stdout)
+        self.assertEqual(status, 0)
+        self.assertIn(b'2 templates compiled', self.stdout.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(module_dir, 'index.plim.py')))
+        self.assertTrue(os.path.exists(os.path.join(module_dir, 'pages', 'a.plim.py')))
+
+        # the modules are used as they are, without compiling the templates again
+        def preprocessor(source):
+            raise AssertionError('The template must not be compiled')
+
+        lookup = TemplateLookup(directories=[source_dir], module_directory=module_dir, preprocessor=preprocessor)
+        self.assertEqual(lookup.get_template('/index.plim').render_unicode(title='x'), '<div><p>x</p></div>')
+
+    def test_cli_batch(self):
+        source_dir = tempfile.mkdtemp()
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        self.addCleanup(shutil.rmtree, output_dir)
+        os.mkdir(os.path.join(source_dir, 'pages'))
+        for name, content in (('index.plim', 'div = title'), (os.path.join('pages', 'a.plim'), 'p text')):
+            with codecs.open(os.path.join(source_dir, name), 'w', 'utf-8') as f:
+                f.write(content)
+
+        status = plimc(['batch', source_dir, '-o', output_dir, '-j', '2'], stdout=self.stdout)
+        self.assertEqual(status, 0)
+        self.assertIn(b'2 templates in', self.stdout.getvalue())
+        self.assertIn(b'2 written', self.stdout.getvalue())
+        output_path = os.path.join(output_dir, 'pages', 'a.mako')
+        with codecs.open(output_path, 'r', 'utf-8') as f:
+            self.assertEqual(f.read(), '<p>text</p>')
+
+        os.utime(output_path, (0, 0))
+        stdout = self.stdout.__class__()
+        pattern = os.path.join(source_dir, '**', '*.plim')
+        status = plimc(['batch', pattern, '-o', output_dir, '-j', '1'], stdout=stdout)
+        self.assertEqual(status, 0)
+        self.assertIn(b'0 written, 2 unchanged', stdout.getvalue())
+        self.assertEqual(os.stat(output_path).st_mtime, 0)
+
+        with codecs.open(os.path.join(source_dir, 'broken.plim'), 'w', 'utf-8') as f:
+            f.write('-incorrect_directive')
+        stdout = self.stdout.__class__()
+        status = plimc(['batch', source_dir, '-o', output_dir], stdout=stdout)
+        self.assertEqual(status, 1)
+        self.assertIn(b'1 failed', stdout.getvalue())
+        self.assertIn(b'ParserNotFound', stdout.getvalue())
+
+        stdout = self.stdout.__class__()
+        status = plimc(['batch', pattern, '-o', output_dir, '-j', '1', '--memory-budget', '1K'], stdout=stdout)
+        self.assertEqual(status, 1)
+        self.assertIn(b'MemoryBudgetExceeded', stdout.getvalue())
+
+        # the same template given twice is compiled once, different templates must not share an output file
+        stdout = self.stdout.__class__()
+        index = os.path.join(source_dir, 'index.plim')
+        status = plimc(['batch', index, index, '-o', output_dir], stdout=stdout)
+        self.assertEqual(status, 0)
+        self.assertIn(b'1 templates in', stdout.getvalue())
+        missing = os.path.join(source_dir, 'missing.plim')
+        status = plimc(['batch', missing, missing, '-o', output_dir], stdout=self.stdout.__class__())
+        self.assertEqual(status, 1)
+        with codecs.open(os.path.join(source_dir, 'pages', 'index.plim'), 'w', 'utf-8') as f:
+            f.write('p page')
+        with self.assertRaises(SystemExit) as context:
+            plimc(['batch', index, os.path.join(source_dir, 'pages', 'index.plim'), '-o', output_dir], stdout=stdout)
+        self.assertEqual(context.exception.code, 2)
+
+    def test_cli_deps(self):
+        source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        for name, content in (('base.plim', 'html'), ('index.plim', '-inherit base.plim'), ('a.plim', 'p')):
+            with codecs.open(os.path.join(source_dir, name), 'w', 'utf-8') as f:
+                f.write(content)
+
+        status = plimc(['deps', source_dir], stdout=self.stdout)
+        self.assertEqual(status, 0)
+        self.assertEqual(self.stdout.getvalue(), b'/a.plim: \n/base.plim: \n/index.plim: /base.plim\n')
+
+        stdout = self.stdout.__class__()
+        plimc(['deps', source_dir, '--reverse'], stdout=stdout)
+        self.assertEqual(stdout.getvalue(), b'/base.plim: /index.plim\n')
+
+        stdout = self.stdout.__class__()
+        plimc(['deps', source_dir, '--affected', 'base.plim'], stdout=stdout)
+        self.assertEqual(stdout.getvalue(), b'/base.plim\n/index.plim\n')
+
+    def test_cli_watch(self):
+        source_dir = tempfile.mkdtemp()
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        self.addCleanup(shutil.rmtree, output_dir)
+        with codecs.open(os.path.join(source_dir, 'index.plim'), 'w', 'utf-8') as f:
+            f.write('p text')
+
+        status = plimc_watch([source_dir, '--out', output_dir], stdout=self.stdout, max_rebuilds=0)
+        self.assertEqual(status, 0)
+        self.assertIn(b'1 templates rebuilt in', self.stdout.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(output_dir, 'index.mako')))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import codecs
+import os
+import shutil
+import tempfile
+
+from plim import deps
+from plim import syntax
+from plim.errors import ParserNotFound
+from . import TestCaseBase
+
+
+class TestDependencies(TestCaseBase):
+
+    def test_template_dependencies(self):
+        source = '\n'.join([
+            '-inherit base.plim',
+            '-namespace name="forms" file="/lib/forms.plim"',
+            '-namespace name="helpers" module="app.helpers"',
+            '-page args="title"',
+            '-if title',
+            '  div',
+            '    -include file="header.plim"',
+            '-include ${dynamic}',
+            '/ -include commented.plim',
+        ])
+        self.assertEqual(deps.template_dependencies(source), [
+            deps.Dependency('inherit', 'base.plim'),
+            deps.Dependency('namespace', '/lib/forms.plim'),
+            deps.Dependency('include', 'header.plim'),
+        ])
+        self.assertEqual(deps.template_dependencies('div\n  p', syntax.Mako()), [])
+        # Django templates don't have these directives
+        self.assertRaises(ParserNotFound, deps.template_dependencies, source, syntax.Django())
+
+    def test_resolve_uri(self):
+        self.assertEqual(deps.resolve_uri('base.plim', '/pages/index.plim'), '/pages/base.plim')
+        self.assertEqual(deps.resolve_uri('../base.plim', '/pages/index.plim'), '/base.plim')
+        self.assertEqual(deps.resolve_uri('/base.plim', '/pages/index.plim'), '/base.plim')
+        self.assertEqual(deps.resolve_uri('base.plim'), '/base.plim')
+
+    def test_dependency_graph(self):
+        source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        os.mkdir(os.path.join(source_dir, 'pages'))
+        templates = {
+            'base.plim': 'html = next.body()',
+            'lib.plim': '-def button()\n  button',
+            os.path.join('pages', 'layout.plim'): '-inherit /base.plim\n-namespace name="lib" file="/lib.plim"',
+            os.path.join('pages', 'index.plim'): '-inherit layout.plim',
+            'other.plim': 'p',
+        }
+        for name, content in templates.items():
+            with codecs.open(os.path.join(source_dir, name), 'w', 'utf-8') as f:
+                f.write(content)
+
+        graph = deps.DependencyGraph.build(source_dir)
+        self.assertEqual(graph.dependencies['/pages/layout.plim'], {'/base.plim', '/lib.plim'})
+        self.assertEqual(graph.dependents['/pages/layout.plim'], {'/pages/index.plim'})
+        self.assertEqual(
+            graph.affected(['/lib.plim']),
+            {'/lib.plim', '/pages/layout.plim', '/pages/index.plim'}
+        )
+        self.assertEqual(graph.affected(['/other.plim']), {'/other.plim'})
+
+        graph.update('/pages/index.plim', 'p no inheritance')
+        self.assertEqual(graph.affected(['/lib.plim']), {'/lib.plim', '/pages/layout.plim'})
+        self.assertNotIn('/pages/layout.plim', graph.dependents)
+
+        graph.update('/other.plim', '-incorrect_directive')
+        self.assertIn('/other.plim', graph.errors)
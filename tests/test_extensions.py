@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+
+from plim import extensions
+from plim import lexer
+from plim import syntax
+from . import TestCaseBase
+
+
+def upper_to_html(source):
+    return '<pre>{}</pre>'.format(source.strip().upper())
+
+
+class TestMarkupLanguages(TestCaseBase):
+
+    def test_lazy_imports(self):
+        code = 'import sys, plim; print(" ".join(m for m in ("markdown2", "docutils", "coffeescript", "scss", "stylus") if m in sys.modules))'
+        output = subprocess.check_output([sys.executable, '-c', code]).decode('utf-8')
+        self.assertEqual(output.strip(), '')
+
+    def test_registry(self):
+        languages = extensions.MarkupLanguages(
+            {'upper': 'tests.test_extensions:upper_to_html'}, entry_point_group=None
+        )
+        self.assertIsInstance(languages._compilers['upper'], str)
+        self.assertIs(languages['upper'], upper_to_html)
+        self.assertEqual(list(languages), ['upper'])
+
+        pattern = extensions.MarkupLanguagesPattern(languages)
+        self.assertTrue(pattern.match('- upper'))
+        self.assertFalse(pattern.match('-up'))
+        languages.register('up', upper_to_html)
+        self.assertEqual(pattern.match('-up').group('lang'), 'up')
+        self.assertEqual(pattern.match('-upper').group('lang'), 'upper')
+        del languages['up']
+        del languages['upper']
+        self.assertFalse(pattern.match('-upper'))
+
+    def test_registered_language(self):
+        lexer.MARKUP_LANGUAGES.register('upper', upper_to_html, 'Plim')
+        self.addCleanup(lexer.MARKUP_LANGUAGES.__delitem__, 'upper')
+        result = lexer.compile_plim_source('div\n  -upper\n    text', syntax.Mako())
+        self.assertEqual(result, '<div><pre>TEXT</pre></div>')
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from plim import preprocessor_factory
+from plim import syntax
+from plim.incremental import IncrementalCompiler, segment_starts
+from plim.lexer import SourceCursor, compile_plim_source
+from . import TestCaseBase
+
+
+class TestIncrementalCompiler(TestCaseBase):
+
+    def setUp(self):
+        super(TestIncrementalCompiler, self).setUp()
+        self.syntax = syntax.Mako()
+
+    def check_compile(self, compiler, source):
+        self.assertEqual(compiler.compile(source), compile_plim_source(source, self.syntax))
+        self.assertEqual(compiler.compile(source, False), compile_plim_source(source, self.syntax, False))
+
+    def test_segment_starts(self):
+        source = SourceCursor('-if x\n  p\n-elif y\n  p\n\n-else\n  p\ndiv\n-try\n  p\n-except:\n  p\nspan')
+        self.assertEqual(segment_starts(source, self.syntax), [1, 8, 9, 13])
+        self.assertEqual(segment_starts(SourceCursor(''), self.syntax), [])
+
+    def test_fixtures(self):
+        compiler = IncrementalCompiler(self.syntax)
+        for name in ('if_test.plim', 'try_test.plim', 'for_test.plim', 'def_block_test.plim', 'inline_loop_test.plim'):
+            self.check_compile(compiler, self.get_file_contents(name))
+
+    def test_changed_segment(self):
+        compiler = IncrementalCompiler(self.syntax)
+        blocks = ['div.block{}\n  p = value\n  -if x\n    b\n  -else\n    i\n'.format(i) for i in range(10)]
+        source = ''.join(blocks)
+        compiler.compile(source)
+        self.assertEqual((compiler.parsed, compiler.reused), (10, 0))
+
+        blocks[5] = 'div.changed\n  p = other\n'
+        self.assertEqual(compiler.compile(''.join(blocks)), compile_plim_source(''.join(blocks), self.syntax))
+        self.assertEqual((compiler.parsed, compiler.reused), (1, 9))
+        compiler.clear()
+        self.assertEqual(len(compiler), 0)
+
+    def test_continuations(self):
+        compiler = IncrementalCompiler(self.syntax)
+        sources = [
+            '-if x\n  p a\n-elif y\n  p b\n-else\n  p c\np d',
+            '-try\n  p a\n-except Exception:\n  p b\n-finally\n  p c\np d',
+            'div(a=1\nb=2) text\np next',
+            'p = func(a,\\\nb)\np next',
+            '| text \\\ncontinued\np next',
+        ]
+        for source in sources:
+            self.check_compile(compiler, source)
+            # the first line is changed, and the rest is reused where it is possible
+            self.check_compile(compiler, 'span\n' + source)
+            self.check_compile(compiler, source + '\np appended')
+
+        # a block that ended at the end of the source may take the lines that are appended to it
+        compiler.compile('p first\n| text \\\n')
+        source = 'p first\n| text \\\ncontinued\n'
+        self.assertEqual(compiler.compile(source), compile_plim_source(source, self.syntax))
+        self.assertEqual((compiler.parsed, compiler.reused), (2, 1))
+
+    def test_preprocessor(self):
+        source = self.get_file_contents('if_test.plim')
+        preprocessor = preprocessor_factory(segment_cache_size=100)
+        self.assertEqual(preprocessor(source), preprocessor_factory()(source))
+        self.assertTrue(preprocessor.compiler.parsed)
+        self.assertEqual(preprocessor(source), preprocessor_factory()(source))
+        self.assertEqual(preprocessor.compiler.parsed, 0)
+
+        preprocessor = preprocessor_factory(segment_cache_size=100, cache_size=10)
+        self.assertEqual(preprocessor(source), preprocessor_factory()(source))
+        self.assertTrue(len(preprocessor.compiler))
+        self.assertRaises(ValueError, IncrementalCompiler, self.syntax, 0)
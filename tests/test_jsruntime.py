@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import shutil
+import threading
+import unittest
+
+from plim import errors
+from plim import jsruntime
+from . import TestCaseBase
+
+
+SCRIPT = '''
+function add(a, b) { return a + b; }
+var counter = {value: 0, next: function () { return ++this.value; }};
+function fail() { throw new Error('failed'); }
+function spin() { while (true) {} }
+'''
+
+
+@unittest.skipIf(shutil.which('node') is None, 'node is not available')
+class TestJSRuntimePool(TestCaseBase):
+
+    def setUp(self):
+        super(TestJSRuntimePool, self).setUp()
+        self.pool = jsruntime.JSRuntimePool(size=2)
+        self.addCleanup(self.pool.close)
+        self.pool.define('test', SCRIPT)
+
+    def test_call(self):
+        self.assertEqual(self.pool.call('test', 'add', 1, 2), 3)
+        self.assertEqual(self.pool.call('test', 'add', u'абв', 'г'), u'абвг')
+        # the context of the script lives as long as the process
+        self.assertEqual(self.pool.call('test', 'counter.next'), 1)
+        self.assertEqual(self.pool.call('test', 'counter.next'), 2)
+        self.assertRaises(errors.JavaScriptError, self.pool.call, 'test', 'fail')
+        self.assertRaises(KeyError, self.pool.call, 'unknown', 'add')
+        self.assertRaises(ValueError, jsruntime.JSRuntimePool, 0)
+
+    def test_concurrent_calls(self):
+        results = {}
+
+        def worker(i):
+            results[i] = self.pool.call('test', 'add', i, i)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict((i, i * 2) for i in range(8)))
+        self.assertLessEqual(len(self.pool._workers), 2)
+
+    def test_restart(self):
+        self.assertEqual(self.pool.call('test', 'add', 1, 2), 3)
+        for worker in self.pool._workers:
+            worker.process.kill()
+            worker.process.wait()
+        self.assertEqual(self.pool.call('test', 'add', 2, 2), 4)
+        self.assertEqual(self.pool.restarts, 1)
+
+    def test_timeout(self):
+        self.pool.timeout = 0.5
+        self.assertEqual(self.pool.call('test', 'add', 1, 2), 3)
+        with self.assertRaises(errors.JavaScriptError) as cm:
+            self.pool.call('test', 'spin')
+        self.assertIn('0.5 seconds', str(cm.exception))
+        self.assertEqual(self.pool.restarts, 1)
+        self.assertEqual(self.pool.call('test', 'add', 2, 2), 4)
+
+    def test_interrupted_call(self):
+        self.pool = jsruntime.JSRuntimePool(size=1)
+        self.addCleanup(self.pool.close)
+        self.pool.define('test', SCRIPT)
+        self.assertEqual(self.pool.call('test', 'add', 1, 2), 3)
+        worker = self.pool._workers[0]
+        original_request = worker.request
+
+        def interrupted_request(request, timeout=None):
+            worker.stdin.write(b'{"op": "call", "name": "test", "function": "add", "args": [0, 0]}\n')
+            worker.stdin.flush()
+            raise KeyboardInterrupt
+
+        worker.request = interrupted_request
+        self.assertRaises(KeyboardInterrupt, self.pool.call, 'test', 'add', 2, 2)
+        worker.request = original_request
+        # the response to the interrupted call is not taken for the response to the next one
+        self.assertEqual(self.pool.call('test', 'add', 3, 3), 6)
+        self.assertEqual(self.pool.restarts, 1)
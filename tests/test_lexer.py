@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
+import io
+import itertools
+import re
+from unittest import mock
+
 from plim import lexer as l
+from plim import nodes
 from plim import syntax
-from plim.errors import PlimSyntaxError, ParserNotFound
+from plim import preprocessor_factory
+from plim.errors import PlimSyntaxError, ParserNotFound, CompileLimitExceeded
 from . import TestCaseBase
 
 
@@ -23,6 +30,37 @@ class TestLexerFunctions(TestCaseBase):
         self.assertRaises(ParserNotFound, l.search_parser, 1, "-icorrect_directive", self.mako_syntax)
 
 
+    def test_parsers_dispatch_index(self):
+        def linear_search(line, syntax):
+            for template, parser in syntax.parsers:
+                if template.match(line):
+                    return parser
+            return None
+
+        custom_syntax = syntax.Mako([(re.compile('(?:/!)?'), None)])
+        lines = ['', ' ', '-', 'ſtyle', 'Style', u'абв'] + [
+            l.scan_line(line)[1]
+            for name in ('if_test.plim', 'python_test.plim', 'embedded_test.plim', 'call_test.plim')
+            for line in self.get_file_contents(name).split('\n')
+        ]
+        for syntax_ in (self.mako_syntax, syntax.Django(), custom_syntax):
+            for line in lines:
+                candidates = syntax_.parsers_for(line)
+                found = next((parser for template, parser in candidates if template.match(line)), None)
+                self.assertEqual(found, linear_search(line, syntax_))
+
+        # parsers with unknown leading characters are tried against every line
+        self.assertEqual(custom_syntax.parsers_for('div')[0], custom_syntax.parsers[0])
+        # only ASCII leading characters are memoized
+        index_size = len(self.mako_syntax.parsers_index)
+        self.assertEqual(self.mako_syntax.parsers_for(u'Я'), self.mako_syntax.parsers_for(u'Ж'))
+        self.assertEqual(len(self.mako_syntax.parsers_index), index_size)
+
+        # the pattern of markup languages is indexed by its leading character
+        self.assertNotIn(l.parse_markup_languages, [parser for _, parser in self.mako_syntax.parsers_for('div')])
+        self.assertIn(l.parse_markup_languages, [parser for _, parser in self.mako_syntax.parsers_for('-')])
+
+
     def test_control_re(self):
         m = self.syntax.PARSE_STATEMENTS_RE.match("- if 1")
         assert m.group('expr') == ' 1'
@@ -51,6 +89,17 @@ class TestLexerFunctions(TestCaseBase):
         self.assertIsNone(l.search_quotes('"""test'))
         self.assertIsNone(l.search_quotes("'''test"))
 
+        self.assertEqual(l.search_quotes(r"'\\\''"), 6)
+        self.assertEqual(l.search_quotes(r'"""a\"""b"""'), 12)
+        self.assertIsNone(l.search_quotes(r'"""a\"""'))
+
+        # search from the middle of a line
+        self.assertEqual(l.search_quotes('attr="test" tail', pos=5), 11)
+        self.assertIsNone(l.search_quotes('attr="test" tail', pos=4))
+
+        long_value = '"{}"'.format('\\" ' * 10000)
+        self.assertEqual(l.search_quotes(long_value), len(long_value))
+
 
     def test_extract_mako_expression(self):
         str_ = '${x}'
@@ -126,6 +175,28 @@ class TestLexerFunctions(TestCaseBase):
         self.assertEqual(str_[:len(result)], u'.абв')
 
 
+    def test_extract_ident_multiline(self):
+        source = l.enumerate_source('b,\n  c)}.class')
+        result, tail, _ = l.extract_identifier('.${fn(a,\n', source, '.')
+        self.assertEqual(result, '.${fn(a,b,c)}')
+        self.assertEqual(tail, '.class')
+
+
+    def test_long_lines(self):
+        values = ['v{}'.format(i) for i in range(5000)]
+        source = 'div data-x="{}" {} = fn({})'.format(
+            ' '.join(values),
+            ' '.join('a{}=({})'.format(i, v) for i, v in enumerate(values)),
+            ', '.join(values)
+        )
+        result = l.compile_plim_source(source, self.mako_syntax)
+        self.assertEqual(result, '<div data-x="{}" {}>${{fn({})}}</div>'.format(
+            ' '.join(values),
+            ' '.join('a{}="${{{}}}"'.format(i, v) for i, v in enumerate(values)),
+            ', '.join(values)
+        ))
+
+
     def test_parse_tag_attribute(self):
         def assert_this(str_, parentheses, attr_, tail):
             source = l.enumerate_source('')
@@ -384,16 +455,145 @@ class TestLexerFunctions(TestCaseBase):
     def test_explicit_literal(self):
         result, _, __, ___ = l.parse_explicit_literal_with_embedded_markup(
             0, "| Test", None, l.enumerate_source(""), self.mako_syntax)
-        assert result == "Test"
+        assert self.mako_syntax.emit(result) == "Test"
 
         result, _, __, ___ = l.parse_explicit_literal_with_embedded_markup(
             0, ", Test", None, l.enumerate_source(""), self.mako_syntax)
-        assert result == "Test "
+        assert self.mako_syntax.emit(result) == "Test "
 
         result, _, __, ___ = l.parse_explicit_literal_with_embedded_markup(
             0, ",Test\n Test", None, l.enumerate_source(""), self.mako_syntax)
-        assert result == "Test\n Test "
+        assert self.mako_syntax.emit(result) == "Test\n Test "
+
+
+    def test_parse_embedded_snippet(self):
+        mako = syntax.Mako()
+        self.assertTrue(l.has_parser('a href="#" link', mako))
+        self.assertFalse(l.has_parser('*not plim*', mako))
+        self.assertIsNone(l.parse_embedded_snippet('*not plim*', mako))
+        # the first line is valid, but the nested one is not
+        self.assertIsNone(l.parse_embedded_snippet('b: *x', mako))
+
+        source = 'p `a href="#" link`_ and `*x*` `a href="#" link`'
+        result = l.compile_plim_source(source, mako)
+        self.assertEqual(result, '<p><a href="#">link</a> and `*x*` <a href="#">link</a></p>')
+        info = mako.parse_embedded_snippet.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 2))
+        self.assertEqual(l.compile_plim_source(source, mako), result)
+        self.assertEqual(mako.parse_embedded_snippet.cache_info().misses, 2)
+
+
+    def test_source_cursor(self):
+        source = l.enumerate_source('a\n  b\n\nc')
+        self.assertEqual(source.line_count, 4)
+        self.assertEqual(source.lineno, 0)
+        self.assertEqual(source.peek(), 'a\n')
+        self.assertEqual(source.advance(), 'a\n')
+        self.assertEqual(source.lineno, 1)
+        self.assertEqual(source.line(2), '  b\n')
+        self.assertEqual(source.line(4), 'c')
+        self.assertRaises(IndexError, source.line, 5)
+        self.assertEqual(list(source), [(2, '  b\n'), (3, '\n'), (4, 'c')])
+        self.assertEqual(source.advance(), None)
+        self.assertEqual(source.peek(), None)
+        source.jump(2)
+        self.assertEqual(source.advance(), '  b\n')
+        self.assertEqual(l.enumerate_source('').line_count, 0)
+        self.assertEqual(l.enumerate_source('a\n').line_count, 1)
+
+    def test_source_cursor_indents(self):
+        text = 'a\n  b  \n \n    c\n d\n\te'
+        for source in (l.enumerate_source(text), l.StreamSourceCursor(io.StringIO(text))):
+            self.assertEqual([source.indent(n) for n in range(1, 7)], [0, 2, -1, 4, 1, 1])
+            self.assertEqual(source.scan_next(), (0, 'a'))
+            self.assertEqual(source.find_dedent(1), 5)
+            self.assertEqual(source.find_dedent(0), 7)
+            self.assertEqual(source.lineno, 1)
+            self.assertEqual(
+                [source.scan_next() for _ in range(6)],
+                [(2, 'b  '), (0, ''), (4, 'c'), (1, 'd'), (1, 'e'), (None, None)]
+            )
+            for line in text.split('\n'):
+                self.assertEqual(l.scan_line(line)[1], l.enumerate_source(line).scan_next()[1])
+
+    def test_unexpected_end_of_source(self):
+        self.assertRaises(PlimSyntaxError, l.compile_plim_source, 'div(a=1\n  b=2', self.mako_syntax)
+        self.assertRaises(PlimSyntaxError, l.compile_plim_source, 'div = func(a,\n  b', self.mako_syntax)
+
+    def test_parse_plim_source(self):
+        tree = l.parse_plim_source('-if x\n  a#link.btn href=url = title\n-else\n  | none', self.mako_syntax)
+        expected = nodes.Fragment([
+            nodes.Statement('if', 'x', [
+                nodes.Tag('a', [
+                    nodes.Attr('href', [nodes.Expr('url')]),
+                    nodes.Attr('id', ['link']),
+                    nodes.Attr('class', ['btn']),
+                ], [nodes.Expr('title')])
+            ], [
+                nodes.Clause('else', None, [nodes.Fragment([nodes.Text('none')])])
+            ])
+        ])
+        self.assertEqual(tree, expected)
+
+        mako_result = '%if x:\n<a href="${url}" id="link" class="btn">${title}</a>\n%else:\nnone\n%endif'
+        self.assertEqual(self.mako_syntax.emit(tree).strip(), mako_result)
+        django_result = '{% if x %}\n<a href="{{url}}" id="link" class="btn">{{title}}</a>\n{% else %}\nnone\n{% endif %}'
+        self.assertEqual(syntax.Django().emit(tree).strip(), django_result)
+
+    def test_emit_deeply_nested_tree(self):
+        tree = nodes.Text('x')
+        for _ in range(5000):
+            tree = nodes.Tag('b', children=[tree])
+        self.assertEqual(self.mako_syntax.emit(tree), '<b>' * 5000 + 'x' + '</b>' * 5000)
+
+    def test_parse_deeply_nested_source(self):
+        depth = 3000
+        template = '\n'.join(' ' * i + 'b' for i in range(depth)) + '\n' + ' ' * depth + '| x'
+        self.assertEqual(l.compile_plim_source(template, self.mako_syntax), '<b>' * depth + 'x' + '</b>' * depth)
+
+        template = 'b: ' * depth + '| x'
+        self.assertEqual(l.compile_plim_source(template, self.mako_syntax), '<b>' * depth + 'x' + '</b>' * depth)
+
+        template = '\n'.join(' ' * i + '-if x' for i in range(depth)) + '\n' + ' ' * depth + '| x'
+        self.assertEqual(
+            l.compile_plim_source(template, self.mako_syntax),
+            ('%if x:\n' + '\n%if x:\n' * (depth - 1) + 'x\n%endif\n' + '\n%endif\n' * (depth - 1)).strip()
+        )
 
+    def test_compile_limits(self):
+        template = 'div\n  p\n    b = x\n  p ' + 'y' * 100 + '\n'
+        limits = l.Limits(max_source_size=len(template), max_line_length=104, max_depth=3, timeout=60)
+        self.assertEqual(l.compile_plim_source(template, self.mako_syntax, limits=limits),
+                         l.compile_plim_source(template, self.mako_syntax))
+
+        for limits, limit, lineno in (
+            (l.Limits(max_source_size=10), 'max_source_size', 3),
+            (l.Limits(max_line_length=100), 'max_line_length', 4),
+            (l.Limits(max_depth=2), 'max_depth', 3),
+            (l.Limits(timeout=0), 'timeout', 1),
+        ):
+            with self.assertRaises(CompileLimitExceeded) as cm:
+                l.compile_plim_source(template, self.mako_syntax, limits=limits)
+            self.assertEqual((cm.exception.limit, cm.exception.lineno), (limit, lineno))
+            self.assertIn('at line {}'.format(lineno), str(cm.exception))
+            # lines of a file object are checked as they are read
+            with self.assertRaises(CompileLimitExceeded) as cm:
+                l.compile_stream(io.StringIO(template), [].append, self.mako_syntax, limits=limits)
+            self.assertEqual((cm.exception.limit, cm.exception.lineno), (limit, lineno))
+
+        # the timeout is checked between the nested blocks of a single line too
+        ticks = itertools.count()
+        with mock.patch.object(l.time, 'perf_counter', lambda: next(ticks)):
+            with self.assertRaises(CompileLimitExceeded) as cm:
+                l.compile_plim_source('div: ' * 50 + 'x', self.mako_syntax, limits=l.Limits(timeout=20))
+        self.assertEqual((cm.exception.limit, cm.exception.lineno), ('timeout', 1))
+
+        preprocessor = preprocessor_factory(limits=l.Limits(max_depth=2), cache_size=10)
+        self.assertRaises(CompileLimitExceeded, preprocessor, template)
+        self.assertRaises(CompileLimitExceeded, preprocessor.stream, io.StringIO(template), [].append)
+        preprocessor = preprocessor_factory(limits=l.Limits(max_depth=2), segment_cache_size=10)
+        self.assertRaises(CompileLimitExceeded, preprocessor, template)
+        self.assertEqual(preprocessor('div\n  p'), '<div><p></p></div>')
 
     def test_multiline_extract_plim_line(self):
         def test_case(template, result):
@@ -442,20 +642,20 @@ class TestLexerFunctions(TestCaseBase):
 
     def test_parse_embedded_markup(self):
         result = l._parse_embedded_markup("this is a `test`", self.mako_syntax)
-        self.assertEqual(result, "this is a <test></test>")
+        self.assertEqual(self.mako_syntax.emit(result), "this is a <test></test>")
 
         self.assertRaises(PlimSyntaxError, l._parse_embedded_markup, "this is a `test", self.mako_syntax)
 
         result = l._parse_embedded_markup("this is a ``test", self.mako_syntax)
-        self.assertEqual(result, "this is a `test")
+        self.assertEqual(self.mako_syntax.emit(result), "this is a `test")
 
         self.assertRaises(PlimSyntaxError, l._parse_embedded_markup, "this is a ```test", self.mako_syntax)
 
         result = l._parse_embedded_markup("this is a ````test", self.mako_syntax)
-        self.assertEqual(result, "this is a ``test")
+        self.assertEqual(self.mako_syntax.emit(result), "this is a ``test")
 
         result = l._parse_embedded_markup("this is a `recursive Test ``recursive Test```test", self.mako_syntax)
-        self.assertEqual(result, "this is a <recursive>Test <recursive>Test</recursive></recursive>test")
+        self.assertEqual(self.mako_syntax.emit(result), "this is a <recursive>Test <recursive>Test</recursive></recursive>test")
 
 
     def test_parse_markdown(self):
@@ -464,7 +664,7 @@ class TestLexerFunctions(TestCaseBase):
         _, line = next(source)
         result = self.get_file_contents('markdown_result.mako')
         data, _, __, ___ = l.parse_markup_languages(0, '', self.mako_syntax.PARSE_EXTENSION_LANGUAGES_RE.match(line), source, self.mako_syntax)
-        self.assertEqual(data.strip(), result.strip())
+        self.assertEqual(self.mako_syntax.emit(data).strip(), result.strip())
 
 
     def test_parse_rst(self):
@@ -473,7 +673,7 @@ class TestLexerFunctions(TestCaseBase):
         _, line = next(source)
         result = self.get_file_contents('reST_result.mako')
         data, _, __, ___ = l.parse_markup_languages(0, '', self.mako_syntax.PARSE_EXTENSION_LANGUAGES_RE.match(line), source, self.mako_syntax)
-        self.assertEqual(data.strip(), result.strip())
+        self.assertEqual(self.mako_syntax.emit(data).strip(), result.strip())
 
 
     def test_sass(self):
@@ -482,7 +682,7 @@ class TestLexerFunctions(TestCaseBase):
         _, line = next(source)
         result = self.get_file_contents('scss_result.mako')
         data, _, __, ___ = l.parse_markup_languages(0, '', self.mako_syntax.PARSE_EXTENSION_LANGUAGES_RE.match(line), source, self.mako_syntax)
-        self.assertEqual(data.strip(), result.strip())
+        self.assertEqual(self.mako_syntax.emit(data).strip(), result.strip())
 
         
     def test_coffee(self):
@@ -496,7 +696,7 @@ class TestLexerFunctions(TestCaseBase):
             self.mako_syntax.PARSE_EXTENSION_LANGUAGES_RE.match(line),
             source,
             self.mako_syntax)
-        self.assertEqual(data.strip(), result.strip())
+        self.assertEqual(self.mako_syntax.emit(data).strip(), result.strip())
         
         
     def test_stylus(self):
@@ -505,4 +705,4 @@ class TestLexerFunctions(TestCaseBase):
         _, line = next(source)
         result = self.get_file_contents('stylus_result.mako')
         data, _, __, ___ = l.parse_markup_languages(0, '', self.mako_syntax.PARSE_EXTENSION_LANGUAGES_RE.match(line), source, self.mako_syntax)
-        self.assertEqual(data.strip(), result.strip())
\ No newline at end of file
+        self.assertEqual(self.mako_syntax.emit(data).strip(), result.strip())
\ No newline at end of file
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import tracemalloc
+
+from plim import errors, lexer, syntax
+from plim.memory import MemoryMonitor, measure
+from . import TestCaseBase
+
+
+class TestMemoryMonitor(TestCaseBase):
+
+    def setUp(self):
+        super(TestMemoryMonitor, self).setUp()
+        self.syntax = syntax.Mako()
+        self.source = '\n'.join(
+            'div.item-{0}\n  -for x in range({0})\n    span = x'.format(i) for i in range(200)
+        )
+
+    def test_measure(self):
+        expected = lexer.compile_plim_source(self.source, self.syntax)
+        result, report = measure(self.source, self.syntax, top=3)
+        self.assertEqual(result, expected)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertTrue(report['peak'] > 0)
+        self.assertTrue(report['live_blocks'] > 0)
+        self.assertIsNone(report['budget'])
+        self.assertEqual(len(report['sites']), 3)
+        sizes = [site['size'] for site in report['sites']]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertTrue(all(site['line'] and site['count'] for site in report['sites']))
+
+    def test_budget(self):
+        parsers = self.syntax.parsers
+        with self.assertRaises(errors.MemoryBudgetExceeded) as cm:
+            measure(self.source, self.syntax, budget=1024)
+        self.assertEqual(cm.exception.budget, 1024)
+        self.assertTrue(cm.exception.allocated > 1024)
+        self.assertTrue(cm.exception.lineno >= 1)
+        self.assertIn('over the memory budget of 1024 bytes at line', str(cm.exception))
+        self.assertIs(self.syntax.parsers, parsers)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        _, report = measure(self.source, self.syntax, budget=64 * 1024 * 1024)
+        self.assertTrue(report['peak'] < report['budget'])
+
+    def test_tracing_already(self):
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        with MemoryMonitor(self.syntax) as monitor:
+            lexer.compile_plim_source(self.source, self.syntax)
+        self.assertTrue(tracemalloc.is_tracing())
+        self.assertTrue(monitor.peak > 0)
+        self.assertIn('peak memory', monitor.format_report())
+        self.assertIn('live blocks at peak', monitor.format_report())
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import re
+
+from plim import lexer, syntax
+from plim.profiling import Profiler, profile
+from . import TestCaseBase
+
+
+def parse_greeting(indent_level, current_line, matched, source, syntax):
+    return 'Hello, {}!'.format(matched.group('name')), indent_level, '', source
+
+
+class TestProfiler(TestCaseBase):
+
+    def setUp(self):
+        super(TestProfiler, self).setUp()
+        self.syntax = syntax.Mako([(re.compile(r'hello (?P<name>\w+)'), parse_greeting)])
+        self.source = self.get_file_contents('for_test.plim') + '\nhello world\n'
+
+    def test_profile(self):
+        expected = lexer.compile_plim_source(self.source, self.syntax)
+        result, report = profile(self.source, self.syntax)
+        self.assertEqual(result, expected)
+
+        parsers = dict((row['name'], row) for row in report['parsers'])
+        self.assertEqual(parsers['parse_statements']['calls'], 7)
+        self.assertEqual(parsers['parse_statements']['match_hits'], 7)
+        self.assertTrue(parsers['parse_statements']['seconds'] > parsers['parse_statements']['own_seconds'])
+        greeting = parsers['tests.test_profiling.parse_greeting']
+        self.assertEqual((greeting['calls'], greeting['match_hits']), (1, 1))
+        self.assertEqual(greeting['pattern'], r'hello (?P<name>\w+)')
+        self.assertTrue(greeting['match_attempts'] >= greeting['match_hits'])
+        self.assertEqual(report['parsers'], sorted(report['parsers'], key=lambda row: -row['seconds']))
+        self.assertEqual(report['lookups'], sum(row['calls'] for row in report['parsers']))
+
+    def test_enable_disable(self):
+        parsers = self.syntax.parsers
+        block_parsers = dict(lexer._BLOCK_PARSERS)
+        profiler = Profiler(self.syntax)
+        with profiler:
+            self.assertIsNot(self.syntax.parsers, parsers)
+            lexer.compile_plim_source(self.source, self.syntax)
+        self.assertIs(self.syntax.parsers, parsers)
+        self.assertEqual(lexer._BLOCK_PARSERS, block_parsers)
+        self.assertNotIn('parsers_for', vars(self.syntax))
+
+        # counters are accumulated until reset
+        lookups = profiler.lookups
+        lexer.compile_plim_source(self.source, self.syntax)
+        self.assertEqual(profiler.lookups, lookups)
+        with profiler:
+            lexer.compile_plim_source(self.source, self.syntax)
+        self.assertEqual(profiler.lookups, lookups * 2)
+        self.assertIn('parse_statements', profiler.format_report())
+        profiler.reset()
+        self.assertEqual(profiler.lookups, 0)
+        self.assertTrue(all(row['calls'] == 0 for row in profiler.report()['parsers']))
+
+    def test_markup_languages(self):
+        self.syntax.markup_caches = ()
+        _, report = profile(self.get_file_contents('markdown_test.plim'), self.syntax)
+        self.assertEqual([(row['name'], row['calls']) for row in report['markup_languages']], [('markdown', 1)])
+        self.assertIs(self.syntax.markup_languages, lexer.MARKUP_LANGUAGES)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import codecs
+import os
+import shutil
+import tempfile
+
+from plim import preprocessor
+from plim.deps import iter_template_uris
+from plim.watch import Watcher
+from . import TestCaseBase
+
+
+class TestWatcher(TestCaseBase):
+
+    def setUp(self):
+        super(TestWatcher, self).setUp()
+        self.source_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir)
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        os.mkdir(os.path.join(self.source_dir, 'pages'))
+        self.write('base.plim', 'html = next.body()')
+        self.write('pages/index.plim', '-inherit /base.plim\np index')
+        self.write('pages/about.plim', 'p about')
+
+    def write(self, name, content):
+        path = os.path.join(self.source_dir, *name.split('/'))
+        with codecs.open(path, 'w', 'utf-8') as f:
+            f.write(content)
+        # make sure that the change is visible even with coarse modification times
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def read_output(self, name):
+        with codecs.open(os.path.join(self.output_dir, *name.split('/')), 'r', 'utf-8') as f:
+            return f.read()
+
+    def test_watcher(self):
+        watcher = Watcher(self.source_dir, self.output_dir, preprocessor)
+        rebuild = watcher.start()
+        self.assertEqual(rebuild.compiled, ['/base.plim', '/pages/about.plim', '/pages/index.plim'])
+        self.assertEqual(rebuild.written, 3)
+        self.assertEqual(self.read_output('pages/about.mako'), '<p>about</p>')
+        self.assertEqual(watcher.poll(), set())
+
+        # dependents of a changed template are recompiled too
+        self.write('base.plim', 'body = next.body()')
+        changed = watcher.poll()
+        self.assertEqual(changed, {'/base.plim'})
+        rebuild = watcher.rebuild(changed)
+        self.assertEqual(rebuild.compiled, ['/base.plim', '/pages/index.plim'])
+        self.assertEqual(rebuild.written, 1)
+
+        self.write('pages/new.plim', 'p = broken(')
+        os.remove(os.path.join(self.source_dir, 'pages', 'about.plim'))
+        changed = watcher.poll()
+        self.assertEqual(changed, {'/pages/new.plim', '/pages/about.plim'})
+        rebuild = watcher.rebuild(changed)
+        self.assertEqual(rebuild.compiled, ['/pages/new.plim'])
+        self.assertEqual(rebuild.removed, 1)
+        self.assertEqual(list(rebuild.failed), ['/pages/new.plim'])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'pages', 'about.mako')))
+
+    def test_symlinks(self):
+        if not hasattr(os, 'symlink'):
+            return
+        # a link to an ancestor directory and a cycle of links
+        os.symlink(self.source_dir, os.path.join(self.source_dir, 'pages', 'root'))
+        os.symlink('loop_b.plim', os.path.join(self.source_dir, 'loop_a.plim'))
+        os.symlink('loop_a.plim', os.path.join(self.source_dir, 'loop_b.plim'))
+        watcher = Watcher(self.source_dir, self.output_dir, preprocessor)
+        self.assertEqual(sorted(watcher.scan()), ['/base.plim', '/pages/about.plim', '/pages/index.plim'])
+        self.assertEqual(
+            sorted(set(iter_template_uris(self.source_dir)) - {'/loop_a.plim', '/loop_b.plim'}),
+            sorted(watcher.scan())
+        )
+
+    def test_run(self):
+        rebuilds = []
+        watcher = Watcher(self.source_dir, self.output_dir, preprocessor)
+        watcher.run(rebuilds.append, max_rebuilds=0)
+        self.assertEqual(len(rebuilds), 1)
+        self.assertEqual(len(rebuilds[0].compiled), 3)